@@ -0,0 +1,76 @@
+"""
+Define the cache entries invalidated all at once by changing a version.
+
+Each entry is stored with the versions it was computed for, so that the
+versions and the entries are read together with one get_many: a hit costs a
+single round trip to the cache, a query with the database cache.
+"""
+import uuid
+
+from django.core.cache import cache
+
+
+def get_versioned_many(keys, version_keys):
+    """
+    Return the current versions and the entries computed for them.
+
+    A new random version is set when a version key is missing (first use or
+    cleared cache), so that entries stored before are never trusted.
+
+    :param keys: keys of the entries, mandatory.
+    :param version_keys: keys of the versions the entries depend on,
+    mandatory.
+    :type keys: list of strings
+    :type version_keys: list of strings
+    :returns: (versions, {key: entry}) without the missing or outdated
+    entries, versions to give to set_versioned_many.
+    :rtype: tuple
+    """
+    values = cache.get_many(list(version_keys) + list(keys))
+    versions = []
+    for version_key in version_keys:
+        version = values.pop(version_key, None)
+        if version is None:
+            cache.add(version_key, uuid.uuid4().hex, None)
+            version = cache.get(version_key)
+        versions.append(version)
+    versions = tuple(versions)
+    return versions, {key: value for key, (entry_versions, value) in values.items()
+                      if entry_versions == versions}
+
+
+def get_versioned(key, version_keys):
+    """
+    Return the current versions and the entry computed for them, None if it
+    is missing or outdated. See get_versioned_many.
+    """
+    versions, entries = get_versioned_many([key], version_keys)
+    return versions, entries.get(key)
+
+
+def set_versioned_many(entries, versions, timeout):
+    """
+    Store entries computed for the versions returned by get_versioned_many.
+
+    :param entries: {key: entry}, mandatory.
+    :param versions: versions returned by get_versioned_many, mandatory.
+    :param timeout: timeout of the entries, in seconds.
+    :type entries: dict
+    :type versions: tuple
+    :type timeout: integer
+    """
+    cache.set_many({key: (versions, value) for key, value in entries.items()}, timeout)
+
+
+def set_versioned(key, versions, value, timeout):
+    """
+    Store an entry computed for the versions returned by get_versioned.
+    """
+    set_versioned_many({key: value}, versions, timeout)
+
+
+def bump_version(version_key):
+    """
+    Invalidate all the entries depending on the version.
+    """
+    cache.set(version_key, uuid.uuid4().hex, None)
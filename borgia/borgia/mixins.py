@@ -2,7 +2,10 @@ from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
 from django.views.generic.base import ContextMixin
 
-from borgia.utils import (ACCEPTED_MENU_TYPES, is_association_manager,
+from borgia.cache import get_versioned, set_versioned
+from borgia.utils import (ACCEPTED_MENU_TYPES, LATERAL_MENU_CACHE_TIMEOUT,
+                          LATERAL_MENU_VERSION_KEYS,
+                          get_lateral_menu_cache_key, is_association_manager,
                           managers_lateral_menu, members_lateral_menu,
                           simple_lateral_link)
 from shops.utils import get_shops_tree, shops_lateral_menu
@@ -57,7 +60,7 @@ class LateralMenuMixin(ContextMixin):
                 return shops_lateral_menu(nav_tree, self.request.user, self.shop)
 
 
-    def get_menu(self):
+    def build_menu(self):
         """
         Override it with your custom menu.
         As a base, only add the main sections, depending on the user.
@@ -98,7 +101,20 @@ class LateralMenuMixin(ContextMixin):
 
             nav_tree.append(management_tree)
 
-        nav_tree = self.get_specific_menu(nav_tree)
+        return self.get_specific_menu(nav_tree)
+
+    def get_menu(self):
+        """
+        Return the menu built by build_menu, cached per user, with the active
+        link set.
+        """
+        menu_type = self.get_menu_type()
+        shop = getattr(self, 'shop', None) if menu_type == 'shops' else None
+        cache_key = get_lateral_menu_cache_key(self.request.user, menu_type, shop)
+        versions, nav_tree = get_versioned(cache_key, LATERAL_MENU_VERSION_KEYS)
+        if nav_tree is None:
+            nav_tree = self.build_menu()
+            set_versioned(cache_key, versions, nav_tree, LATERAL_MENU_CACHE_TIMEOUT)
 
         if self.lm_active is not None:
             for link in nav_tree:
@@ -1,11 +1,16 @@
 from django.contrib.auth import get_user
 from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import NoReverseMatch, reverse
 
 from borgia.settings import LOGIN_REDIRECT_URL, LOGIN_URL
 from borgia.tests.utils import get_login_url_redirected
-from borgia.utils import EXTERNALS_GROUP_NAME, INTERNALS_GROUP_NAME, PRESIDENTS_GROUP_NAME
+from borgia.utils import (EXTERNALS_GROUP_NAME, INTERNALS_GROUP_NAME, PRESIDENTS_GROUP_NAME,
+                          get_lateral_menu_cache_key)
+from shops.models import Shop
 from users.models import User
 
 
@@ -13,6 +18,7 @@ class BaseBorgiaViewsTestCase(TestCase):
     fixtures = ['initial', 'tests_data']
 
     def setUp(self):
+        cache.clear()
         members_group = Group.objects.get(name=INTERNALS_GROUP_NAME)
         externals_group = Group.objects.get(name=EXTERNALS_GROUP_NAME)
         presidents_group = Group.objects.get(name=PRESIDENTS_GROUP_NAME)
@@ -262,3 +268,39 @@ class ManagersWorkboardTests(BaseWorkboardsTestCase):
 
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
+
+
+class LateralMenuCacheTests(BaseWorkboardsTestCase):
+    url_view = 'url_members_workboard'
+
+    def count_queries(self, client):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(self.get_url())
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_cached_menu(self):
+        Shop.objects.create(name='menushop')
+        first_queries = self.count_queries(self.client1)
+        self.assertLess(self.count_queries(self.client1), first_queries)
+        self.assertContains(self.client1.get(self.get_url()), 'Management Menushop')
+
+    def test_invalidation_on_shop_change(self):
+        self.client1.get(self.get_url())
+        Shop.objects.create(name='menushop')
+        self.assertContains(self.client1.get(self.get_url()), 'Management Menushop')
+
+    def test_invalidation_on_groups_change(self):
+        Shop.objects.create(name='menushop')
+        self.assertNotContains(self.client2.get(self.get_url()), 'Management Menushop')
+        self.user2.groups.add(Group.objects.get(name='chiefs-menushop'))
+        self.assertContains(self.client2.get(self.get_url()), 'Management Menushop')
+
+    def test_key_depends_on_user_flags(self):
+        key = get_lateral_menu_cache_key(self.user2, 'members')
+        self.user2.is_superuser = True
+        superuser_key = get_lateral_menu_cache_key(self.user2, 'members')
+        self.assertNotEqual(superuser_key, key)
+        self.user2.is_active = False
+        self.assertNotIn(get_lateral_menu_cache_key(self.user2, 'members'),
+                         (key, superuser_key))
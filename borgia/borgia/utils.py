@@ -1,8 +1,14 @@
+import collections
+import datetime
+
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Q, prefetch_related_objects
 from django.urls import reverse
+from django.utils.timezone import utc
 
+from borgia.cache import bump_version
 from modules.models import SelfSaleModule
 from shops.models import Shop
 
@@ -13,6 +19,44 @@ PRESIDENTS_GROUP_NAME = 'presidents'
 VICE_PRESIDENTS_GROUP_NAME = 'vice_presidents'
 TREASURERS_GROUP_NAME = 'treasurers'
 ACCEPTED_MENU_TYPES = ['members', 'managers', 'shops']
+LATERAL_MENU_PERMISSIONS_VERSION_KEY = 'borgia.lateral_menu.permissions.version'
+LATERAL_MENU_SHOPS_VERSION_KEY = 'borgia.lateral_menu.shops.version'
+# Versions of the cached lateral menus: one changed each time groups or
+# permissions change, the other each time shops or modules change.
+LATERAL_MENU_VERSION_KEYS = [LATERAL_MENU_PERMISSIONS_VERSION_KEY,
+                             LATERAL_MENU_SHOPS_VERSION_KEY]
+LATERAL_MENU_CACHE_TIMEOUT = 60 * 60
+
+
+def get_lateral_menu_cache_key(user, menu_type, shop=None):
+    """
+    Return the cache key of the lateral menu of a user.
+
+    The key contains the superuser and active flags of the user, which
+    change the permissions without any group change. Menus are stored with
+    two global versions, see LATERAL_MENU_VERSION_KEYS.
+
+    :note:: The versions are shared between processes only if the cache is.
+    """
+    return 'borgia.lateral_menu.{0}.{1}.{2}.{3}.{4}'.format(
+        user.pk, int(user.is_superuser), int(user.is_active),
+        menu_type, shop.pk if shop is not None else '')
+
+
+def invalidate_lateral_menus_permissions():
+    """
+    Invalidate the lateral menus of every user, after a change of group
+    membership or permissions.
+    """
+    bump_version(LATERAL_MENU_PERMISSIONS_VERSION_KEY)
+
+
+def invalidate_lateral_menus_shops():
+    """
+    Invalidate the lateral menus of every user, after a change of a shop or
+    of a module.
+    """
+    bump_version(LATERAL_MENU_SHOPS_VERSION_KEY)
 
 
 def simple_lateral_link(label, fa_icon, id_link, url):
@@ -105,6 +149,7 @@ def managers_lateral_menu(nav_tree, user):
     - Transferts
     - Rechargings
     - ExceptionnalMovements
+    - Balance audit
     - Groups Management
     - Configuration
     """
@@ -169,6 +214,15 @@ def managers_lateral_menu(nav_tree, user):
             url=reverse('url_exceptionnalmovement_list')
         ))
 
+    # Balance audit
+    if user.has_perm('users.audit_balancemovement'):
+        nav_tree.append(simple_lateral_link(
+            label='Audit des soldes',
+            fa_icon='balance-scale',
+            id_link='lm_balance_audit',
+            url=reverse('url_balance_audit')
+        ))
+
     # Groups management
     nav_management_groups = {
         'label': 'Gestion des groupes',
@@ -402,3 +456,164 @@ def is_association_manager(user):
         return True
     else:
         return False
+
+
+def prefetch_generic_foreign_keys(objects, field_name, *lookups):
+    """
+    Load the targets of a GenericForeignKey for several objects, and attach
+    them so that reading the field does not query the database.
+
+    Objects are grouped by content type, and each target model is loaded
+    with one in_bulk query.
+
+    :param objects: objects of the same model, mandatory.
+    :param field_name: name of the GenericForeignKey, mandatory.
+    :param lookups: lookups prefetched on the targets, as for
+    prefetch_related ('shop' for Sale.module for instance).
+    :type objects: iterable of model instances
+    :type field_name: string
+    :returns: the objects
+    :rtype: list
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+
+    meta = objects[0]._meta
+    field = meta.get_field(field_name)
+    ct_attname = meta.get_field(field.ct_field).get_attname()
+
+    pks_by_content_type = collections.defaultdict(set)
+    for obj in objects:
+        content_type_id = getattr(obj, ct_attname)
+        pk = getattr(obj, field.fk_field)
+        if content_type_id is not None and pk is not None:
+            pks_by_content_type[content_type_id].add(pk)
+
+    targets = {}
+    for content_type_id, pks in pks_by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        targets[content_type_id] = model._base_manager.in_bulk(list(pks))
+        if lookups:
+            prefetch_related_objects(list(targets[content_type_id].values()), *lookups)
+
+    for obj in objects:
+        target = targets.get(getattr(obj, ct_attname), {}).get(getattr(obj, field.fk_field))
+        if target is not None:
+            field.set_cached_value(obj, target)
+    return objects
+
+
+CURSOR_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=utc)
+
+
+class KeysetPage:
+    """
+    Page of objects returned by KeysetPaginator, iterable as a Django Page.
+
+    next_cursor and previous_cursor are None when there is no next (older)
+    or previous (newer) page.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset from the most recent object, on (datetime, id).
+
+    Unlike the Django Paginator, no COUNT and no OFFSET are needed: a page
+    is read from a cursor, the position of the last (or first) object of the
+    page next to it, so every page costs the same. Cursors are strings, to
+    be passed in URLs.
+
+    :param queryset: objects to paginate, mandatory.
+    :param per_page: number of objects per page, mandatory.
+    :param field: datetime field of the order, 'datetime' by default.
+    """
+
+    def __init__(self, queryset, per_page, field='datetime'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+
+    def get_cursor(self, obj):
+        """
+        Return the cursor of the position of the object.
+        """
+        delta = getattr(obj, self.field) - CURSOR_EPOCH
+        return '{0}_{1}'.format(delta // datetime.timedelta(microseconds=1), obj.pk)
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """
+        Return the (datetime, pk) position of the cursor.
+
+        :raises: ValueError if the cursor is not valid.
+        """
+        microseconds, pk = cursor.split('_')
+        return (CURSOR_EPOCH + datetime.timedelta(microseconds=int(microseconds)),
+                int(pk))
+
+    def page(self, after=None, before=None):
+        """
+        Return the page of the objects older than the cursor after, or newer
+        than the cursor before, the first page by default or if the cursor is
+        not valid.
+
+        :param after: cursor of the previous page (next_cursor).
+        :param before: cursor of the next page (previous_cursor).
+        :type after: string
+        :type before: string
+        :rtype: KeysetPage object
+        """
+        field = self.field
+        queryset = self.queryset.order_by('-' + field, '-pk')
+        try:
+            if after:
+                moment, pk = self.parse_cursor(after)
+                queryset = queryset.filter(
+                    Q(**{field + '__lt': moment}) | Q(**{field: moment, 'pk__lt': pk}))
+            elif before:
+                moment, pk = self.parse_cursor(before)
+                queryset = queryset.filter(
+                    Q(**{field + '__gt': moment}) | Q(**{field: moment, 'pk__gt': pk})
+                ).reverse()
+        except (ValueError, OverflowError):
+            after = before = None
+            queryset = self.queryset.order_by('-' + field, '-pk')
+
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if before:
+            object_list.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(after)
+
+        next_cursor = previous_cursor = None
+        if object_list:
+            if has_next:
+                next_cursor = self.get_cursor(object_list[-1])
+            if has_previous:
+                previous_cursor = self.get_cursor(object_list[0])
+        return KeysetPage(object_list, next_cursor, previous_cursor)
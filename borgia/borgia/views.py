@@ -12,7 +12,7 @@ from django.contrib.auth.views import LoginView
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.serializers import serialize
-from django.db.models import Q
+from django.db.models import Q, Sum
 from django.http import HttpResponse, QueryDict
 from django.shortcuts import render, resolve_url
 from django.urls import reverse
@@ -21,7 +21,8 @@ from django.views.generic.edit import FormView
 
 from borgia.mixins import LateralMenuMixin
 from borgia.utils import (INTERNALS_GROUP_NAME, get_managers_group_from_user,
-                          is_association_manager)
+                          is_association_manager,
+                          prefetch_generic_foreign_keys)
 from events.models import Event
 from finances.models import ExceptionnalMovement, Recharging, Transfert
 from modules.models import SelfSaleModule
@@ -29,7 +30,8 @@ from sales.models import Sale
 from shops.utils import get_shops_managed
 from shops.models import Shop
 from users.forms import UserQuickSearchForm
-from users.models import User
+from users.models import (User, get_balance_history,
+                          load_balance_movements_sources)
 
 
 class BorgiaView(LateralMenuMixin, View):
@@ -120,22 +122,26 @@ class MembersWorkboard(LoginRequiredMixin, BorgiaView):
     def get_transactions(self):
         transactions = {'months': self.monthlist(
             datetime.datetime.now() - datetime.timedelta(days=365),
-            datetime.datetime.now()), 'all': self.request.user.list_transaction()[:5]}
+            datetime.datetime.now()),
+            'all': load_balance_movements_sources(
+                get_balance_history(self.request.user)[:5])}
 
         # Shops sales
         sale_list = Sale.objects.filter(
             sender=self.request.user).order_by('-datetime')
         transactions['shops'] = []
+        shop_totals = dict(sale_list.order_by().values_list(
+            'shop').annotate(total=Sum('total')))
+        first_month = datetime.date.today().replace(day=1) - datetime.timedelta(days=365)
         for shop in Shop.objects.all():
             list_filtered = sale_list.filter(shop=shop)
-            total = 0
-            for sale in list_filtered:
-                total += sale.amount()
             transactions['shops'].append({
                 'shop': shop,
-                'total': total,
-                'sale_list_short': list_filtered[:5],
-                'data_months': self.data_months(list_filtered, transactions['months'])
+                'total': shop_totals.get(shop.pk, 0),
+                'sale_list_short': list_filtered.prefetch_related('saleproduct_set__product')[:5],
+                'data_months': self.data_months(
+                    list_filtered.filter(datetime__date__gte=first_month),
+                    transactions['months'])
             })
 
         # Transferts
@@ -208,11 +214,13 @@ class ManagersWorkboard(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView)
         context = self.get_context_data(**kwargs)
         if (self.managers_group):
             context['group'] = self.managers_group
-            context['sale_list'] = Sale.objects.all().order_by('-datetime')[:5]
-        elif self.shops_managed:
+            sale_list = Sale.objects.all()
+        else:
             context['group'] = self.shops_managed[0]
-            context['sale_list'] = self.shops_managed[0].sale_set.all().order_by(
-                '-datetime')[:5]
+            sale_list = self.shops_managed[0].sale_set.all()
+        context['sale_list'] = prefetch_generic_foreign_keys(
+            sale_list.select_related('operator', 'sender', 'shop').order_by('-datetime')[:5],
+            'module', 'shop')
         context['events'] = []
         for event in Event.objects.all():
             context['events'].append({
@@ -1,6 +1,14 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
 
 from configurations.models import Configuration
+from configurations.utils import (CONFIGURATIONS_REGISTRY_TTL,
+                                  CONFIGURATIONS_VERSION_CHECK_INTERVAL,
+                                  configuration_get_many,
+                                  configuration_get_value)
 
 def create_configurations(values, configurations_list):
     """
@@ -81,3 +89,68 @@ class ConfigurationTestCase(TestCase):
         self.assertEqual(self.boolean_configurations[5].get_value(), False)
         self.assertEqual(self.boolean_configurations[6].get_value(), True)
         self.assertEqual(self.boolean_configurations[7].get_value(), False)
+
+
+class ConfigurationRegistryTestCase(TestCase):
+    """
+    Tests for the process-local registry of configurations.
+    """
+    def setUp(self):
+        cache.clear()
+        self.integer_configuration = Configuration.objects.create(
+            name='REGISTRY_INTEGER', description='integer', value='1',
+            value_type='i')
+        self.boolean_configuration = Configuration.objects.create(
+            name='REGISTRY_BOOLEAN', description='boolean', value='True',
+            value_type='b')
+
+    def test_get_value(self):
+        self.assertEqual(configuration_get_value('REGISTRY_INTEGER'), 1)
+        self.assertIs(configuration_get_value('REGISTRY_BOOLEAN'), True)
+
+    def test_get_many(self):
+        self.assertEqual(
+            configuration_get_many(['REGISTRY_INTEGER', 'REGISTRY_BOOLEAN']),
+            {'REGISTRY_INTEGER': 1, 'REGISTRY_BOOLEAN': True})
+
+    def test_does_not_exist(self):
+        with self.assertRaises(Configuration.DoesNotExist):
+            configuration_get_value('REGISTRY_UNDEFINED')
+
+    def test_no_query_when_loaded(self):
+        configuration_get_value('REGISTRY_INTEGER')
+        with self.assertNumQueries(0):
+            configuration_get_value('REGISTRY_INTEGER')
+            configuration_get_many(['REGISTRY_INTEGER', 'REGISTRY_BOOLEAN'])
+
+    def test_version_read_once_per_interval(self):
+        configuration_get_value('REGISTRY_INTEGER')
+        with mock.patch.object(cache, 'get', wraps=cache.get) as get:
+            configuration_get_value('REGISTRY_INTEGER')
+            configuration_get_value('REGISTRY_BOOLEAN')
+            get.assert_not_called()
+            with mock.patch('configurations.utils.time.monotonic',
+                            return_value=time.monotonic() + CONFIGURATIONS_VERSION_CHECK_INTERVAL + 1):
+                configuration_get_value('REGISTRY_INTEGER')
+            get.assert_called_once()
+
+    def test_invalidation_on_save(self):
+        self.assertEqual(configuration_get_value('REGISTRY_INTEGER'), 1)
+        self.integer_configuration.value = '2'
+        self.integer_configuration.save()
+        self.assertEqual(configuration_get_value('REGISTRY_INTEGER'), 2)
+
+    def test_invalidation_on_delete(self):
+        self.assertIs(configuration_get_value('REGISTRY_BOOLEAN'), True)
+        self.boolean_configuration.delete()
+        with self.assertRaises(Configuration.DoesNotExist):
+            configuration_get_value('REGISTRY_BOOLEAN')
+
+    def test_reload_after_ttl(self):
+        self.assertEqual(configuration_get_value('REGISTRY_INTEGER'), 1)
+        # Changed by another process, whose invalidation is not seen.
+        Configuration.objects.filter(pk=self.integer_configuration.pk).update(value='2')
+        self.assertEqual(configuration_get_value('REGISTRY_INTEGER'), 1)
+        with mock.patch('configurations.utils.time.monotonic',
+                        return_value=time.monotonic() + CONFIGURATIONS_REGISTRY_TTL + 1):
+            self.assertEqual(configuration_get_value('REGISTRY_INTEGER'), 2)
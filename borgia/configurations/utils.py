@@ -3,9 +3,110 @@ Define Configurations utils.
 Including the default configurations, with the syntax:
 name: (String name, String description, String value_type, String value)
 """
+import time
+import uuid
+
+from django.core.cache import cache
 
 from configurations.models import Configuration
 
+CONFIGURATIONS_CACHE_VERSION_KEY = 'configurations.registry.version'
+CONFIGURATIONS_REGISTRY_TTL = 60
+CONFIGURATIONS_VERSION_CHECK_INTERVAL = 1
+
+# Process-local registry of the typed configuration values. It is reloaded
+# entirely when the shared version stored in the cache changes, and at least
+# every CONFIGURATIONS_REGISTRY_TTL seconds, in case the cache is not shared
+# between processes. The version is read from the cache at most every
+# CONFIGURATIONS_VERSION_CHECK_INTERVAL seconds, not on every value read.
+_registry = {'version': None, 'checked_at': None, 'loaded_at': None, 'values': {}}
+
 
 def configuration_get(name):
+    """
+    Return the Configuration object, read from the database.
+
+    Use it when the configuration is going to be modified. For reading a
+    value, prefer configuration_get_value which does not query the database.
+    """
     return Configuration.objects.get(name=name)
+
+
+def get_configurations_version():
+    """
+    Return the current version of the configurations, shared between
+    processes through the cache.
+
+    A new random version is set when the key is missing (first use or cleared
+    cache), so that a process never trusts a registry loaded before.
+    """
+    version = cache.get(CONFIGURATIONS_CACHE_VERSION_KEY)
+    if version is None:
+        cache.add(CONFIGURATIONS_CACHE_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(CONFIGURATIONS_CACHE_VERSION_KEY)
+    return version
+
+
+def invalidate_configurations():
+    """
+    Invalidate the configuration registry of every process.
+    """
+    cache.set(CONFIGURATIONS_CACHE_VERSION_KEY, uuid.uuid4().hex, None)
+    # The registry of this process is reloaded right away.
+    _registry['checked_at'] = None
+
+
+def get_configurations():
+    """
+    Return the typed values of all configurations, indexed by name.
+
+    All configurations are loaded in one query, only when the registry of the
+    process is outdated or older than CONFIGURATIONS_REGISTRY_TTL seconds.
+
+    :returns: {name: value}, value typed with Configuration.get_value
+    :rtype: dict
+    """
+    now = time.monotonic()
+    if (_registry['checked_at'] is not None and
+            now - _registry['checked_at'] <= CONFIGURATIONS_VERSION_CHECK_INTERVAL):
+        return _registry['values']
+
+    version = get_configurations_version()
+    _registry['checked_at'] = now
+    if (_registry['version'] != version or
+            now - _registry['loaded_at'] > CONFIGURATIONS_REGISTRY_TTL):
+        _registry['values'] = {
+            configuration.name: configuration.get_value()
+            for configuration in Configuration.objects.all()}
+        _registry['version'] = version
+        _registry['loaded_at'] = now
+    return _registry['values']
+
+
+def configuration_get_value(name):
+    """
+    Return the typed value of the configuration.
+
+    :param name: name of the configuration, mandatory.
+    :type name: string
+    :raises: Configuration.DoesNotExist if the configuration is not defined.
+    """
+    return configuration_get_many([name])[name]
+
+
+def configuration_get_many(names):
+    """
+    Return the typed values of several configurations at once.
+
+    :param names: names of the configurations, mandatory.
+    :type names: iterable of strings
+    :returns: {name: value}
+    :rtype: dict
+    :raises: Configuration.DoesNotExist if a configuration is not defined.
+    """
+    configurations = get_configurations()
+    try:
+        return {name: configurations[name] for name in names}
+    except KeyError as error:
+        raise Configuration.DoesNotExist(
+            "Configuration %s does not exist." % error)
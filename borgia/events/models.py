@@ -2,10 +2,10 @@ import decimal
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils.timezone import now
 
-from users.models import User
+from users.models import User, apply_balance_deltas
 
 
 class Event(models.Model):
@@ -212,13 +212,15 @@ class Event(models.Model):
         """
         Procède au paiement de l'évenement par les participants.
         Une seule vente, un seul paiement mais plusieurs débits sur compte
-        (un par participant)
+        (un par participant), appliqués en une seule requête.
         :param operator: user qui procède au paiement
         :param recipient: user qui recoit les paiements (AE_ENSAM)
         :return:
         """
 
         self.done = True
+        # Date of the payment, recorded with the movements of the balances.
+        self.datetime = now()
         self.save()
 
         # Calcul du prix par weight
@@ -228,13 +230,15 @@ class Event(models.Model):
         except (ZeroDivisionError, decimal.DivisionUndefined, decimal.DivisionByZero):
             return
 
-        for e in self.weightsuser_set.all():
-            user_price = final_price_per_weight * e.weights_participation
-            e.user.debit(user_price)
-            recipient.credit(user_price)
+        with transaction.atomic():
+            deltas = {}
+            for e in self.weightsuser_set.all():
+                user_price = final_price_per_weight * e.weights_participation
+                deltas[e.user_id] = deltas.get(e.user_id, 0) - user_price
+                deltas[recipient.pk] = deltas.get(recipient.pk, 0) + user_price
+            apply_balance_deltas(deltas, users=[recipient], source=self)
 
         self.price = total_price
-        self.datetime = now()
         self.remark = 'Paiement par Borgia (Prix total : ' + \
             str(total_price) + ')'
         self.save()
@@ -243,7 +247,7 @@ class Event(models.Model):
         """
         Procède au paiement de l'évenement par les participants.
         Une seule vente, un seul paiement mais plusieurs débits sur compte
-        (un par participant)
+        (un par participant), appliqués en une seule requête.
         :param operator: user qui procède au paiement
         :param recipient: user qui recoit les paiements (AE_ENSAM)
         :param ponderation_price: price per ponderation for each participant
@@ -251,18 +255,22 @@ class Event(models.Model):
         """
 
         self.done = True
+        # Date of the payment, recorded with the movements of the balances.
+        self.datetime = now()
         self.save()
 
-        for weights in self.weightsuser_set.all():
-            weight = weights.weights_participation
-            if weight != 0:
-                user_price = ponderation_price * weight
-                weights.user.debit(user_price)
-                recipient.credit(user_price)
+        with transaction.atomic():
+            deltas = {}
+            for weights in self.weightsuser_set.all():
+                weight = weights.weights_participation
+                if weight != 0:
+                    user_price = ponderation_price * weight
+                    deltas[weights.user_id] = deltas.get(weights.user_id, 0) - user_price
+                    deltas[recipient.pk] = deltas.get(recipient.pk, 0) + user_price
+            apply_balance_deltas(deltas, users=[recipient], source=self)
 
         self.payment_by_ponderation = True
         self.price = ponderation_price
-        self.datetime = now()
         self.remark = 'Paiement par Borgia (Prix par pondération: ' + \
             str(ponderation_price) + ')'
         self.save()
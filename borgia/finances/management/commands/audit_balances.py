@@ -0,0 +1,64 @@
+import decimal
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from finances.utils import (RECONCILIATION_CHUNK_SIZE, audit_balances,
+                            get_user_chunks)
+
+
+class Command(BaseCommand):
+    help = 'Compare the balance of every user with the sum of their transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=RECONCILIATION_CHUNK_SIZE,
+                            help='Number of users reconciled at once.')
+        parser.add_argument('--processes', type=int,
+                            help='Number of processes, the current one by default.')
+        parser.add_argument('--checkpoint',
+                            help='File where the progress is saved, to resume an interrupted audit.')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the progress saved in the checkpoint file.')
+        parser.add_argument('--from-opening', action='store_true',
+                            help='Start from the balances recorded when the journal was '
+                                 'installed, instead of zero.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('The chunk size must be strictly positive.')
+        checkpoint = options['checkpoint']
+
+        last_pk, drifts = None, []
+        if checkpoint and not options['restart'] and os.path.exists(checkpoint):
+            try:
+                with open(checkpoint) as checkpoint_file:
+                    progress = json.load(checkpoint_file)
+                last_pk = progress['last_pk']
+                drifts = [dict(drift, **{key: decimal.Decimal(drift[key])
+                                         for key in ('balance', 'expected', 'drift')})
+                          for drift in progress['drifts']]
+            except (ValueError, KeyError, TypeError, decimal.InvalidOperation):
+                raise CommandError('Checkpoint file "%s" is not valid.' % checkpoint)
+            if progress.get('from_opening', False) != options['from_opening']:
+                raise CommandError('Checkpoint file "%s" was saved with%s --from-opening.' % (
+                    checkpoint, '' if progress.get('from_opening') else 'out'))
+            self.stdout.write('Resuming after user %d.' % last_pk)
+
+        chunks = get_user_chunks(options['chunk_size'], after=last_pk)
+        for (first_pk, last_pk), chunk_drifts in audit_balances(
+                chunks, options['processes'], options['from_opening']):
+            drifts += chunk_drifts
+            if checkpoint:
+                with open(checkpoint, 'w') as checkpoint_file:
+                    json.dump({'last_pk': last_pk, 'drifts': drifts,
+                               'from_opening': options['from_opening']},
+                              checkpoint_file, default=str)
+
+        for drift in drifts:
+            self.stdout.write('%s: balance %s, expected %s, drift %s' % (
+                drift['username'], drift['balance'], drift['expected'], drift['drift']))
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            '%d chunk(s) of users checked, %d balance(s) drifted.' % (len(chunks), len(drifts))))
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.11 on 2026-10-17 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0003_lydia_fee'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recharging',
+            index=models.Index(fields=['datetime', 'id'], name='finances_recharging_dt_id'),
+        ),
+    ]
@@ -5,9 +5,10 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.db.models import Count, Q, Sum
 from django.utils.timezone import now
 
-from users.models import User
+from users.models import User, apply_balance_deltas
 
 # TODO: harmonization of methods name of Cash, Lydia, Cheque.
 # TODO: harmonization of attributes singular/plurial (especially in Payment).
@@ -34,6 +35,9 @@ class Recharging(models.Model):
         :note:: Initial Django Permission (add, view) are added.
         """
         default_permissions = ('add', 'view',)
+        indexes = [
+            models.Index(fields=['datetime', 'id'], name='finances_recharging_dt_id'),
+        ]
 
     def __str__(self):
         return 'Rechargement de ' + str(self.amount()) + '€.'
@@ -42,7 +46,7 @@ class Recharging(models.Model):
         return self.content_solution.amount
 
     def pay(self):
-        self.sender.credit(self.amount())
+        self.sender.credit(self.amount(), source=self)
 
 
 class Transfert(models.Model):
@@ -68,9 +72,18 @@ class Transfert(models.Model):
         return 'Transfert de ' + self.sender.__str__() + ' à ' + self.recipient.__str__() +', ' + self.justification
 
     def pay(self):
-        if self.sender.debit != self.recipient.credit:
-            self.sender.debit(self.amount)
-            self.recipient.credit(self.amount)
+        """
+        Move the amount from the sender to the recipient in one statement.
+
+        :raise: ValueError if the amount is negative or null
+        """
+        if self.amount <= 0:
+            raise ValueError('The amount must be strictly positive')
+        if self.sender.pk != self.recipient.pk:
+            apply_balance_deltas({self.sender.pk: -self.amount,
+                                  self.recipient.pk: self.amount},
+                                 users=[self.sender, self.recipient],
+                                 source=self)
 
 
 class ExceptionnalMovement(models.Model):
@@ -101,9 +114,9 @@ class ExceptionnalMovement(models.Model):
         Add/Remove money from recipient
         '''
         if self.is_credit:
-            self.recipient.credit(self.amount)
+            self.recipient.credit(self.amount, source=self)
         else:
-            self.recipient.debit(self.amount)
+            self.recipient.debit(self.amount, source=self)
 
 
 class BaseRechargingSolution(models.Model):
@@ -186,3 +199,67 @@ class Lydia(BaseRechargingSolution):
 
     def __str__(self):
         return 'Lydia de ' + str(self.amount) + '€, n°' + self.id_from_lydia
+
+
+# Maximum number of solutions detailed per solution type by
+# get_rechargings_info, the totals are not limited.
+RECHARGINGS_INFO_DETAIL_LIMIT = 1000
+
+
+def get_rechargings_info(rechargings):
+    """
+    Return the number and the total amount of rechargings per solution
+    (cash, cheque, Lydia face to face and Lydia online), and overall.
+
+    Amounts are summed by the database over all the rechargings, with one
+    aggregate query per solution table. Solutions are only loaded if ids
+    are read, and only the RECHARGINGS_INFO_DETAIL_LIMIT latest ones.
+
+    :param rechargings: rechargings, filtered or not.
+    :type rechargings: Recharging queryset
+    :returns: {solution: {'nb': integer, 'total': decimal, 'ids': solutions
+    queryset}}, 'total' without ids.
+    :rtype: dict
+    """
+    rechargings = rechargings.order_by()
+
+    def solutions(model):
+        return model.objects.filter(pk__in=rechargings.filter(
+            content_type=ContentType.objects.get_for_model(model)).values('solution_id'))
+
+    def stats(queryset):
+        return queryset.aggregate(nb=Count('pk'), total=Sum('amount'))
+
+    def details(queryset):
+        return queryset.order_by('-pk')[:RECHARGINGS_INFO_DETAIL_LIMIT]
+
+    cash = solutions(Cash)
+    cheques = solutions(Cheque)
+    lydias = solutions(Lydia)
+    # Face to face and online Lydia are aggregated by the same query.
+    lydia_stats = lydias.aggregate(
+        nb_face2face=Count('pk', filter=Q(is_online=False)),
+        total_face2face=Sum('amount', filter=Q(is_online=False)),
+        nb_online=Count('pk', filter=Q(is_online=True)),
+        total_online=Sum('amount', filter=Q(is_online=True)))
+    info = {
+        'cash': dict(stats(cash), ids=details(cash)),
+        'cheque': dict(stats(cheques), ids=details(cheques.select_related('sender'))),
+        'lydia_face2face': {
+            'nb': lydia_stats['nb_face2face'],
+            'total': lydia_stats['total_face2face'],
+            'ids': details(lydias.filter(is_online=False).select_related('sender'))
+        },
+        'lydia_online': {
+            'nb': lydia_stats['nb_online'],
+            'total': lydia_stats['total_online'],
+            'ids': details(lydias.filter(is_online=True).select_related('sender'))
+        },
+    }
+    for solution in info.values():
+        solution['total'] = solution['total'] or decimal.Decimal(0)
+    info['total'] = {
+        'nb': sum(solution['nb'] for solution in info.values()),
+        'total': sum(solution['total'] for solution in info.values())
+    }
+    return info
@@ -16,6 +16,7 @@ class FinancesNamedURLTests(TestCase):
             ('url_transfert_create', [], {}),
             ('url_transfert_retrieve', [], {'transfert_pk': 53}),
             ('url_exceptionnalmovement_list', [], {}),
+            ('url_balance_audit', [], {}),
             ('url_exceptionnalmovement_retrieve',
              [], {'exceptionnalmovement_pk': 53}),
             ('url_self_lydia_create', [], {}),
@@ -1,8 +1,21 @@
+import datetime
 import decimal
+import io
+import json
+import os
+import tempfile
 
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import TestCase
-from finances.utils import (calculate_lydia_fee_from_total,
-                            calculate_total_amount_lydia)
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import localdate, now
+
+from finances.models import Cash, ExceptionnalMovement, Recharging, Transfert
+from finances.utils import (audit_balances, calculate_lydia_fee_from_total,
+                            calculate_total_amount_lydia, get_user_chunks,
+                            reconcile_balances)
+from users.models import OpeningBalance, User, take_balance_snapshot
 
 
 class CalculationsLydiaTestCase(TestCase):
@@ -85,3 +98,101 @@ class CalculationsLydiaTestCase(TestCase):
             recharging_amount, base_fee, ratio_fee, tax_fee)
         expected = decimal.Decimal('53.00')
         self.assertEqual(expected, total)
+
+
+class BalanceAuditTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1')
+        self.user2 = User.objects.create(username='user2')
+        self.user3 = User.objects.create(username='user3')
+        self.add_transactions()
+
+    def add_transactions(self):
+        cash = Cash.objects.create(sender=self.user1, amount=10)
+        Recharging.objects.create(sender=self.user1, operator=self.user2,
+                                  content_solution=cash).pay()
+        Transfert.objects.create(sender=self.user1, recipient=self.user2,
+                                 amount=3, justification='test').pay()
+        ExceptionnalMovement.objects.create(
+            operator=self.user2, recipient=self.user2, amount=decimal.Decimal('1.5'),
+            is_credit=False, justification='test').pay()
+
+    def get_chunk(self):
+        return (self.user1.pk, self.user3.pk)
+
+    def test_no_drift(self):
+        self.assertListEqual(reconcile_balances(self.get_chunk()), [])
+
+    def test_drift(self):
+        User.objects.filter(pk=self.user2.pk).update(balance=5)
+        self.assertListEqual(reconcile_balances(self.get_chunk()), [{
+            'pk': self.user2.pk, 'username': 'user2', 'balance': decimal.Decimal('5.00'),
+            'expected': decimal.Decimal('1.50'), 'drift': decimal.Decimal('3.50')}])
+
+    def test_snapshot_ignored(self):
+        User.objects.filter(pk=self.user3.pk).update(balance=7)
+        take_balance_snapshot(localdate() - datetime.timedelta(days=1))
+        self.assertListEqual([drift['pk'] for drift in reconcile_balances(self.get_chunk())],
+                             [self.user3.pk])
+
+    def test_from_opening(self):
+        # Balance imported before the journal.
+        User.objects.filter(pk=self.user3.pk).update(balance=7)
+        for user in User.objects.filter(pk__in=[self.user1.pk, self.user2.pk, self.user3.pk]):
+            OpeningBalance.objects.create(user=user, balance=user.balance, datetime=now())
+        self.assertListEqual(
+            [drift['pk'] for drift in reconcile_balances(self.get_chunk())], [self.user3.pk])
+        self.assertListEqual(reconcile_balances(self.get_chunk(), from_opening=True), [])
+
+        # Transactions since the opening are still audited.
+        self.add_transactions()
+        self.assertListEqual(reconcile_balances(self.get_chunk(), from_opening=True), [])
+        User.objects.filter(pk=self.user1.pk).update(balance=0)
+        self.assertListEqual(
+            [drift['pk'] for drift in reconcile_balances(self.get_chunk(), from_opening=True)],
+            [self.user1.pk])
+
+    def test_constant_queries(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                reconcile_balances(self.get_chunk())
+            return len(queries)
+
+        count = count_queries()
+        for i in range(3):
+            self.add_transactions()
+        self.assertEqual(count_queries(), count)
+
+    def test_chunks(self):
+        User.objects.filter(pk=self.user3.pk).update(balance=1)
+        chunks = get_user_chunks(2, after=self.user1.pk - 1)
+        self.assertListEqual(chunks, [(self.user1.pk, self.user2.pk),
+                                      (self.user3.pk, self.user3.pk)])
+        self.assertListEqual(
+            [[drift['pk'] for drift in drifts] for _, drifts in audit_balances(chunks)],
+            [[], [self.user3.pk]])
+
+    def test_command_resume(self):
+        User.objects.filter(pk=self.user3.pk).update(balance=1)
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'audit.json')
+            with open(checkpoint, 'w') as checkpoint_file:
+                json.dump({'last_pk': self.user2.pk, 'drifts': [{
+                    'pk': self.user1.pk, 'username': 'user1', 'balance': '1.00',
+                    'expected': '0.00', 'drift': '1.00'}]}, checkpoint_file)
+            out = io.StringIO()
+            call_command('audit_balances', '--checkpoint', checkpoint, stdout=out)
+            self.assertFalse(os.path.exists(checkpoint))
+        self.assertIn('Resuming after user %d.' % self.user2.pk, out.getvalue())
+        self.assertIn('user1: balance 1.00', out.getvalue())
+        self.assertIn('user3: balance 1.00, expected 0.00, drift 1.00', out.getvalue())
+        self.assertIn('2 balance(s) drifted.', out.getvalue())
+
+    def test_command_resume_other_mode(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'audit.json')
+            with open(checkpoint, 'w') as checkpoint_file:
+                json.dump({'last_pk': self.user2.pk, 'drifts': []}, checkpoint_file)
+            with self.assertRaises(CommandError):
+                call_command('audit_balances', '--checkpoint', checkpoint, '--from-opening',
+                             stdout=io.StringIO())
@@ -1,9 +1,16 @@
+import decimal
+from unittest import mock
+
+from django.db import connection
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
 from borgia.tests.utils import get_login_url_redirected
-from finances.models import Cash, ExceptionnalMovement, Recharging, Transfert
+from finances.models import (Cash, Cheque, ExceptionnalMovement, Lydia,
+                             Recharging, Transfert, get_rechargings_info)
+from finances.views import RechargingList, SelfTransactionList
 from users.tests.tests_views import BaseFocusUserViewsTestCase
 
 
@@ -80,6 +87,88 @@ class RechargingListTests(GeneralFinancesViewsTests):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def test_search(self):
+        response = self.client1.post(self.get_url(), {
+            'search': self.user2.last_name.upper(),
+            'date_begin': '', 'date_end': ''})
+        self.assertEqual(list(response.context['recharging_list']), [self.recharging1])
+
+        response = self.client1.post(self.get_url(), {
+            'search': 'nobody', 'date_begin': '', 'date_end': ''})
+        self.assertEqual(list(response.context['recharging_list']), [])
+
+    def add_rechargings(self):
+        for solution in (Cash.objects.create(sender=self.user2, amount=1),
+                         Cheque.objects.create(sender=self.user2, amount=2,
+                                               cheque_number='0000001'),
+                         Lydia.objects.create(sender=self.user2, amount=3,
+                                              id_from_lydia='1')):
+            Recharging.objects.create(sender=self.user2, operator=self.user1,
+                                      content_solution=solution)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client1.get(self.get_url())
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_constant_queries(self):
+        self.add_rechargings()
+        # The first request fills the caches (menu, content types).
+        self.count_queries()
+        count = self.count_queries()
+        for i in range(3):
+            self.add_rechargings()
+        self.assertEqual(self.count_queries(), count)
+
+    def test_info(self):
+        for i in range(2):
+            self.add_rechargings()
+        Lydia.objects.filter(amount=3).update(is_online=False)
+        self.add_rechargings()
+        info = get_rechargings_info(Recharging.objects.all())
+        self.assertEqual((info['cash']['nb'], info['cash']['total']), (4, decimal.Decimal(23)))
+        self.assertEqual((info['cheque']['nb'], info['cheque']['total']), (3, decimal.Decimal(6)))
+        self.assertEqual((info['lydia_face2face']['nb'], info['lydia_face2face']['total']),
+                         (2, decimal.Decimal(6)))
+        self.assertEqual((info['lydia_online']['nb'], info['lydia_online']['total']),
+                         (1, decimal.Decimal(3)))
+        self.assertEqual((info['total']['nb'], info['total']['total']), (10, decimal.Decimal(38)))
+        self.assertEqual(len(info['lydia_face2face']['ids']), 2)
+
+    @mock.patch('finances.models.RECHARGINGS_INFO_DETAIL_LIMIT', 2)
+    def test_info_details_limited(self):
+        for i in range(3):
+            self.add_rechargings()
+        info = get_rechargings_info(Recharging.objects.all())
+        # Totals are not limited, details are.
+        self.assertEqual(info['cheque']['nb'], 3)
+        self.assertEqual(len(info['cheque']['ids']), 2)
+        response = self.client1.post(self.get_url(), {
+            'search': '', 'date_begin': '', 'date_end': ''})
+        self.assertContains(response, 'Seuls les 2 chèques les plus récents sont affichés.')
+
+    @mock.patch.object(RechargingList, 'per_page', 2)
+    def test_pagination(self):
+        for i in range(2):
+            self.add_rechargings()
+        response = self.client1.post(self.get_url(), {
+            'search': '', 'date_begin': '', 'date_end': ''})
+        # Totals are not limited to the page.
+        self.assertEqual(response.context['info']['total']['nb'], 7)
+        page = response.context['recharging_list']
+        self.assertEqual(len(page), 2)
+
+        pks = [recharging.pk for recharging in page]
+        while page.has_next():
+            response = self.client1.get(self.get_url() + '?' + '&'.join([
+                response.context['filters_querystring'], 'after=' + page.next_cursor]))
+            self.assertEqual(response.context['info']['total']['nb'], 7)
+            page = response.context['recharging_list']
+            pks += [recharging.pk for recharging in page]
+        self.assertEqual(pks, list(Recharging.objects.order_by(
+            '-datetime', '-pk').values_list('pk', flat=True)))
+
 
 class RechargingRetrieveTests(BaseFinancesViewsTestCase):
     url_view = 'url_recharging_retrieve'
@@ -219,3 +308,73 @@ class ExceptionnalMovementRetrieveTests(BaseFinancesViewsTestCase):
         self.assertEqual(response_offline_user.status_code, 302)
         self.assertRedirects(response_offline_user, get_login_url_redirected(
             self.get_url(self.movement1.pk)))
+
+
+@mock.patch.object(SelfTransactionList, 'per_page', 2)
+class SelfTransactionListTests(BaseFinancesViewsTestCase):
+    url_view = 'url_self_transaction_list'
+
+    def get_url(self):
+        return reverse(self.url_view)
+
+    def setUp(self):
+        super().setUp()
+        self.recharging1.pay()
+        for amount in (1, 2, 3, 4):
+            ExceptionnalMovement.objects.create(
+                operator=self.user1, recipient=self.user2, amount=amount,
+                is_credit=bool(amount % 2), justification='test').pay()
+
+    def test_pagination(self):
+        response = self.client2.get(self.get_url())
+        self.assertEqual(response.status_code, 200)
+        page = response.context['transaction_list']
+        self.assertEqual(len(page), 2)
+
+        amounts = [movement.amount for movement in page]
+        while page.has_next():
+            response = self.client2.get(self.get_url() + '?after=' + page.next_cursor)
+            page = response.context['transaction_list']
+            amounts += [movement.amount for movement in page]
+        self.assertListEqual(amounts, [decimal.Decimal(amount) for amount in
+                                       ('-4.00', '3.00', '-2.00', '1.00', '20.00')])
+
+    def test_offline_user_redirection_get(self):
+        response_offline_user = Client().get(self.get_url())
+        self.assertEqual(response_offline_user.status_code, 302)
+
+
+class BalanceAuditTests(BaseFinancesViewsTestCase):
+    url_view = 'url_balance_audit'
+
+    def get_url(self):
+        return reverse(self.url_view)
+
+    def test_allowed_user_get(self):
+        with mock.patch('finances.views.audit_balances') as audit:
+            response_client1 = self.client1.get(self.get_url())
+        self.assertEqual(response_client1.status_code, 200)
+        # The audit is only run on POST.
+        audit.assert_not_called()
+        self.assertNotIn('drift_list', response_client1.context)
+
+    def test_allowed_user_post(self):
+        response_client1 = self.client1.post(self.get_url())
+        self.assertEqual(response_client1.status_code, 200)
+        # The recharging of user2 is not paid, so the balances drift.
+        self.assertIn(self.user2.pk, [
+            drift['pk'] for drift in response_client1.context['drift_list']])
+
+    def test_not_allowed_user_get(self):
+        response_client2 = self.client2.get(self.get_url())
+        self.assertEqual(response_client2.status_code, 403)
+
+    def test_not_allowed_user_post(self):
+        response_client2 = self.client2.post(self.get_url())
+        self.assertEqual(response_client2.status_code, 403)
+
+    def test_offline_user_redirection_get(self):
+        response_offline_user = Client().get(self.get_url())
+        self.assertEqual(response_offline_user.status_code, 302)
+        self.assertRedirects(response_offline_user,
+                             get_login_url_redirected(self.get_url()))
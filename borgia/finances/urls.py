@@ -1,6 +1,6 @@
 from django.urls import include, path
 
-from finances.views import (ExceptionnalMovementList,
+from finances.views import (BalanceAudit, ExceptionnalMovementList,
                             ExceptionnalMovementRetrieve, RechargingCreate,
                             RechargingList, RechargingRetrieve,
                             SelfLydiaConfirm, SelfLydiaCreate,
@@ -41,6 +41,8 @@ finances_patterns = [
             path('<int:exceptionnalmovement_pk>/', ExceptionnalMovementRetrieve.as_view(),
                  name='url_exceptionnalmovement_retrieve')
         ])),
+        # BALANCES
+        path('balances/audit/', BalanceAudit.as_view(), name='url_balance_audit'),
         # Lydias
         path('lydias/', include([
             path('callback/', self_lydia_callback,
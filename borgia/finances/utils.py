@@ -1,7 +1,21 @@
+import collections
 import decimal
+import functools
 import hashlib
+import multiprocessing
 import operator
 
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.db.models import F, Min, OuterRef, Q, Subquery, Sum
+
+from finances.models import (Cash, Cheque, ExceptionnalMovement, Lydia,
+                             Recharging, Transfert)
+from sales.models import Sale
+from users.models import BalanceMovement, OpeningBalance, User
+
+RECONCILIATION_CHUNK_SIZE = 1000
+
 
 def verify_token_lydia(params, token):
     """
@@ -56,3 +70,147 @@ def calculate_lydia_fee_from_total(total_amount, base_fee, ratio_fee, tax_fee=1)
         tax_fee * (base_fee + ratio_fee / 100 * total_amount)
     ).quantize(decimal.Decimal('0.0001')).quantize(decimal.Decimal('.01'), decimal.ROUND_UP)
     # rounded to up. First round to 0.0001 is to remove float imprecision error, which lead 0.200000000001 to round to 0.21 instead of 0.20
+
+
+def get_user_chunks(chunk_size=RECONCILIATION_CHUNK_SIZE, after=None):
+    """
+    Split the users in ranges of ids, to be reconciled one after another.
+
+    :param chunk_size: number of users per range.
+    :param after: id of the last user already reconciled.
+    :type chunk_size: integer
+    :type after: integer
+    :returns: (first id, last id) of each range, in order
+    :rtype: list of tuples
+    """
+    pks = User.objects.order_by('pk').values_list('pk', flat=True)
+    if after is not None:
+        pks = pks.filter(pk__gt=after)
+    pks = list(pks)
+    return [(pks[i], pks[min(i + chunk_size, len(pks)) - 1])
+            for i in range(0, len(pks), chunk_size)]
+
+
+def get_expected_balances(first_pk, last_pk, from_opening=False):
+    """
+    Recompute the balance of the users of the range from their transactions,
+    with one grouped aggregate per kind of transaction.
+
+    Events are read from the balance journal, the only place where the
+    recipient of their payment is recorded.
+
+    Balances start from zero and the whole history is added, unless
+    from_opening is set: balances imported before Borgia then start from
+    their OpeningBalance, and only the transactions since are added. Users
+    created since start from zero.
+
+    :param first_pk: id of the first user of the range, mandatory.
+    :param last_pk: id of the last user of the range, mandatory.
+    :param from_opening: start from the opening balances.
+    :type first_pk: integer
+    :type last_pk: integer
+    :type from_opening: boolean
+    :returns: expected balance, indexed by user id
+    :rtype: dict {integer: decimal}
+    """
+    def in_range(field):
+        return {field + '__gte': first_pk, field + '__lte': last_pk}
+
+    expected = collections.defaultdict(decimal.Decimal)
+
+    def add(rows, sign=1):
+        for pk, total in rows:
+            expected[pk] += sign * (total or 0)
+
+    since = {}
+    if from_opening:
+        opening = OpeningBalance.objects.aggregate(datetime=Min('datetime'))['datetime']
+        if opening is not None:
+            add(OpeningBalance.objects.filter(**in_range('user')).values_list(
+                'user', 'balance'))
+            since['datetime__gte'] = opening
+
+    add(Sale.objects.filter(**since, **in_range('sender')).order_by().values_list(
+        'sender').annotate(Sum('total')), -1)
+
+    for solution_model in (Cash, Cheque, Lydia):
+        add(Recharging.objects.filter(
+            content_type=ContentType.objects.get_for_model(solution_model),
+            **since, **in_range('sender')
+        ).annotate(amount=Subquery(solution_model.objects.filter(
+            pk=OuterRef('solution_id')).values('amount'))
+        ).order_by().values_list('sender').annotate(Sum('amount')))
+
+    transferts = Transfert.objects.filter(**since).exclude(sender=F('recipient')).order_by()
+    add(transferts.filter(**in_range('sender')).values_list(
+        'sender').annotate(Sum('amount')), -1)
+    add(transferts.filter(**in_range('recipient')).values_list(
+        'recipient').annotate(Sum('amount')))
+
+    movements = ExceptionnalMovement.objects.filter(
+        **since, **in_range('recipient')).order_by().values_list('recipient').annotate(
+            credit=Sum('amount', filter=Q(is_credit=True)),
+            debit=Sum('amount', filter=Q(is_credit=False)))
+    for pk, credit, debit in movements:
+        expected[pk] += (credit or 0) - (debit or 0)
+
+    add(BalanceMovement.objects.filter(kind='event', **since, **in_range('user')).order_by(
+        ).values_list('user').annotate(Sum('amount')))
+    return expected
+
+
+def reconcile_balances(chunk, from_opening=False):
+    """
+    Compare the balance of the users of the range with their expected
+    balance.
+
+    :param chunk: (first id, last id) of the range of users, mandatory.
+    :param from_opening: start from the opening balances, see
+    get_expected_balances.
+    :type chunk: tuple
+    :type from_opening: boolean
+    :returns: the users whose balance drifted, as dicts with pk, username,
+    balance, expected and drift (balance - expected).
+    :rtype: list of dicts
+    """
+    first_pk, last_pk = chunk
+    expected = get_expected_balances(first_pk, last_pk, from_opening)
+    drifts = []
+    users = User.objects.filter(pk__gte=first_pk, pk__lte=last_pk).order_by(
+        'pk').values_list('pk', 'username', 'balance')
+    for pk, username, balance in users:
+        expected_balance = expected[pk].quantize(decimal.Decimal('.01'))
+        if balance != expected_balance:
+            drifts.append({'pk': pk, 'username': username, 'balance': balance,
+                           'expected': expected_balance,
+                           'drift': balance - expected_balance})
+    return drifts
+
+
+def audit_balances(chunks, processes=None, from_opening=False):
+    """
+    Reconcile the balances of the ranges of users, one range at a time or
+    over a pool of processes.
+
+    :param chunks: ranges of users, as returned by get_user_chunks, mandatory.
+    :param processes: number of processes, None to reconcile in the current
+    process.
+    :param from_opening: start from the opening balances, see
+    get_expected_balances.
+    :type chunks: list of tuples
+    :type processes: integer
+    :type from_opening: boolean
+    :returns: iterator of (chunk, drifts), in the order of the chunks
+    """
+    reconcile = functools.partial(reconcile_balances, from_opening=from_opening)
+    if not processes or processes < 2:
+        return ((chunk, reconcile(chunk)) for chunk in chunks)
+    return _audit_balances_pool(chunks, processes, reconcile)
+
+
+def _audit_balances_pool(chunks, processes, reconcile):
+    # Forked processes must not share the database connection of the parent.
+    connections.close_all()
+    with multiprocessing.Pool(processes) as pool:
+        for chunk, drifts in zip(chunks, pool.imap(reconcile, chunks)):
+            yield chunk, drifts
@@ -7,25 +7,28 @@ from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.db.models import Q
-from django.http import Http404
+from django.http import Http404, QueryDict
 from django.shortcuts import HttpResponse, render
 from django.urls import reverse
 from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 
+from borgia.utils import KeysetPaginator, prefetch_generic_foreign_keys
 from borgia.views import BorgiaFormView, BorgiaView
-from configurations.utils import configuration_get
+from configurations.utils import (configuration_get_many,
+                                  configuration_get_value)
 from finances.forms import (ExceptionnalMovementForm,
                             GenericListSearchDateForm, RechargingCreateForm,
                             RechargingListForm, SelfLydiaCreateForm,
                             TransfertCreateForm)
 from finances.models import (Cash, Cheque, ExceptionnalMovement, Lydia,
-                             Recharging, Transfert)
-from finances.utils import (verify_token_lydia, 
-                            calculate_lydia_fee_from_total,
-                            calculate_total_amount_lydia)
+                             Recharging, Transfert, get_rechargings_info)
+from finances.utils import (audit_balances, calculate_lydia_fee_from_total,
+                            calculate_total_amount_lydia, get_user_chunks,
+                            verify_token_lydia)
 from users.mixins import UserMixin
-from users.models import User
+from users.models import (User, get_balance_history,
+                          load_balance_movements_sources, search_users)
 
 
 class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
@@ -43,89 +46,68 @@ class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView
     form_class = RechargingListForm
     lm_active = 'lm_recharging_list'
 
+    per_page = 50
+
     search = None
     date_end = now() + datetime.timedelta(days=1)
     date_begin = now() - datetime.timedelta(days=7)
     operators = None
 
+    def get(self, request, *args, **kwargs):
+        """
+        Filters and cursors are read from the URL, so that the links to the
+        next and previous pages keep them.
+        """
+        if any(name in request.GET for name in self.form_class.base_fields):
+            form = self.form_class(request.GET)
+            if form.is_valid():
+                self.set_filters(form.cleaned_data)
+        return super().get(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        rechargings = self.form_query(Recharging.objects.all())
 
-        context['recharging_list'] = self.form_query(
-            Recharging.objects.all().order_by(
-                '-datetime'))[:1000]
+        # Totals are computed over all the rechargings, the list is paginated.
+        context['info'] = get_rechargings_info(rechargings)
 
-        context['info'] = self.info(context['recharging_list'])
+        paginator = KeysetPaginator(
+            rechargings.select_related('sender', 'operator'), self.per_page)
+        context['recharging_list'] = paginator.page(
+            after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        prefetch_generic_foreign_keys(context['recharging_list'], 'content_solution')
+        context['filters_querystring'] = self.get_filters_querystring().urlencode()
         return context
 
     def get_initial(self):
         initial = super().get_initial()
+        initial['search'] = self.search
         initial['date_begin'] = self.date_begin
         initial['date_end'] = self.date_end
+        initial['operators'] = self.operators
         return initial
 
-    def info(self, query):
-        info = {
-            'cash': {
-                'total': 0,
-                'nb': 0,
-                'ids': []
-            },
-            'cheque': {
-                'total': 0,
-                'nb': 0,
-                'ids': []
-            },
-            'lydia_face2face': {
-                'total': 0,
-                'nb': 0,
-                'ids': []
-            },
-            'lydia_online': {
-                'total': 0,
-                'nb': 0,
-                'ids': []
-            },
-            'total': {
-                'total': 0,
-                'nb': 0
-            }
-        }
-
-        for recharging in query:
-            if recharging.content_solution.__class__.__name__ == 'Cash':
-                info['cash']['total'] += recharging.content_solution.amount
-                info['cash']['nb'] += 1
-                info['cash']['ids'].append(recharging.content_solution)
-            elif recharging.content_solution.__class__.__name__ == 'Cheque':
-                info['cheque']['total'] += recharging.content_solution.amount
-                info['cheque']['nb'] += 1
-                info['cheque']['ids'].append(recharging.content_solution)
-            elif recharging.content_solution.__class__.__name__ == 'Lydia':
-                if recharging.content_solution.is_online is False:
-                    info['lydia_face2face']['total'] += recharging.content_solution.amount
-                    info['lydia_face2face']['nb'] += 1
-                    info['lydia_face2face']['ids'].append(
-                        recharging.content_solution)
-                else:
-                    info['lydia_online']['total'] += recharging.content_solution.amount
-                    info['lydia_online']['nb'] += 1
-                    info['lydia_online']['ids'].append(
-                        recharging.content_solution)
-            info['total']['total'] += recharging.content_solution.amount
-            info['total']['nb'] += 1
-        return info
+    def get_filters_querystring(self):
+        """
+        Return the filters as a querystring, to be completed with a cursor.
+
+        Dates are always given, empty if not filtered, so that the default
+        dates don't apply on the next pages.
+        """
+        querystring = QueryDict(mutable=True)
+        if self.search:
+            querystring['search'] = self.search
+        for name in ('date_begin', 'date_end'):
+            date = getattr(self, name)
+            querystring[name] = date.strftime('%d/%m/%Y') if date else ''
+        if self.operators:
+            querystring.setlist('operators', [operator.pk for operator in self.operators])
+        return querystring
 
     def form_query(self, query):
         if self.search:
-            query = query.filter(
-                Q(operator__last_name__contains=self.search)
-                | Q(operator__first_name__contains=self.search)
-                | Q(operator__surname__contains=self.search)
-                | Q(sender__last_name__contains=self.search)
-                | Q(sender__first_name__contains=self.search)
-                | Q(sender__surname__contains=self.search)
-            )
+            users = search_users(self.search)
+            query = query.filter(Q(operator__in=users) | Q(sender__in=users))
 
         if self.date_begin:
             query = query.filter(
@@ -140,19 +122,21 @@ class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView
 
         return query
 
-    def form_valid(self, form):
-        if form.cleaned_data['search'] != '':
-            self.search = form.cleaned_data['search']
+    def set_filters(self, cleaned_data):
+        if cleaned_data['search'] != '':
+            self.search = cleaned_data['search']
 
-        if form.cleaned_data['date_begin'] != '':
-            self.date_begin = form.cleaned_data['date_begin']
+        if cleaned_data['date_begin'] != '':
+            self.date_begin = cleaned_data['date_begin']
 
-        if form.cleaned_data['date_end'] != '':
-            self.date_end = form.cleaned_data['date_end']
+        if cleaned_data['date_end'] != '':
+            self.date_end = cleaned_data['date_end']
 
-        if form.cleaned_data['operators']:
-            self.operators = form.cleaned_data['operators']
+        if cleaned_data['operators']:
+            self.operators = cleaned_data['operators']
 
+    def form_valid(self, form):
+        self.set_filters(form.cleaned_data)
         return self.get(self.request, self.args, self.kwargs)
 
 
@@ -226,14 +210,8 @@ class TransfertList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView)
 
     def form_query(self, query):
         if self.search:
-            query = query.filter(
-                Q(recipient__last_name__contains=self.search)
-                | Q(recipient__first_name__contains=self.search)
-                | Q(recipient__surname__contains=self.search)
-                | Q(sender__last_name__contains=self.search)
-                | Q(sender__first_name__contains=self.search)
-                | Q(sender__surname__contains=self.search)
-            )
+            users = search_users(self.search)
+            query = query.filter(Q(recipient__in=users) | Q(sender__in=users))
 
         if self.date_begin:
             query = query.filter(
@@ -299,6 +277,33 @@ class TransfertRetrieve(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView)
         return render(request, self.template_name, context=context)
 
 
+class BalanceAudit(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
+    """
+    Compare the balance of every user with the sum of their transactions,
+    and list the balances which drifted.
+
+    The audit reads every transaction, so it only runs when asked for, with a
+    POST. For large databases, prefer the command audit_balances, which can
+    resume and use several processes.
+    """
+    permission_required = 'users.audit_balancemovement'
+    menu_type = 'managers'
+    template_name = 'finances/balance_audit.html'
+    lm_active = 'lm_balance_audit'
+
+    def get(self, request, *args, **kwargs):
+        context = self.get_context_data(**kwargs)
+        return render(request, self.template_name, context=context)
+
+    def post(self, request, *args, **kwargs):
+        context = self.get_context_data(**kwargs)
+        chunks = get_user_chunks()
+        context['drift_list'] = [drift for _, drifts in audit_balances(chunks)
+                                 for drift in drifts]
+        context['total_drift'] = sum(drift['drift'] for drift in context['drift_list'])
+        return render(request, self.template_name, context=context)
+
+
 class TransfertCreate(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
     permission_required = 'finances.add_transfert'
     menu_type = 'members'
@@ -365,14 +370,8 @@ class ExceptionnalMovementList(LoginRequiredMixin, PermissionRequiredMixin, Borg
 
     def form_query(self, query):
         if self.search:
-            query = query.filter(
-                Q(operator__last_name__contains=self.search)
-                | Q(operator__first_name__contains=self.search)
-                | Q(operator__surname__contains=self.search)
-                | Q(recipient__last_name__contains=self.search)
-                | Q(recipient__first_name__contains=self.search)
-                | Q(recipient__surname__contains=self.search)
-            )
+            users = search_users(self.search)
+            query = query.filter(Q(operator__in=users) | Q(recipient__in=users))
 
         if self.date_begin:
             query = query.filter(
@@ -440,11 +439,14 @@ class ExceptionnalMovementRetrieve(LoginRequiredMixin, PermissionRequiredMixin,
 class SelfTransactionList(LoginRequiredMixin, BorgiaFormView):
     """
     View to list transactions of the logged user.
+
+    The list is read from the balance journal, one page at a time.
     """
     menu_type = 'members'
     template_name = 'finances/self_transaction_list.html'
     form_class = GenericListSearchDateForm
     lm_active = 'lm_self_transaction_list'
+    per_page = 50
 
     search = None
     date_begin = None
@@ -456,8 +458,11 @@ class SelfTransactionList(LoginRequiredMixin, BorgiaFormView):
 
     def get_context_data(self, **kwargs):
         context = super(SelfTransactionList, self).get_context_data(**kwargs)
-        context['transaction_list'] = self.form_query(
-            self.request.user.list_transaction())[:100]
+        paginator = KeysetPaginator(
+            self.form_query(get_balance_history(self.request.user)), self.per_page)
+        context['transaction_list'] = paginator.page(
+            after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        load_balance_movements_sources(context['transaction_list'])
         return context
 
     # TODO: form to be used
@@ -612,29 +617,25 @@ class SelfLydiaCreate(LoginRequiredMixin, BorgiaFormView):
         self.tax_fee_lydia = None
 
     def add_lydia_context(self):
-        if not configuration_get("ENABLE_SELF_LYDIA").get_value():
+        lydia_configurations = configuration_get_many([
+            'ENABLE_SELF_LYDIA', 'API_TOKEN_LYDIA', 'ENABLE_FEE_LYDIA',
+            'BASE_FEE_LYDIA', 'RATIO_FEE_LYDIA', 'TAX_FEE_LYDIA'])
+        if not lydia_configurations['ENABLE_SELF_LYDIA']:
             self.state = "disabled"
-        elif configuration_get("API_TOKEN_LYDIA").get_value() in ['', 'Undefined']:
+        elif lydia_configurations['API_TOKEN_LYDIA'] in ['', 'Undefined']:
             self.state = "undefined"
         else:
             self.state = "enabled"
 
-            self.enable_fee_lydia = configuration_get(
-                name='ENABLE_FEE_LYDIA').get_value()
+            self.enable_fee_lydia = lydia_configurations['ENABLE_FEE_LYDIA']
 
             if self.enable_fee_lydia:
-                base_fee_lydia = configuration_get(
-                    name='BASE_FEE_LYDIA').get_value()
                 self.base_fee_lydia = decimal.Decimal(
-                    base_fee_lydia).quantize(decimal.Decimal('.01'))
-                ratio_fee_lydia = configuration_get(
-                    name='RATIO_FEE_LYDIA').get_value()
+                    lydia_configurations['BASE_FEE_LYDIA']).quantize(decimal.Decimal('.01'))
                 self.ratio_fee_lydia = decimal.Decimal(
-                    ratio_fee_lydia).quantize(decimal.Decimal('.01'))
-                tax_fee_lydia = configuration_get(
-                    name='TAX_FEE_LYDIA').get_value()
+                    lydia_configurations['RATIO_FEE_LYDIA']).quantize(decimal.Decimal('.01'))
                 self.tax_fee_lydia = decimal.Decimal(
-                    tax_fee_lydia).quantize(decimal.Decimal('.01'))
+                    lydia_configurations['TAX_FEE_LYDIA']).quantize(decimal.Decimal('.01'))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -651,10 +652,10 @@ class SelfLydiaCreate(LoginRequiredMixin, BorgiaFormView):
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
 
-        min_value = configuration_get(name='MIN_PRICE_LYDIA').get_value()
+        min_value = configuration_get_value('MIN_PRICE_LYDIA')
         kwargs['min_value'] = decimal.Decimal(min_value)
 
-        max_value = configuration_get(name='MAX_PRICE_LYDIA').get_value()
+        max_value = configuration_get_value('MAX_PRICE_LYDIA')
         if max_value == 0:
             kwargs['max_value'] = None
         else:
@@ -675,11 +676,11 @@ class SelfLydiaCreate(LoginRequiredMixin, BorgiaFormView):
         user = self.request.user
         if user.phone is None:
             user.phone = form.cleaned_data['tel_number']
-            user.save()
+            user.save(update_fields=['phone'])
 
         context = self.get_context_data()
-        context['vendor_token'] = configuration_get(
-            "VENDOR_TOKEN_LYDIA").get_value()
+        context['vendor_token'] = configuration_get_value(
+            "VENDOR_TOKEN_LYDIA")
         context['confirm_url'] = self.request.build_absolute_uri(
             reverse('url_self_lydia_confirm'))
         context['callback_url'] = self.request.build_absolute_uri(
@@ -778,7 +779,7 @@ def self_lydia_callback(request):
         "vendor_token": request.POST.get("vendor_token"),
         "sig": request.POST.get("sig")
     }
-    lydia_token = configuration_get("API_TOKEN_LYDIA").get_value()
+    lydia_token = configuration_get_value("API_TOKEN_LYDIA")
 
     if verify_token_lydia(params_dict, lydia_token) is False:
         raise PermissionDenied
@@ -794,13 +795,16 @@ def self_lydia_callback(request):
             raise Http404
 
         total_amount = decimal.Decimal(params_dict['amount'])
-        if not configuration_get('ENABLE_FEE_LYDIA').get_value():
+        fee_configurations = configuration_get_many([
+            'ENABLE_FEE_LYDIA', 'BASE_FEE_LYDIA', 'RATIO_FEE_LYDIA',
+            'TAX_FEE_LYDIA'])
+        if not fee_configurations['ENABLE_FEE_LYDIA']:
             fee = 0
             recharging_amount = total_amount
         else:
-            base_fee = decimal.Decimal(configuration_get('BASE_FEE_LYDIA').get_value()).quantize(decimal.Decimal('.01'))
-            ratio_fee = decimal.Decimal(configuration_get('RATIO_FEE_LYDIA').get_value()).quantize(decimal.Decimal('.01'))
-            tax_fee = decimal.Decimal(configuration_get('TAX_FEE_LYDIA').get_value()).quantize(decimal.Decimal('.01'))
+            base_fee = decimal.Decimal(fee_configurations['BASE_FEE_LYDIA']).quantize(decimal.Decimal('.01'))
+            ratio_fee = decimal.Decimal(fee_configurations['RATIO_FEE_LYDIA']).quantize(decimal.Decimal('.01'))
+            tax_fee = decimal.Decimal(fee_configurations['TAX_FEE_LYDIA']).quantize(decimal.Decimal('.01'))
 
             fee = calculate_lydia_fee_from_total(
                 total_amount, base_fee, ratio_fee, tax_fee)
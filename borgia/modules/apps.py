@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ModulesConfig(AppConfig):
     name = 'modules'
+
+    def ready(self):
+        # Import modules signals
+        from modules.signals import (invalidate_catalogs_on_change,
+                                     invalidate_lateral_menus_on_module_change)
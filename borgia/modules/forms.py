@@ -1,8 +1,9 @@
+import decimal
+
 from django import forms
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
 
-from modules.models import CategoryProduct
 from shops.models import Product
 from users.models import User
 
@@ -11,6 +12,7 @@ class ShopModuleSaleForm(forms.Form):
     def __init__(self, *args, **kwargs):
         self.module_class = kwargs.pop('module_class')
         self.module = kwargs.pop('module')
+        self.catalog = kwargs.pop('catalog')
         self.client = kwargs.pop('client')
         self.balance_threshold_purchase = kwargs.pop(
             'balance_threshold_purchase')
@@ -19,24 +21,22 @@ class ShopModuleSaleForm(forms.Form):
         if self.module_class == 'operator_sales':
             self.fields['client'] = self.get_client_field()
 
-        for category in self.module.categories.all():
-            for category_product in category.categoryproduct_set.all():
-                if (category_product.get_price() > 0 and
-                        not category_product.product.is_removed and
-                        category_product.product.is_active):
-                    self.fields[str(category_product.pk)
-                                + '-' + str(category.pk)
-                                ] = forms.IntegerField(
-                                    label=category_product.__str__(),
-                                    widget=forms.NumberInput(
-                                        attrs={'data_category_pk': category.pk,
-                                               'data_price': category_product.get_price(),
-                                               'class': 'form-control buyable_product',
-                                               'min': 0}),
-                                    initial=0,
-                                    required=False,
-                                    validators=[MinValueValidator(0, """La commande doit être
-                                                                positive ou nulle""")])
+        self.lines = {}
+        for category in self.catalog:
+            for line in category['products']:
+                if line['is_sellable']:
+                    self.lines[line['field_key']] = line
+                    self.fields[line['field_key']] = forms.IntegerField(
+                        label=line['label'],
+                        widget=forms.NumberInput(
+                            attrs={'data_category_pk': category['pk'],
+                                   'data_price': line['price'],
+                                   'class': 'form-control buyable_product',
+                                   'min': 0}),
+                        initial=0,
+                        required=False,
+                        validators=[MinValueValidator(0, """La commande doit être
+                                                    positive ou nulle""")])
 
     def clean(self):
         super().clean()
@@ -50,18 +50,11 @@ class ShopModuleSaleForm(forms.Form):
                 raise forms.ValidationError('Utilisateur non sélectionné')
             if not self.client.is_active:
                 raise forms.ValidationError("L'utilisateur a été desactivé")
-        total_price = 0
-        for field in self.cleaned_data:
-            if field != 'client':
-                invoice = self.cleaned_data[field]
-                if isinstance(invoice, int) and invoice > 0:
-                    try:
-                        category_product_pk = field.split('-')[0]
-                        total_price += (CategoryProduct.objects.get(
-                            pk=category_product_pk).get_price() * invoice)
-                    except ObjectDoesNotExist:
-                        pass
-        if (self.client.balance - total_price) < self.balance_threshold_purchase.get_value():
+        basket, total_price = self.resolve_basket()
+        if not self.are_products_sellable(basket):
+            raise forms.ValidationError(
+                "Un produit n'est plus en vente, veuillez recharger la page.")
+        if (self.client.balance - total_price) < self.balance_threshold_purchase:
             raise forms.ValidationError('Crédit insuffisant !')
         if self.module.limit_purchase:
             if total_price > self.module.limit_purchase:
@@ -71,8 +64,50 @@ class ShopModuleSaleForm(forms.Form):
             raise forms.ValidationError('La commande doit être positive.')
 
         self.cleaned_data['client'] = self.client
+        self.cleaned_data['basket'] = basket
+        self.cleaned_data['total_price'] = total_price
         return self.cleaned_data
 
+    def resolve_basket(self):
+        """
+        Resolve the lines ordered with the prices of the catalog, without any
+        query.
+
+        The catalog is resolved when the form is submitted, so current prices
+        are used even if they changed since the interface was displayed.
+
+        :returns: list of lines {'category_product', 'invoice', 'price'} and
+        the total price of the basket.
+        """
+        basket = []
+        total_price = 0
+        for field, invoice in self.cleaned_data.items():
+            if field in self.lines and isinstance(invoice, int) and invoice > 0:
+                line = self.lines[field]
+                price = (line['price'] * invoice).quantize(decimal.Decimal('0.01'))
+                basket.append({
+                    'category_product': line['category_product'],
+                    'invoice': invoice,
+                    'price': price
+                })
+                total_price += price
+        return basket, total_price
+
+    def are_products_sellable(self, basket):
+        """
+        Check in the database that the products of the basket are still
+        active and not removed, with one query.
+
+        The catalog may have been cached before a product was deactivated.
+
+        :returns: True if every product of the basket can be sold.
+        """
+        product_pks = {line['category_product'].product_id for line in basket}
+        if not product_pks:
+            return True
+        return Product.objects.filter(
+            pk__in=product_pks, is_active=True, is_removed=False).count() == len(product_pks)
+
     def get_client_field(self):
         return forms.CharField(
             label="Client",
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modules', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='order',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
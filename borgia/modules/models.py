@@ -50,20 +50,24 @@ class CategoryProduct(models.Model):
             return self.product.name + ' / ' + str(self.quantity) + self.product.get_unit_display()
         return self.product.name
 
-    def get_price(self):
+    def get_price(self, product_price=None):
         """
         Return the price for the quantity.
+
+        :param product_price: price of the product, if already known.
         """
         try:
+            if product_price is None:
+                product_price = self.product.get_price()
             if self.product.unit:
                 # - price for a L, quantity in cl
                 # - price for a kg, quantity in kg
                 if self.product.unit == 'CL':
-                    return decimal.Decimal(self.quantity * self.product.get_price() / 100)
+                    return decimal.Decimal(self.quantity * product_price / 100)
                 if self.product.unit == 'G':
-                    return decimal.Decimal(self.quantity * self.product.get_price() / 1000)
+                    return decimal.Decimal(self.quantity * product_price / 1000)
             else:
-                return decimal.Decimal(self.product.get_price())
+                return decimal.Decimal(product_price)
         except (ZeroDivisionError, decimal.DivisionUndefined, decimal.DivisionByZero):
             return decimal.Decimal(0)
 
@@ -0,0 +1,31 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from borgia.utils import invalidate_lateral_menus_shops
+from modules.models import (Category, CategoryProduct, OperatorSaleModule,
+                            SelfSaleModule)
+from modules.utils import invalidate_catalogs
+from shops.models import Product
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=CategoryProduct)
+@receiver(post_delete, sender=CategoryProduct)
+@receiver(post_save, sender=Product)
+def invalidate_catalogs_on_change(**kwargs):
+    """
+    Sale interfaces display categories, category products and products.
+    """
+    invalidate_catalogs()
+
+
+@receiver(post_save, sender=SelfSaleModule)
+@receiver(post_delete, sender=SelfSaleModule)
+@receiver(post_save, sender=OperatorSaleModule)
+@receiver(post_delete, sender=OperatorSaleModule)
+def invalidate_lateral_menus_on_module_change(**kwargs):
+    """
+    Lateral menus link to the enabled sale modules.
+    """
+    invalidate_lateral_menus_shops()
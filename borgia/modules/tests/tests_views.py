@@ -1,8 +1,15 @@
+import decimal
+
+from django.db import connection
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from borgia.tests.utils import get_login_url_redirected
-from modules.models import Category, OperatorSaleModule, SelfSaleModule
+from modules.models import (Category, CategoryProduct, OperatorSaleModule,
+                            SelfSaleModule)
+from sales.models import Sale
+from shops.models import Product
 from shops.tests.tests_views import BaseShopsViewsTest
 
 
@@ -78,6 +85,95 @@ class ShopModuleSaleViewTests(BaseGeneralShopModuleViewsTest):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def test_self_sale_post(self):
+        category = Category.objects.create(
+            name='SelfSaleCategory',
+            module=self.selfsalemodule1
+        )
+        # 2€ per liter, sold by 50cl
+        category_product = CategoryProduct.objects.create(
+            category=category,
+            product=self.product2,
+            quantity=50
+        )
+        field = str(category_product.pk) + '-' + str(category.pk)
+        response_client1 = self.client1.post(
+            self.get_url(self.shop1.pk, 'self_sales'), {field: 3})
+        self.assertEqual(response_client1.status_code, 200)
+
+        sale = Sale.objects.get(sender=self.user1)
+        self.assertEqual(sale.amount(), decimal.Decimal('3.00'))
+        self.assertEqual(sale.saleproduct_set.get().quantity, 150)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('50.00'))
+
+    def test_price_change_before_post(self):
+        category = Category.objects.create(
+            name='SelfSaleCategory',
+            module=self.selfsalemodule1
+        )
+        category_product = CategoryProduct.objects.create(
+            category=category,
+            product=self.product2,
+            quantity=100
+        )
+        self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+
+        self.product2.manual_price = decimal.Decimal('2.5')
+        self.product2.save()
+        field = str(category_product.pk) + '-' + str(category.pk)
+        self.client1.post(self.get_url(self.shop1.pk, 'self_sales'), {field: 2})
+
+        sale = Sale.objects.get(sender=self.user1)
+        self.assertEqual(sale.total, decimal.Decimal('5.00'))
+        self.assertEqual(sale.compute_total(), sale.total)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('48.00'))
+
+    def test_product_deactivated_before_post(self):
+        category = Category.objects.create(
+            name='SelfSaleCategory',
+            module=self.selfsalemodule1
+        )
+        category_product = CategoryProduct.objects.create(
+            category=category,
+            product=self.product2,
+            quantity=100
+        )
+        self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+
+        # Deactivated without invalidating the cached catalog, as done by
+        # another process.
+        Product.objects.filter(pk=self.product2.pk).update(is_active=False)
+        field = str(category_product.pk) + '-' + str(category.pk)
+        self.client1.post(self.get_url(self.shop1.pk, 'self_sales'), {field: 2})
+        self.assertFalse(Sale.objects.filter(sender=self.user1).exists())
+
+    def test_constant_queries_get(self):
+        category = Category.objects.create(
+            name='SelfSaleCategory',
+            module=self.selfsalemodule1
+        )
+
+        def count_queries():
+            self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+            with CaptureQueriesContext(connection) as context:
+                response = self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+            self.assertEqual(response.status_code, 200)
+            return len(context.captured_queries)
+
+        for product in (self.product1, self.product2, self.product3):
+            CategoryProduct.objects.create(category=category, product=product, quantity=1)
+        nb_queries = count_queries()
+
+        for i in range(20):
+            product = Product.objects.create(
+                name='product' + str(i), shop=self.shop1, is_manual=True, manual_price=1)
+            CategoryProduct.objects.create(category=category, product=product, quantity=1)
+        self.assertEqual(count_queries(), nb_queries)
+        self.assertContains(
+            self.client1.get(self.get_url(self.shop1.pk, 'self_sales')), 'product19')
+
 
 class ShopModuleConfigViewTests(BaseGeneralShopModuleViewsTest):
     url_view = 'url_shop_module_config'
@@ -0,0 +1,87 @@
+"""
+Define modules utils.
+Including the catalog of the sale interface of shop modules.
+"""
+
+from django.db.models import Prefetch
+
+from borgia.cache import bump_version, get_versioned, set_versioned
+from modules.models import CategoryProduct
+from shops.models import get_products_prices
+
+CATALOG_CACHE_VERSION_KEY = 'modules.catalog.version'
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+
+def get_catalog_cache_key(module):
+    """
+    Return the cache key of the catalog of a module.
+
+    Catalogs are stored with a global version, changed each time a category,
+    a category product or a product changes, see borgia.cache.
+    """
+    return 'modules.catalog.{0}.{1}'.format(module.get_module_class(), module.pk)
+
+
+def invalidate_catalogs():
+    """
+    Invalidate the catalogs of every module.
+    """
+    bump_version(CATALOG_CACHE_VERSION_KEY)
+
+
+def build_module_catalog(module):
+    """
+    Return the structure of the sale interface of a module, in two queries.
+
+    The catalog is a list of categories, ordered, each one with its
+    category products:
+    [{'pk', 'name', 'products': [{'category_product', 'field_key', 'label'}]}]
+    Prices are not part of the structure, see get_module_catalog.
+    """
+    catalog = []
+    categories = module.categories.order_by('order').prefetch_related(
+        Prefetch('categoryproduct_set',
+                 queryset=CategoryProduct.objects.select_related('product')))
+    for category in categories:
+        catalog.append({
+            'pk': category.pk,
+            'name': category.name,
+            'products': [{
+                'category_product': category_product,
+                'field_key': str(category_product.pk) + '-' + str(category.pk),
+                'label': category_product.__str__()
+            } for category_product in category.categoryproduct_set.all()]
+        })
+    return catalog
+
+
+def get_module_catalog(module):
+    """
+    Return the catalog of a module, with the current prices.
+
+    The structure is cached, prices are resolved at once through the product
+    prices cache. Each product of the catalog gets:
+    - price: price of the category product,
+    - is_sellable: True if the product can be bought in the interface.
+
+    :param module: module, mandatory.
+    :type module: ShopModule object
+    """
+    key = get_catalog_cache_key(module)
+    versions, catalog = get_versioned(key, [CATALOG_CACHE_VERSION_KEY])
+    if catalog is None:
+        catalog = build_module_catalog(module)
+        set_versioned(key, versions, catalog, CATALOG_CACHE_TIMEOUT)
+
+    lines = [line for category in catalog for line in category['products']]
+    prices = get_products_prices(
+        line['category_product'].product for line in lines)
+    for line in lines:
+        category_product = line['category_product']
+        line['price'] = category_product.get_price(
+            prices[category_product.product_id])
+        line['is_sellable'] = (line['price'] > 0 and
+                               not category_product.product.is_removed and
+                               category_product.product.is_active)
+    return catalog
@@ -3,21 +3,22 @@ from functools import partial, wraps
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.forms.formsets import formset_factory
 from django.http import Http404
 from django.shortcuts import redirect, render
 from django.urls import reverse
 
 from borgia.views import BorgiaFormView, BorgiaView
-from configurations.utils import configuration_get
+from configurations.utils import configuration_get_value
 from modules.forms import (ModuleCategoryCreateForm,
                            ModuleCategoryCreateNameForm, ShopModuleConfigForm,
                            ShopModuleSaleForm)
 from modules.mixins import ShopModuleCategoryMixin, ShopModuleMixin
 from modules.models import Category, CategoryProduct, SelfSaleModule
+from modules.utils import get_module_catalog
 from sales.models import Sale, SaleProduct
-from shops.models import Product, Shop
-from users.models import User
+from shops.models import Product, Shop, add_stock_output
 
 
 class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
@@ -38,6 +39,7 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
     permission_required_operator = 'modules.use_operatorsalemodule'
     template_name = 'modules/shop_module_sale.html'
     form_class = ShopModuleSaleForm
+    catalog = None
 
     def has_permission(self):
         if self.kwargs['module_class'] == 'self_sales':
@@ -67,11 +69,20 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
         elif self.module_class == "operator_sales":
             return 'shops'
 
+    def get_catalog(self):
+        """
+        Return the catalog of the module, resolved once per request.
+        """
+        if self.catalog is None:
+            self.catalog = get_module_catalog(self.module)
+        return self.catalog
+
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['module_class'] = self.module_class
         kwargs['module'] = self.module
-        kwargs['balance_threshold_purchase'] = configuration_get(
+        kwargs['catalog'] = self.get_catalog()
+        kwargs['balance_threshold_purchase'] = configuration_get_value(
             'BALANCE_THRESHOLD_PURCHASE')
 
         if self.module_class == "self_sales":
@@ -84,12 +95,14 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = self.module.categories.all().order_by('order')
+        context['categories'] = self.get_catalog()
         return context
 
     def form_valid(self, form):
         """
         Create a sale and like all products via SaleProduct objects.
+
+        Lines and total come from the basket resolved by the form.
         """
         if self.module_class == "self_sales":
             client = self.request.user
@@ -98,31 +111,33 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
         else:
             self.handle_unexpected_module_class()
 
-        sale = Sale.objects.create(
-            operator=self.request.user,
-            sender=client,
-            recipient=User.objects.get(pk=1),
-            module=self.module,
-            shop=self.shop
-        )
-        for field in form.cleaned_data:
-            if field != 'client' and form.cleaned_data[field] != '':
-                invoice = int(form.cleaned_data[field])
-                if invoice > 0:
-                    try:
-                        category_product = CategoryProduct.objects.get(
-                            pk=field.split('-')[0])
-                    except ObjectDoesNotExist:
-                        pass
-                    else:
-                        SaleProduct.objects.create(
-                            sale=sale,
-                            product=category_product.product,
-                            quantity=category_product.quantity * invoice,
-                            price=category_product.get_price() * invoice
-                        )
-        sale.pay()
-
+        sale_products = [
+            SaleProduct(
+                product=line['category_product'].product,
+                quantity=line['category_product'].quantity * line['invoice'],
+                price=line['price']
+            ) for line in form.cleaned_data['basket']
+        ]
+
+        sold_quantities = {}
+        for sale_product in sale_products:
+            sold_quantities[sale_product.product.pk] = sold_quantities.get(
+                sale_product.product.pk, 0) + sale_product.quantity
+
+        with transaction.atomic():
+            sale = Sale.objects.create(
+                operator=self.request.user,
+                sender=client,
+                recipient_id=1,
+                module=self.module,
+                shop=self.shop,
+                total=form.cleaned_data['total_price']
+            )
+            for sale_product in sale_products:
+                sale_product.sale = sale
+            SaleProduct.objects.bulk_create(sale_products)
+            add_stock_output(sold_quantities)
+            sale.pay()
 
         context = self.get_context_data()
 
@@ -0,0 +1,24 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.models import refresh_sales_rollup
+
+
+class Command(BaseCommand):
+    help = 'Roll up the sales of products per day, used for sales velocities.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', help='First day to roll up (YYYY-MM-DD), the last day rolled up by default.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Invalid date "%s", expected YYYY-MM-DD.' % options['since'])
+
+        count = refresh_sales_rollup(since)
+        self.stdout.write(self.style.SUCCESS('%d day(s) of product sales rolled up.' % count))
@@ -0,0 +1,35 @@
+from decimal import Decimal
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_sale_total(apps, schema_editor):
+    """
+    Compute the total of every existing sale in a single UPDATE statement.
+    """
+    Sale = apps.get_model('sales', 'Sale')
+    SaleProduct = apps.get_model('sales', 'SaleProduct')
+    totals = SaleProduct.objects.filter(sale=OuterRef('pk')).values(
+        'sale').annotate(total=Sum('price')).values('total')
+    Sale.objects.update(total=Coalesce(
+        Subquery(totals, output_field=models.DecimalField(max_digits=9, decimal_places=2)),
+        Decimal(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0002_auto_20190103_1237'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=9, validators=[django.core.validators.MinValueValidator(Decimal('0'))], verbose_name='Total'),
+        ),
+        migrations.RunPython(backfill_sale_total, migrations.RunPython.noop),
+    ]
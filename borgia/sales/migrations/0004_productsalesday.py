@@ -0,0 +1,28 @@
+# Generated by Django 2.1.11 on 2026-10-17 07:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shops', '0002_product_stock_ledger'),
+        ('sales', '0003_sale_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shops.Product')),
+            ],
+            options={
+                'default_permissions': (),
+                'unique_together': {('product', 'date')},
+            },
+        ),
+    ]
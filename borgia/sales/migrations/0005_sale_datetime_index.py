@@ -0,0 +1,21 @@
+# Generated by Django 2.1.11 on 2026-10-17 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0004_productsalesday'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['datetime', 'id'], name='sales_sale_datetime_id'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['shop', 'datetime', 'id'], name='sales_sale_shop_datetime_id'),
+        ),
+    ]
@@ -1,15 +1,21 @@
+import datetime
 import decimal
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.utils.timezone import now
+from django.db import models, transaction
+from django.db.models import IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncDate
+from django.utils.timezone import localdate, make_aware, now
 
 from shops.models import Product, Shop
 from users.models import User
 
+VELOCITY_SHORT_DAYS = 7
+VELOCITY_LONG_DAYS = 28
+
 
 class Sale(models.Model):
     """
@@ -30,6 +36,8 @@ class Sale(models.Model):
     :param module:
     :param shop:
     :param products:
+    :param total: denormalized sum of the prices of the SaleProduct objects,
+    stored when the sale is committed.
 
 
     :type datetime: date string, default now
@@ -43,6 +51,7 @@ class Sale(models.Model):
     :type module:
     :type shop: Shop object
     :type products: Product object
+    :type total: decimal
 
     :note:: Initial Django Permission (add, change, delete, view) are added.
     """
@@ -58,6 +67,18 @@ class Sale(models.Model):
     module = GenericForeignKey('content_type', 'module_id')
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
     products = models.ManyToManyField(Product, through='SaleProduct')
+    total = models.DecimalField('Total', default=0, decimal_places=2,
+                                max_digits=9,
+                                validators=[MinValueValidator(decimal.Decimal(0))])
+
+    class Meta:
+        """
+        Index the (datetime, id) order of the lists, globally and per shop.
+        """
+        indexes = [
+            models.Index(fields=['datetime', 'id'], name='sales_sale_datetime_id'),
+            models.Index(fields=['shop', 'datetime', 'id'], name='sales_sale_shop_datetime_id'),
+        ]
 
     def __str__(self):
         """
@@ -69,7 +90,7 @@ class Sale(models.Model):
         return 'Achat ' + self.shop.__str__() + ', ' + self.string_products()
 
     def pay(self):
-        self.sender.debit(self.amount())
+        self.sender.debit(self.amount(), source=self)
 
     def string_products(self):
         """
@@ -95,10 +116,22 @@ class Sale(models.Model):
             return None
 
     def amount(self):
-        amount = 0
-        for sale_product in self.saleproduct_set.all():
-            amount += sale_product.price
-        return amount
+        return self.total
+
+    def compute_total(self):
+        """
+        Return the sum of the prices of the SaleProduct objects, computed by
+        the database.
+        """
+        return self.saleproduct_set.aggregate(
+            total=Sum('price'))['total'] or decimal.Decimal(0)
+
+    def update_total(self):
+        """
+        Store the total computed from the SaleProduct objects.
+        """
+        self.total = self.compute_total()
+        self.save(update_fields=['total'])
 
 
 class SaleProduct(models.Model):
@@ -123,3 +156,105 @@ class SaleProduct(models.Model):
                 return self.product.__str__() + ' x ' + str(self.quantity)
             else:
                 return self.product.__str__()
+
+
+class ProductSalesDay(models.Model):
+    """
+    Quantity of a product sold during a day, rolled up from the SaleProduct
+    objects by refresh_sales_rollup.
+
+    quantity -> in CL/G
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    date = models.DateField('Date')
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        """
+        Remove default permissions for ProductSalesDay
+        """
+        default_permissions = ()
+        unique_together = ('product', 'date')
+
+
+def refresh_sales_rollup(since=None):
+    """
+    Roll up the sales of every product per day, from a given day.
+
+    By default, the rollup restarts from the last day rolled up, which may
+    have been partial, so that running it regularly only reads the recent
+    sales. Days are the days of the current timezone.
+
+    :param since: first day to roll up, the last day rolled up by default,
+    and all the sales if there isn't any.
+    :type since: date
+    :returns: number of days rolled up, all products included.
+    :rtype: integer
+    """
+    if since is None:
+        since = ProductSalesDay.objects.aggregate(last=Max('date'))['last']
+
+    sales = SaleProduct.objects.all()
+    rollups = ProductSalesDay.objects.all()
+    if since is not None:
+        sales = sales.filter(sale__datetime__gte=make_aware(
+            datetime.datetime.combine(since, datetime.time.min)))
+        rollups = rollups.filter(date__gte=since)
+    days = sales.annotate(date=TruncDate('sale__datetime')).values(
+        'product', 'date').annotate(total=Sum('quantity')).order_by()
+
+    with transaction.atomic():
+        rollups.delete()
+        created = ProductSalesDay.objects.bulk_create([
+            ProductSalesDay(product_id=day['product'], date=day['date'],
+                            quantity=day['total'])
+            for day in days
+        ])
+    return len(created)
+
+
+def get_depletion_forecast(products, today=None):
+    """
+    Return the products with their sales velocity and the days of stock left,
+    with one query.
+
+    Velocities are read from the daily rollup, over the last
+    VELOCITY_SHORT_DAYS and VELOCITY_LONG_DAYS full days. The highest one is
+    used for the projection, so that a recent rush is not hidden by a calm
+    month. The stock is the current estimated stock.
+
+    :param products: products, all the products of a shop for instance.
+    :param today: day of the projection, today by default.
+    :type products: Product queryset
+    :type today: date
+    :returns: products, with the attributes sales_short, sales_long (sold
+    quantities over the windows), velocity (quantity per day) and days_left
+    (None without sale).
+    :rtype: list of Product objects
+    """
+    if today is None:
+        today = localdate()
+
+    def sold(days):
+        return Subquery(
+            ProductSalesDay.objects.filter(
+                product=OuterRef('pk'), date__lt=today,
+                date__gte=today - datetime.timedelta(days=days)
+            ).order_by().values('product').annotate(
+                total=Sum('quantity')).values('total'),
+            output_field=IntegerField())
+
+    products = list(products.annotate(
+        sales_short=sold(VELOCITY_SHORT_DAYS), sales_long=sold(VELOCITY_LONG_DAYS)))
+    for product in products:
+        product.sales_short = product.sales_short or 0
+        product.sales_long = product.sales_long or 0
+        product.velocity = max(
+            decimal.Decimal(product.sales_short) / VELOCITY_SHORT_DAYS,
+            decimal.Decimal(product.sales_long) / VELOCITY_LONG_DAYS)
+        if product.velocity:
+            stock = max(product.current_stock_estimated(), 0)
+            product.days_left = int(stock / product.velocity)
+        else:
+            product.days_left = None
+    return products
@@ -0,0 +1,129 @@
+import datetime
+import decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import localdate, now
+
+from borgia.utils import prefetch_generic_foreign_keys
+from sales.models import (ProductSalesDay, Sale, SaleProduct,
+                          get_depletion_forecast, refresh_sales_rollup)
+from sales.tests.tests_views import BaseSalesViewsTest
+from shops.models import Product, add_stock_input
+
+
+class SaleTestCase(BaseSalesViewsTest):
+    def test_compute_total(self):
+        self.assertEqual(self.sale1.compute_total(), decimal.Decimal('5.79'))
+
+        empty_sale = Sale.objects.create(
+            sender=self.user1,
+            recipient=self.user3,
+            operator=self.user3,
+            shop=self.shop1,
+            module=self.operatorsalemodule1
+        )
+        self.assertEqual(empty_sale.compute_total(), 0)
+
+    def test_update_total(self):
+        SaleProduct.objects.create(
+            sale=self.sale1,
+            product=self.product3,
+            quantity=100,
+            price=decimal.Decimal('1.01')
+        )
+        self.assertEqual(self.sale1.amount(), decimal.Decimal('5.79'))
+        self.sale1.update_total()
+        self.assertEqual(Sale.objects.get(pk=self.sale1.pk).amount(),
+                         decimal.Decimal('6.80'))
+
+
+class SalesVelocityTestCase(BaseSalesViewsTest):
+    def setUp(self):
+        super().setUp()
+        self.today = localdate()
+        self.day = datetime.timedelta(days=1)
+        # sale1: product1 x 2, product2 x 3, today.
+        self.sell(now() - 2 * self.day, self.product1, 5)
+        self.sell(now() - 20 * self.day, self.product1, 14)
+        self.sell(now() - 40 * self.day, self.product2, 100)
+
+    def sell(self, moment, product, quantity):
+        sale = Sale.objects.create(
+            sender=self.user1, recipient=self.user3, operator=self.user3,
+            shop=self.shop1, module=self.operatorsalemodule1, datetime=moment)
+        SaleProduct.objects.create(sale=sale, product=product, quantity=quantity)
+
+    def get_rollup(self):
+        return dict(((day.product_id, day.date), day.quantity)
+                    for day in ProductSalesDay.objects.filter(
+                        product__in=[self.product1, self.product2]))
+
+    def test_rollup(self):
+        refresh_sales_rollup()
+        rollup = self.get_rollup()
+        self.assertEqual(len(rollup), 5)
+        self.assertEqual(rollup[(self.product1.pk, self.today)], 2)
+        self.assertEqual(rollup[(self.product1.pk, self.today - 2 * self.day)], 5)
+        self.assertEqual(rollup[(self.product2.pk, self.today - 40 * self.day)], 100)
+
+    def test_incremental_rollup(self):
+        refresh_sales_rollup()
+        self.sell(now(), self.product1, 1)
+        # Only the last day rolled up is computed again.
+        self.assertEqual(refresh_sales_rollup(), 2)
+        rollup = self.get_rollup()
+        self.assertEqual(rollup[(self.product1.pk, self.today)], 3)
+        self.assertEqual(len(rollup), 5)
+
+    def test_forecast(self):
+        refresh_sales_rollup()
+        add_stock_input({self.product1.pk: 30})
+        products = {product.pk: product for product in get_depletion_forecast(
+            self.shop1.product_set.all())}
+        product1 = products[self.product1.pk]
+        # Sales of today are not counted, the day is not over.
+        self.assertEqual((product1.sales_short, product1.sales_long), (5, 19))
+        # 5 / 7 per day is faster than 19 / 28 per day.
+        self.assertEqual(product1.velocity, decimal.Decimal(5) / 7)
+        # Stock: 30 entered, sales are not recorded in the stock ledger here.
+        self.assertEqual(product1.days_left, 42)
+        self.assertIsNone(products[self.product2.pk].days_left)
+
+    def test_forecast_constant_queries(self):
+        refresh_sales_rollup()
+        for i in range(20):
+            Product.objects.create(name='product' + str(i), shop=self.shop1)
+        with self.assertNumQueries(1):
+            get_depletion_forecast(self.shop1.product_set.all())
+
+    def test_command(self):
+        out = StringIO()
+        call_command('refresh_sales_rollup', '--since',
+                     (self.today - 3 * self.day).isoformat(), stdout=out)
+        self.assertIn('3 day(s)', out.getvalue())
+
+
+class PrefetchGenericForeignKeysTestCase(BaseSalesViewsTest):
+    def setUp(self):
+        super().setUp()
+        for module in (self.selfsalemodule1, self.operatorsalemodule1) * 3:
+            Sale.objects.create(sender=self.user1, recipient=self.user3,
+                                operator=self.user3, shop=self.shop1, module=module)
+
+    def test_prefetch(self):
+        sales = Sale.objects.filter(shop=self.shop1)
+        expected = [(sale.module, sale.from_shop()) for sale in sales]
+
+        with CaptureQueriesContext(connection) as queries:
+            sales = prefetch_generic_foreign_keys(sales, 'module', 'shop')
+        # Sales, then modules and their shop for each module model.
+        self.assertLessEqual(len(queries), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual([(sale.module, sale.from_shop()) for sale in sales], expected)
+
+    def test_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(prefetch_generic_foreign_keys([], 'module'), [])
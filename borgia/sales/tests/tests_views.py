@@ -1,11 +1,17 @@
+import datetime
 import decimal
+from unittest import mock
 
+from django.db import connection
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.timezone import now
 
 from borgia.tests.utils import get_login_url_redirected
 from modules.tests.tests_views import BaseShopModuleViewsTest
 from sales.models import Sale, SaleProduct
+from sales.views import SaleList
 
 
 class BaseSalesViewsTest(BaseShopModuleViewsTest):
@@ -33,6 +39,7 @@ class BaseSalesViewsTest(BaseShopModuleViewsTest):
             quantity=3,
             price=decimal.Decimal(4.56)
         )
+        self.sale1.update_total()
 
 
 class SaleListViewTests(BaseSalesViewsTest):
@@ -64,6 +71,67 @@ class SaleListViewTests(BaseSalesViewsTest):
             self.get_url(self.shop1.pk)))
 
 
+@mock.patch.object(SaleList, 'per_page', 3)
+class SaleListPaginationTests(BaseSalesViewsTest):
+    def setUp(self):
+        super().setUp()
+        moment = now() - datetime.timedelta(days=1)
+        # Sales at the same moment are ordered by id.
+        for i in range(7):
+            sale = Sale.objects.create(
+                sender=self.user1, recipient=self.user3, operator=self.user3,
+                shop=self.shop1, module=self.operatorsalemodule1,
+                datetime=moment - datetime.timedelta(hours=i // 2))
+            SaleProduct.objects.create(sale=sale, product=self.product1, quantity=1)
+        self.expected = list(Sale.objects.filter(shop=self.shop1).order_by(
+            '-datetime', '-pk').values_list('pk', flat=True))
+        self.url = reverse('url_sale_list', kwargs={'shop_pk': self.shop1.pk})
+
+    def get_page(self, data=None):
+        response = self.client3.get(self.url, data)
+        self.assertEqual(response.status_code, 200)
+        return response.context['sale_list']
+
+    def test_next_and_previous(self):
+        pages = [self.get_page()]
+        while pages[-1].has_next():
+            pages.append(self.get_page({'after': pages[-1].next_cursor}))
+        self.assertEqual([sale.pk for page in pages for sale in page], self.expected)
+        self.assertFalse(pages[0].has_previous())
+
+        previous = self.get_page({'before': pages[-1].previous_cursor})
+        self.assertEqual([sale.pk for sale in previous], [sale.pk for sale in pages[-2]])
+        self.assertEqual(previous.next_cursor, pages[-2].next_cursor)
+
+    def test_invalid_cursor(self):
+        page = self.get_page({'after': 'invalid'})
+        self.assertEqual([sale.pk for sale in page], self.expected[:3])
+
+    def test_filters_in_url(self):
+        response = self.client3.get(self.url, {'search': 'nobody'})
+        self.assertEqual(len(response.context['sale_list']), 0)
+        self.assertEqual(response.context['filters_querystring'], 'search=nobody')
+
+    def test_constant_queries(self):
+        first_page = self.get_page()
+        with CaptureQueriesContext(connection) as first_queries:
+            self.get_page()
+        with CaptureQueriesContext(connection) as next_queries:
+            self.get_page({'after': first_page.next_cursor})
+        self.assertEqual(len(next_queries), len(first_queries))
+        self.assertFalse(any('COUNT' in query['sql'] and '"sales_sale"' in query['sql']
+                             for query in next_queries))
+
+    def test_approximate_count(self):
+        response = self.client3.get(self.url)
+        self.assertEqual(response.context['sale_count'], len(self.expected))
+        Sale.objects.filter(pk=self.expected[0]).delete()
+        # Deep pages read the count cached by the first page.
+        response = self.client3.get(
+            self.url, {'after': response.context['sale_list'].next_cursor})
+        self.assertEqual(response.context['sale_count'], len(self.expected))
+
+
 class SaleRetrieveViewTests(BaseSalesViewsTest):
     url_view = 'url_sale_retrieve'
 
@@ -1,12 +1,17 @@
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+import hashlib
+
+from django.core.cache import cache
 from django.db.models import Q
+from django.http import QueryDict
 from django.shortcuts import render
 
+from borgia.utils import KeysetPaginator, prefetch_generic_foreign_keys
 from borgia.views import BorgiaFormView, BorgiaView
 from sales.forms import SaleListSearchDateForm
 from sales.mixins import SaleMixin
 from sales.models import Sale
 from shops.mixins import ShopMixin
+from users.models import search_users
 
 
 class SaleList(ShopMixin, BorgiaFormView):
@@ -26,36 +31,74 @@ class SaleList(ShopMixin, BorgiaFormView):
     form_class = SaleListSearchDateForm
     lm_active = 'lm_sale_list'
 
+    per_page = 50
+    count_cache_timeout = 60 * 10
+
     query_shop = None
     search = None
     date_begin = None
     date_end = None
 
+    def get(self, request, *args, **kwargs):
+        """
+        Filters and cursors are read from the URL, so that the links to the
+        next and previous pages keep them.
+        """
+        if any(name in request.GET for name in self.form_class.base_fields):
+            form = self.form_class(request.GET)
+            if form.is_valid():
+                self.set_filters(form.cleaned_data)
+        return super().get(request, *args, **kwargs)
+
+    def get_initial(self):
+        return {'search': self.search, 'date_begin': self.date_begin,
+                'date_end': self.date_end}
+
+    def get_filters_querystring(self):
+        """
+        Return the filters as a querystring, to be completed with a cursor.
+        """
+        querystring = QueryDict(mutable=True)
+        if self.search:
+            querystring['search'] = self.search
+        if self.date_begin:
+            querystring['date_begin'] = self.date_begin.strftime('%d/%m/%Y')
+        if self.date_end:
+            querystring['date_end'] = self.date_end.strftime('%d/%m/%Y')
+        return querystring
+
+    def get_approximate_count(self, sales, compute):
+        """
+        Return the number of sales matching the filters, as cached by the
+        first page, or None.
+
+        The count is computed only if asked (first page), and may be
+        outdated by count_cache_timeout at most.
+        """
+        key = 'sales.sale_list.count.{0}.{1}'.format(
+            self.shop.pk, hashlib.md5(
+                self.get_filters_querystring().urlencode().encode()).hexdigest())
+        if compute:
+            return cache.get_or_set(key, sales.count, self.count_cache_timeout)
+        return cache.get(key)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         sales_tab_header = []
         seen = set(sales_tab_header)
-        page = self.request.POST.get('page', 1)
-
-        try:
-            context['sale_list'] = Sale.objects.filter(
-                shop=self.shop).order_by('-datetime')
-        except AttributeError:
-            context['sale_list'] = Sale.objects.all().order_by('-datetime')
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
 
-        # The sale_list is paginated by passing the filtered QuerySet to Paginator
-        paginator = Paginator(self.form_query(context['sale_list']), 50)
-        try:
-            # The requested page is grabbed
-            sales = paginator.page(page)
-        except PageNotAnInteger:
-            # If the requested page is not an integer
-            sales = paginator.page(1)
-        except EmptyPage:
-            # If the requested page is out of range, the last page is grabbed
-            sales = paginator.page(paginator.num_pages)
+        sales = self.form_query(Sale.objects.filter(shop=self.shop))
+        context['sale_count'] = self.get_approximate_count(
+            sales, compute=not (after or before))
 
-        context['sale_list'] = sales
+        # The sale_list is paginated on (datetime, id): every page costs the same.
+        paginator = KeysetPaginator(
+            sales.prefetch_related('saleproduct_set__product'), self.per_page)
+        context['sale_list'] = paginator.page(after=after, before=before)
+        prefetch_generic_foreign_keys(context['sale_list'], 'module', 'shop')
+        context['filters_querystring'] = self.get_filters_querystring().urlencode()
 
         for sale in context['sale_list']:
             if sale.from_shop() not in seen:
@@ -68,20 +111,9 @@ class SaleList(ShopMixin, BorgiaFormView):
 
     def form_query(self, query):
         if self.search:
+            users = search_users(self.search)
             query = query.filter(
-                Q(operator__last_name__icontains=self.search)
-                | Q(operator__first_name__icontains=self.search)
-                | Q(operator__surname__icontains=self.search)
-                | Q(operator__username__icontains=self.search)
-                | Q(recipient__last_name__icontains=self.search)
-                | Q(recipient__first_name__icontains=self.search)
-                | Q(recipient__surname__icontains=self.search)
-                | Q(recipient__username__icontains=self.search)
-                | Q(sender__last_name__icontains=self.search)
-                | Q(sender__first_name__icontains=self.search)
-                | Q(sender__surname__icontains=self.search)
-                | Q(sender__username__icontains=self.search)
-            )
+                Q(operator__in=users) | Q(recipient__in=users) | Q(sender__in=users))
 
         if self.date_begin:
             query = query.filter(
@@ -96,21 +128,23 @@ class SaleList(ShopMixin, BorgiaFormView):
 
         return query
 
-    def form_valid(self, form):
-        if form.cleaned_data['search']:
-            self.search = form.cleaned_data['search']
+    def set_filters(self, cleaned_data):
+        if cleaned_data['search']:
+            self.search = cleaned_data['search']
 
-        if form.cleaned_data['date_begin']:
-            self.date_begin = form.cleaned_data['date_begin']
+        if cleaned_data['date_begin']:
+            self.date_begin = cleaned_data['date_begin']
 
-        if form.cleaned_data['date_end']:
-            self.date_end = form.cleaned_data['date_end']
+        if cleaned_data['date_end']:
+            self.date_end = cleaned_data['date_end']
         try:
-            if form.cleaned_data['shop']:
-                self.query_shop = form.cleaned_data['shop']
+            if cleaned_data['shop']:
+                self.query_shop = cleaned_data['shop']
         except KeyError:
             pass
 
+    def form_valid(self, form):
+        self.set_filters(form.cleaned_data)
         return self.get(self.request, self.args, self.kwargs)
 
 
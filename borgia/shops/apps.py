@@ -6,4 +6,7 @@ class ShopConfig(AppConfig):
 
     def ready(self):
         # Import shop signals
-        from shops.signals import create_shop_groups
+        from shops.signals import (create_shop_groups,
+                                   invalidate_lateral_menus_on_shop_change,
+                                   invalidate_price_on_stockentry,
+                                   invalidate_prices_on_margin_profit)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shops.models import Product, Shop, rebuild_stock_ledger
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stock ledger of products from inventories, stock entries and sales.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', help='Name of the shop, all shops by default.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['shop']:
+            try:
+                shop = Shop.objects.get(name=options['shop'])
+            except Shop.DoesNotExist:
+                raise CommandError('Shop "%s" does not exist.' % options['shop'])
+            products = products.filter(shop=shop)
+
+        fixed = rebuild_stock_ledger(products)
+        for product in fixed:
+            self.stdout.write('Fixed stock ledger of %s (%s)' % (product, product.shop))
+        self.stdout.write(self.style.SUCCESS(
+            '%d product(s) checked, %d fixed.' % (len(products), len(fixed))))
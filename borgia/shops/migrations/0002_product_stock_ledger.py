@@ -0,0 +1,57 @@
+# Generated by Django 2.1.11 on 2026-10-17 06:44
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_stock_ledger(apps, schema_editor):
+    Product = apps.get_model('shops', 'Product')
+    InventoryProduct = apps.get_model('stocks', 'InventoryProduct')
+    StockEntryProduct = apps.get_model('stocks', 'StockEntryProduct')
+    SaleProduct = apps.get_model('sales', 'SaleProduct')
+
+    for product in Product.objects.all():
+        stockentryproducts = StockEntryProduct.objects.filter(product=product)
+        saleproducts = SaleProduct.objects.filter(product=product)
+        last_inventoryproduct = InventoryProduct.objects.filter(
+            product=product).select_related('inventory').order_by('-id').first()
+        if last_inventoryproduct is not None:
+            product.stock_base = last_inventoryproduct.quantity
+            last_inventory_datetime = last_inventoryproduct.inventory.datetime
+            stockentryproducts = stockentryproducts.filter(
+                stockentry__datetime__gte=last_inventory_datetime)
+            saleproducts = saleproducts.filter(
+                sale__datetime__gte=last_inventory_datetime)
+        product.stock_input = stockentryproducts.aggregate(
+            Sum('quantity'))['quantity__sum'] or 0
+        product.stock_output = saleproducts.aggregate(
+            Sum('quantity'))['quantity__sum'] or 0
+        product.save(update_fields=['stock_base', 'stock_input', 'stock_output'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shops', '0001_initial'),
+        ('stocks', '0002_auto_20190103_1237'),
+        ('sales', '0003_sale_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_base',
+            field=models.PositiveIntegerField(default=0, verbose_name='Stock au dernier inventaire'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_input',
+            field=models.PositiveIntegerField(default=0, verbose_name='Entrées depuis le dernier inventaire'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_output',
+            field=models.PositiveIntegerField(default=0, verbose_name='Ventes depuis le dernier inventaire'),
+        ),
+        migrations.RunPython(backfill_stock_ledger, migrations.RunPython.noop),
+    ]
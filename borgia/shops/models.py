@@ -1,11 +1,21 @@
 import decimal
 
+from django.apps import apps
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (Case, F, OuterRef, PositiveIntegerField,
+                              Subquery, Value, When)
 
-from configurations.utils import configuration_get
+from borgia.cache import (bump_version, get_versioned, get_versioned_many,
+                          set_versioned, set_versioned_many)
+from configurations.utils import configuration_get_value
+
+PRICE_CACHE_VERSION_KEY = 'shops.product_price.version'
+PRICE_CACHE_TIMEOUT = 60 * 60
+STOCK_LEDGER_FIELDS = ('stock_base', 'stock_input', 'stock_output')
 
 
 class Shop(models.Model):
@@ -74,6 +84,10 @@ class Product(models.Model):
     :param is_removed: is the product removed.
     :param unit: unit of the product.
     :param correcting_factor: for automatic price.
+    :param stock_base: quantity counted by the last inventory.
+    :param stock_input: quantity entered in stock since the last inventory.
+    :param stock_output: quantity sold since the last inventory, before the
+    correcting factor is applied.
     :type name: string
     :type is_manual: bool
     :type manual_price: decimal
@@ -82,6 +96,14 @@ class Product(models.Model):
     :type is_removed: bool
     :type unit: string
     :type correcting_factor: decimal
+    :type stock_base: integer
+    :type stock_input: integer
+    :type stock_output: integer
+
+    :note:: The stock_* fields are a ledger maintained by add_stock_input,
+    add_stock_output and set_stock_base, and rebuilt from the history by
+    rebuild_stock_ledger. They are never written by save on an existing
+    product.
     """
     UNIT_CHOICES = (('CL', 'cl'), ('G', 'g'))
 
@@ -102,6 +124,12 @@ class Product(models.Model):
                                                 MinValueValidator(decimal.Decimal(0))])
     is_active = models.BooleanField('Actif', default=True)
     is_removed = models.BooleanField('Retiré', default=False)
+    stock_base = models.PositiveIntegerField(
+        'Stock au dernier inventaire', default=0)
+    stock_input = models.PositiveIntegerField(
+        'Entrées depuis le dernier inventaire', default=0)
+    stock_output = models.PositiveIntegerField(
+        'Ventes depuis le dernier inventaire', default=0)
 
     class Meta:
         """
@@ -148,23 +176,67 @@ class Product(models.Model):
             else:
                 return str(round(value, 0)) + ' produit'
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The stock ledger is updated concurrently, by queries only.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in STOCK_LEDGER_FIELDS]
+        super().save(*args, **kwargs)
+        # Price parameters (is_manual, manual_price, correcting_factor) may
+        # have changed.
+        invalidate_product_price(self.pk)
+        self.__dict__.pop('_automatic_price', None)
+        # So may the stock estimation (correcting_factor) or the product
+        # lines of the stock valuations. Imported here, stocks depends on
+        # shops.
+        from stocks.models import invalidate_stock_valuations
+        invalidate_stock_valuations()
+
     def get_automatic_price(self):
+        """
+        Return the automatic price of the product.
+
+        The price is memoized on the instance and cached across requests, see
+        compute_automatic_price for the calculation.
+        """
+        try:
+            return self._automatic_price
+        except AttributeError:
+            pass
+
+        key = get_price_cache_key(self.pk)
+        versions, price = get_versioned(key, [PRICE_CACHE_VERSION_KEY])
+        if price is None:
+            price = self.compute_automatic_price()
+            set_versioned(key, versions, price, PRICE_CACHE_TIMEOUT)
+        self._automatic_price = price
+        return price
+
+    def compute_automatic_price(self):
         """
         Return the price calculated over the last stockentry concerning the product.
         If there is no stock entry realisated, return 0.
         """
         try:
-            margin_profit = configuration_get('MARGIN_PROFIT').get_value()
+            margin_profit = configuration_get_value('MARGIN_PROFIT')
 
             last_stockentry = self.stockentryproduct_set.order_by(
                 '-stockentry__datetime').first()
-            if last_stockentry is not None:
-                return round(decimal.Decimal(last_stockentry.unit_price() * self.correcting_factor * decimal.Decimal(1 + margin_profit / 100)), 4)
-            else:
-                return 0
+            return self.automatic_price_from_stockentry(last_stockentry, margin_profit)
         except IndexError:
             return decimal.Decimal(0)
 
+    def automatic_price_from_stockentry(self, last_stockentry, margin_profit):
+        """
+        Return the automatic price given the last stockentry of the product
+        (None if there isn't any) and the margin profit.
+        """
+        if last_stockentry is not None:
+            return round(decimal.Decimal(last_stockentry.unit_price() * self.correcting_factor * decimal.Decimal(1 + margin_profit / 100)), 4)
+        else:
+            return 0
+
     def deviating_price_from_auto(self):
         automatic_price = self.get_automatic_price()
         if automatic_price == 0:
@@ -228,17 +300,33 @@ class Product(models.Model):
         except AttributeError:
             return self.stockentryproduct_set.all()
 
-    def current_stock_estimated(self, offset=0):
+    def compute_stock_ledger(self, offset=0):
         """
-        Calculate the theorical stock since the last inventory.
-        Used in order to modify the correcting_factor comparing this value with
-        the value given by the next inventory.
+        Return the stock ledger computed from the history: the quantity of the
+        last inventory, the quantity entered and the quantity sold since.
         """
         stock_base = self.last_inventoryproduct_value(offset)
         stock_input = sum(
             se.quantity for se in self.stockentries_since_last_inventory(offset))
         stock_output = sum(
             s.quantity for s in self.sales_since_last_inventory(offset))
+        return stock_base, stock_input, stock_output
+
+    def current_stock_estimated(self, offset=0):
+        """
+        Calculate the theorical stock since the last inventory.
+        Used in order to modify the correcting_factor comparing this value with
+        the value given by the next inventory.
+
+        The current stock is read from the stock ledger, previous ones
+        (offset > 0) are computed from the history.
+        """
+        if offset == 0:
+            stock_base, stock_input, stock_output = (
+                self.stock_base, self.stock_input, self.stock_output)
+        else:
+            stock_base, stock_input, stock_output = self.compute_stock_ledger(
+                offset)
         corrected_stock_output = stock_output * \
             decimal.Decimal(self.correcting_factor)
 
@@ -291,3 +379,164 @@ class Product(models.Model):
             self.save()
         except (ZeroDivisionError, decimal.DivisionByZero, decimal.DivisionUndefined, decimal.InvalidOperation):
             pass
+
+
+def _add_to_stock_ledger(field, quantities):
+    quantities = {pk: quantity for pk, quantity in quantities.items()
+                  if quantity != 0}
+    if quantities:
+        Product.objects.filter(pk__in=quantities.keys()).update(**{
+            field: F(field) + Case(
+                *[When(pk=pk, then=Value(quantity))
+                  for pk, quantity in quantities.items()],
+                default=Value(0),
+                output_field=PositiveIntegerField()
+            )
+        })
+
+
+def add_stock_input(quantities):
+    """
+    Record quantities entered in stock, in a single UPDATE statement.
+
+    :param quantities: quantities, indexed by product pk.
+    :type quantities: dict {integer: integer}
+    """
+    _add_to_stock_ledger('stock_input', quantities)
+
+
+def add_stock_output(quantities):
+    """
+    Record quantities sold, in a single UPDATE statement.
+
+    :param quantities: quantities, indexed by product pk.
+    :type quantities: dict {integer: integer}
+    """
+    _add_to_stock_ledger('stock_output', quantities)
+
+
+def set_stock_base(quantities):
+    """
+    Record the quantities counted by an inventory, in a single UPDATE
+    statement. The quantities entered and sold are reset.
+
+    :param quantities: quantities, indexed by product pk.
+    :type quantities: dict {integer: integer}
+    """
+    if quantities:
+        Product.objects.filter(pk__in=quantities.keys()).update(
+            stock_base=Case(
+                *[When(pk=pk, then=Value(quantity))
+                  for pk, quantity in quantities.items()],
+                output_field=PositiveIntegerField()
+            ),
+            stock_input=0,
+            stock_output=0
+        )
+
+
+def rebuild_stock_ledger(products):
+    """
+    Recompute the stock ledger of products from the history (inventories,
+    stock entries and sales).
+
+    :param products: products, mandatory.
+    :type products: iterable of Product objects
+    :returns: products whose ledger was wrong
+    :rtype: list of Product objects
+    """
+    fixed = []
+    with transaction.atomic():
+        for product in products:
+            ledger = tuple(int(value) for value in product.compute_stock_ledger())
+            if ledger != (product.stock_base, product.stock_input, product.stock_output):
+                product.stock_base, product.stock_input, product.stock_output = ledger
+                Product.objects.filter(pk=product.pk).update(
+                    **dict(zip(STOCK_LEDGER_FIELDS, ledger)))
+                fixed.append(product)
+    return fixed
+
+
+def get_price_cache_key(product_pk):
+    """
+    Return the cache key of the automatic price of a product.
+
+    Prices are stored with a global version, changed when every price must
+    be recomputed (MARGIN_PROFIT change for instance), see borgia.cache.
+    """
+    return 'shops.product_price.{0}'.format(product_pk)
+
+
+def invalidate_product_price(product_pk):
+    """
+    Remove the cached automatic price of a product.
+    """
+    cache.delete(get_price_cache_key(product_pk))
+
+
+def invalidate_products_prices(product_pks):
+    """
+    Remove the cached automatic prices of several products at once.
+    """
+    cache.delete_many([get_price_cache_key(pk) for pk in product_pks])
+
+
+def invalidate_all_product_prices():
+    """
+    Invalidate the cached automatic price of every product.
+    """
+    bump_version(PRICE_CACHE_VERSION_KEY)
+
+
+def get_products_prices(products):
+    """
+    Return the prices of several products, indexed by product pk.
+
+    Cached automatic prices are read at once, with their version. The
+    missing ones are computed with one query for the last stockentries, and
+    cached.
+
+    :param products: products, mandatory.
+    :type products: iterable of Product objects
+    :returns: dict {product pk: price}
+    """
+    products = {product.pk: product for product in products}
+    keys = {get_price_cache_key(pk): pk for pk, product in products.items()
+            if not product.is_manual}
+    versions, cached_prices = get_versioned_many(list(keys), [PRICE_CACHE_VERSION_KEY])
+    prices = {keys[key]: price for key, price in cached_prices.items()}
+
+    missing = [pk for key, pk in keys.items() if key not in cached_prices]
+    if missing:
+        stockentryproduct_model = apps.get_model('stocks', 'StockEntryProduct')
+        last_stockentries = stockentryproduct_model.objects.filter(
+            pk__in=Subquery(
+                Product.objects.filter(pk__in=missing).annotate(
+                    last_stockentry=Subquery(
+                        stockentryproduct_model.objects.filter(
+                            product=OuterRef('pk')).order_by(
+                                '-stockentry__datetime').values('pk')[:1])
+                ).values('last_stockentry')))
+        last_stockentries = {sep.product_id: sep for sep in last_stockentries}
+        margin_profit = configuration_get_value('MARGIN_PROFIT')
+
+        to_cache = {}
+        for pk in missing:
+            product = products[pk]
+            last_stockentry = last_stockentries.get(pk)
+            if last_stockentry is not None:
+                last_stockentry.product = product
+            try:
+                price = product.automatic_price_from_stockentry(
+                    last_stockentry, margin_profit)
+            except (ZeroDivisionError, decimal.DivisionUndefined, decimal.DivisionByZero):
+                price = decimal.Decimal(0)
+            else:
+                to_cache[get_price_cache_key(pk)] = price
+            prices[pk] = price
+        set_versioned_many(to_cache, versions, PRICE_CACHE_TIMEOUT)
+
+    for pk, product in products.items():
+        if product.is_manual:
+            prices[pk] = product.manual_price
+    return prices
@@ -1,10 +1,14 @@
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from shops.models import Shop
+from borgia.utils import invalidate_lateral_menus_shops
+from configurations.models import Configuration
+from shops.models import (Shop, invalidate_all_product_prices,
+                          invalidate_product_price)
+from stocks.models import StockEntryProduct
 from shops.utils import (DEFAULT_PERMISSIONS_ASSOCIATES,
                          DEFAULT_PERMISSIONS_CHIEFS)
 
@@ -56,3 +60,30 @@ def create_shop_groups(instance, created, **kwargs):
         else:
             vice_presidents.permissions.add(manage_chiefs)
             vice_presidents.save()
+
+
+@receiver(post_save, sender=StockEntryProduct)
+@receiver(post_delete, sender=StockEntryProduct)
+def invalidate_price_on_stockentry(instance, **kwargs):
+    """
+    The automatic price of a product depends on its last stock entry.
+    """
+    invalidate_product_price(instance.product_id)
+
+
+@receiver(post_save, sender=Configuration)
+def invalidate_prices_on_margin_profit(instance, **kwargs):
+    """
+    The automatic price of every product depends on MARGIN_PROFIT.
+    """
+    if instance.name == 'MARGIN_PROFIT':
+        invalidate_all_product_prices()
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def invalidate_lateral_menus_on_shop_change(**kwargs):
+    """
+    Lateral menus list shops.
+    """
+    invalidate_lateral_menus_shops()
@@ -1,5 +1,10 @@
+from django.contrib.auth.models import Group
+
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
 from shops.models import Product, Shop
+from shops.utils import (get_managed_shop_ids, get_shops_managed,
+                         is_shop_manager)
+from users.models import User
 
 
 class BaseShopTestCase(BaseBorgiaViewsTestCase):
@@ -19,6 +24,40 @@ class ShopTestCase(BaseShopTestCase):
         self.assertEqual(self.shop2.__str__(), 'Lowercase name')
 
 
+class ShopManagersTestCase(BaseShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chief = User.objects.create(username='chief')
+        self.chief.groups.add(Group.objects.get(name='chiefs-Shop1 name'))
+        self.associate = User.objects.create(username='associate')
+        self.associate.groups.add(
+            Group.objects.get(name='associates-lowercase name'))
+        self.associate.groups.add(Group.objects.get(name='chiefs-Shop1 name'))
+        self.member = User.objects.create(username='member')
+
+    def test_get_managed_shop_ids(self):
+        self.assertEqual(get_managed_shop_ids(self.chief), {self.shop1.pk})
+        self.assertEqual(get_managed_shop_ids(self.associate),
+                         {self.shop1.pk, self.shop2.pk})
+        self.assertEqual(get_managed_shop_ids(self.member), set())
+
+    def test_cached_on_user(self):
+        with self.assertNumQueries(1):
+            get_managed_shop_ids(self.associate)
+            self.assertTrue(is_shop_manager(self.shop1, self.associate))
+            self.assertTrue(is_shop_manager(self.shop2, self.associate))
+
+    def test_is_shop_manager(self):
+        self.assertTrue(is_shop_manager(self.shop1, self.chief))
+        self.assertFalse(is_shop_manager(self.shop2, self.chief))
+        self.assertFalse(is_shop_manager(self.shop1, self.member))
+
+    def test_get_shops_managed(self):
+        self.assertEqual(get_shops_managed(self.chief), [self.shop1])
+        with self.assertNumQueries(1):
+            self.assertEqual(get_shops_managed(self.member), [])
+
+
 class ProductTestCase(BaseShopTestCase):
     def setUp(self):
         super().setUp()
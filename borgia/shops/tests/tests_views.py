@@ -164,6 +164,25 @@ class ShopCheckupViewTest(BaseFocusShopViewsTest):
         super().offline_user_redirection()
 
 
+class ShopWorkboardViewTest(BaseFocusShopViewsTest):
+    url_view = 'url_shop_workboard'
+
+    def test_as_president_get(self):
+        super().as_president_get()
+
+    def test_as_chief_get(self):
+        super().as_chief_get()
+
+    def test_not_existing_shop_get(self):
+        super().not_existing_shop_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+
 class BaseGeneralProductViewsTest(BaseShopsViewsTest):
     url_view = None
 
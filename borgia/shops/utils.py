@@ -1,4 +1,6 @@
 from django.contrib.auth.models import Group
+from django.db.models import Q, Value
+from django.db.models.functions import Concat
 from django.urls import reverse
 
 from borgia.utils import (get_permission_name_group_managing,
@@ -23,26 +25,53 @@ DEFAULT_PERMISSIONS_ASSOCIATES = ['add_user', 'view_user',
                                   'add_inventory', 'view_inventory']
 
 
+def get_managed_shop_ids(user):
+    """
+    Return the ids of the shops managed (as chief or associate) by the user.
+
+    Managers groups are named chiefs-<shop name> and associates-<shop name>,
+    so the shops are resolved from the group names of the user in a single
+    query. The result is cached on the user object, for the request.
+
+    :returns: ids of the shops managed
+    :rtype: frozenset
+    """
+    try:
+        return user._managed_shop_ids
+    except AttributeError:
+        pass
+
+    if user.pk is None:
+        managed_shop_ids = frozenset()
+    else:
+        group_names = user.groups.values('name')
+        managed_shop_ids = frozenset(
+            Shop.objects.annotate(
+                chiefs_group_name=Concat(Value('chiefs-'), 'name'),
+                associates_group_name=Concat(Value('associates-'), 'name')
+            ).filter(
+                Q(chiefs_group_name__in=group_names) |
+                Q(associates_group_name__in=group_names)
+            ).values_list('pk', flat=True))
+    user._managed_shop_ids = managed_shop_ids
+    return managed_shop_ids
+
+
 def is_shop_manager(shop, user):
     """
     Return True if the user is a chief or associate.
     """
-    if user in shop.get_managers():
-        return True
-    else:
-        return False
+    return shop.pk in get_managed_shop_ids(user)
 
 
 def get_shops_managed(user):
     """
     Return the list of shop managed by the user.
     """
-    shop_list = []
-    for shop in Shop.objects.all():
-        if is_shop_manager(shop, user):
-            shop_list.append(shop)
-
-    return shop_list
+    managed_shop_ids = get_managed_shop_ids(user)
+    if not managed_shop_ids:
+        return []
+    return list(Shop.objects.filter(pk__in=managed_shop_ids))
 
 
 def get_shops_tree(user, is_association_manager):
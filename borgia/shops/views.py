@@ -3,14 +3,14 @@ import decimal
 
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
-from django.db.models import Q
+from django.db.models import Q, Sum
 from django.shortcuts import redirect, render
 from django.urls import reverse
 
 from borgia.views import BorgiaFormView, BorgiaView
-from configurations.utils import configuration_get
+from configurations.utils import configuration_get_value
 from modules.models import CategoryProduct
-from sales.models import Sale
+from sales.models import Sale, get_depletion_forecast
 from shops.forms import (ProductCreateForm, ProductListForm, ProductUpdateForm,
                          ProductUpdatePriceForm, ShopCheckupSearchForm,
                          ShopCreateForm, ShopUpdateForm)
@@ -139,8 +139,12 @@ class ShopCheckup(ShopMixin, BorgiaFormView):
             q_sales = q_sales.filter(
                 products__pk__in=[p.pk for p in self.products])
 
+        if self.products:
+            q_sales = q_sales.distinct()
+
         if self.sales_value is None:
-            self.sales_value = sum(s.amount() for s in q_sales)
+            self.sales_value = q_sales.aggregate(
+                value=Sum('total'))['value'] or 0
 
         if self.date_begin == datetime.date.today().replace(day=1) and self.date_end == datetime.date.today():
             current_month = True
@@ -204,17 +208,32 @@ class ShopWorkboard(ShopMixin, BorgiaView):
         context = super().get_context_data(**kwargs)
         context['sale_list'] = self.get_sales()
         context['purchase_list'] = self.get_purchases()
+        context['forecast_list'] = self.get_forecast()
         return render(request, self.template_name, context=context)
 
+    def get_forecast(self):
+        """
+        Return the sold products of the shop, the closest to run out first.
+        """
+        products = get_depletion_forecast(
+            self.shop.product_set.filter(is_removed=False, is_active=True))
+        products = [product for product in products if product.days_left is not None]
+        for product in products:
+            product.sales_short_display = product.get_quantity_display(product.sales_short)
+            product.sales_long_display = product.get_quantity_display(product.sales_long)
+            product.velocity_display = product.get_quantity_display(product.velocity)
+        return sorted(products, key=lambda product: (product.days_left, product.name))
+
     def get_sales(self):
         sales = {}
         s_list = Sale.objects.filter(shop=self.shop).order_by('-datetime')
-        sales['weeks'] = self.weeklist(
-            datetime.datetime.now() - datetime.timedelta(days=30),
-            datetime.datetime.now())
-        sales['data_weeks'] = self.sale_data_weeks(s_list, sales['weeks'])[0]
-        sales['total'] = self.sale_data_weeks(s_list, sales['weeks'])[1]
-        sales['all'] = s_list[:7]
+        start = datetime.datetime.now() - datetime.timedelta(days=30)
+        sales['weeks'] = self.weeklist(start, datetime.datetime.now())
+        # Only sales of the displayed weeks are needed, from the first monday
+        first_day = start.date() - datetime.timedelta(days=start.weekday())
+        sales['data_weeks'], sales['total'] = self.sale_data_weeks(
+            s_list.filter(datetime__date__gte=first_day), sales['weeks'])
+        sales['all'] = s_list.prefetch_related('saleproduct_set__product')[:7]
         return sales
 
     # TODO: purchases with stock
@@ -235,12 +254,12 @@ class ShopWorkboard(ShopMixin, BorgiaView):
     def sale_data_weeks(weeklist, weeks):
         amounts = [0 for _ in range(0, len(weeks))]
         total = 0
-        for obj in weeklist:
-            string = (str(obj.datetime.isocalendar()[1])
-                      + '-' + str(obj.datetime.year))
+        for obj_datetime, obj_total in weeklist.values_list('datetime', 'total'):
+            string = (str(obj_datetime.isocalendar()[1])
+                      + '-' + str(obj_datetime.year))
             if string in weeks:
-                amounts[weeks.index(string)] += obj.amount()
-                total += obj.amount()
+                amounts[weeks.index(string)] += obj_total
+                total += obj_total
         return amounts, total
 
     @staticmethod
@@ -435,8 +454,8 @@ class ProductUpdatePrice(ProductMixin, BorgiaFormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['margin_profit'] = configuration_get(
-            'MARGIN_PROFIT').get_value()
+        context['margin_profit'] = configuration_get_value(
+            'MARGIN_PROFIT')
         return context
 
     def get_initial(self):
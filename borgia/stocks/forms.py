@@ -2,15 +2,19 @@ from django import forms
 from django.forms.formsets import BaseFormSet
 
 from shops.models import Product, Shop
+from stocks.models import VALUATION_AVERAGE, VALUATION_METHODS
 
 
 class StockEntryProductForm(forms.Form):
     def __init__(self, *args, **kwargs):
         shop = kwargs.pop('shop')
+        products = kwargs.pop('products', None)
         super().__init__(*args, **kwargs)
+        if products is None:
+            products = Product.objects.filter(shop=shop, is_removed=False)
         product_choice = ([(None, 'Sélectionner un produit')] +
                           [(str(product.pk)+'/'+str(product.get_unit_display()), product.__str__())
-                           for product in Product.objects.filter(shop=shop, is_removed=False)]
+                           for product in products]
                           )
         self.fields['product'].choices = product_choice
 
@@ -90,6 +94,11 @@ class BaseInventoryProductFormSet(BaseFormSet):
             products.append(product)
 
 
+class StockEntryImportForm(forms.Form):
+    invoice = forms.FileField(label='Facture (CSV ou Excel)',
+                              widget=forms.ClearableFileInput(attrs={'class': 'btn btn-default btn-file'}))
+
+
 class AdditionnalDataStockEntryForm(forms.Form):
     isAddingInventory = forms.ChoiceField(label='Faire également un inventaire des stocks',
                                           choices=([('with', 'Avec'), ('without', 'Sans')]))
@@ -128,11 +137,14 @@ class AdditionnalDataInventoryForm(forms.Form):
 class InventoryProductForm(forms.Form):
     def __init__(self, *args, **kwargs):
         shop = kwargs.pop('shop')
+        products = kwargs.pop('products', None)
         super().__init__(*args, **kwargs)
 
+        if products is None:
+            products = Product.objects.filter(shop=shop, is_removed=False)
         product_choice = ([(None, 'Sélectionner un produit')] +
                           [(str(product.pk)+'/'+str(product.get_unit_display()), product.__str__())
-                           for product in Product.objects.filter(shop=shop, is_removed=False)]
+                           for product in products]
                           )
         self.fields['product'].choices = product_choice
 
@@ -182,3 +194,24 @@ class InventoryListDateForm(forms.Form):
         widget=forms.DateInput(attrs={'class': 'datepicker'}),
         required=False
     )
+
+
+class StockAtDateForm(forms.Form):
+    date = forms.DateField(
+        label='Date',
+        input_formats=['%d/%m/%Y'],
+        widget=forms.DateInput(attrs={'class': 'datepicker'})
+    )
+
+
+class StockValuationForm(forms.Form):
+    date = forms.DateField(
+        label='Date',
+        input_formats=['%d/%m/%Y'],
+        widget=forms.DateInput(attrs={'class': 'datepicker'})
+    )
+    method = forms.ChoiceField(
+        label='Méthode',
+        choices=VALUATION_METHODS,
+        initial=VALUATION_AVERAGE
+    )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from shops.models import Shop
+from stocks.models import get_stocks_at
+from stocks.utils import end_of_day
+
+
+class Command(BaseCommand):
+    help = 'Print the estimated stock of every product of a shop at a given moment.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop', help='Name of the shop.')
+        parser.add_argument(
+            'moment', help='YYYY-MM-DD (end of the day) or YYYY-MM-DD HH:MM.')
+
+    def handle(self, *args, **options):
+        try:
+            shop = Shop.objects.get(name=options['shop'])
+        except Shop.DoesNotExist:
+            raise CommandError('Shop "%s" does not exist.' % options['shop'])
+
+        moment = parse_datetime(options['moment'])
+        if moment is None:
+            date = parse_date(options['moment'])
+            if date is None:
+                raise CommandError('Invalid moment "%s".' % options['moment'])
+            moment = end_of_day(date)
+        elif is_naive(moment):
+            moment = make_aware(moment)
+
+        products = get_stocks_at(
+            shop.product_set.filter(is_removed=False).order_by('name'), moment)
+        for product in products:
+            self.stdout.write('%s\t%s' % (product, product.get_quantity_display(product.stock_at)))
@@ -0,0 +1,24 @@
+# Generated by Django 2.1.11 on 2026-10-17 06:55
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0002_auto_20190103_1237'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='inventory',
+            name='datetime',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Date'),
+        ),
+        migrations.AlterField(
+            model_name='stockentry',
+            name='datetime',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Date'),
+        ),
+    ]
@@ -1,12 +1,31 @@
-from decimal import Decimal
+import itertools
+from decimal import (ROUND_HALF_UP, Decimal, DivisionByZero,
+                     DivisionUndefined, InvalidOperation)
 
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.utils.timezone import now
+from django.db import models, transaction
+from django.db.backends.utils import format_number
+from django.db.models import (Case, DecimalField, IntegerField, OuterRef,
+                              Subquery, Sum, Value, When)
+from django.utils.timezone import localdate, now
 
-from shops.models import Product, Shop
+from borgia.cache import bump_version, get_versioned, set_versioned
+from modules.utils import invalidate_catalogs
+from sales.models import SaleProduct
+from shops.models import (Product, Shop, add_stock_input,
+                          invalidate_products_prices, set_stock_base)
+from stocks.utils import end_of_day
 from users.models import User
 
+VALUATION_AVERAGE = 'average'
+VALUATION_FIFO = 'fifo'
+VALUATION_METHODS = (
+    (VALUATION_AVERAGE, 'Coût moyen pondéré'),
+    (VALUATION_FIFO, 'Premier entré, premier sorti (FIFO)'),
+)
+VALUATION_CACHE_VERSION_KEY = 'stocks.valuation.version'
+VALUATION_CACHE_TIMEOUT = 60 * 60 * 24
+
 
 class StockEntry(models.Model):
     """
@@ -14,7 +33,7 @@ class StockEntry(models.Model):
 
     :note:: Initial Django Permission (add, change, delete, view) are added.
     """
-    datetime = models.DateTimeField('Date', default=now)
+    datetime = models.DateTimeField('Date', default=now, db_index=True)
     operator = models.ForeignKey(User, on_delete=models.CASCADE)
     products = models.ManyToManyField(Product, through='StockEntryProduct')
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
@@ -72,15 +91,57 @@ class Inventory(models.Model):
     :note:: Initial Django Permission (add, change, delete, view) are added.
     """
 
-    datetime = models.DateTimeField('Date', default=now)
+    datetime = models.DateTimeField('Date', default=now, db_index=True)
     operator = models.ForeignKey(User, on_delete=models.CASCADE)
     products = models.ManyToManyField(Product, through='InventoryProduct')
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
 
     def update_correcting_factors(self):
-        for inventoryproduct in self.inventoryproduct_set.all():
-            inventoryproduct.product.update_correcting_factor(
-                inventoryproduct.quantity)
+        """
+        Update the correcting factors of every product of the inventory.
+
+        Same calculation as Product.update_correcting_factor, for all
+        products at once: the previous inventory, the stock entries and the
+        sales since are loaded with one query, and the factors are written
+        with one UPDATE statement.
+        """
+        next_stocks = dict(
+            self.inventoryproduct_set.order_by('pk').values_list('product', 'quantity'))
+        if not next_stocks:
+            return
+
+        factor_field = Product._meta.get_field('correcting_factor')
+        correcting_factors = {}
+        for product in get_stock_history(next_stocks.keys()):
+            stock_base = product.previous_inventory_quantity
+            if stock_base is None:
+                stock_base = Decimal(0)
+            try:
+                correcting_factor = Decimal(
+                    (stock_base + product.previous_stock_input - next_stocks[product.pk])
+                    / product.previous_stock_output
+                )
+            except (ZeroDivisionError, DivisionByZero, DivisionUndefined, InvalidOperation):
+                continue
+            # Rounded the same way as when saving the field.
+            correcting_factors[product.pk] = Decimal(format_number(
+                correcting_factor, factor_field.max_digits, factor_field.decimal_places))
+
+        if correcting_factors:
+            Product.objects.filter(pk__in=correcting_factors.keys()).update(
+                correcting_factor=Case(
+                    *[When(pk=pk, then=Value(factor))
+                      for pk, factor in correcting_factors.items()],
+                    output_field=DecimalField(
+                        max_digits=factor_field.max_digits,
+                        decimal_places=factor_field.decimal_places)
+                )
+            )
+            # Automatic prices and stock valuations depend on the correcting
+            # factor, and catalogs hold the products.
+            invalidate_products_prices(correcting_factors.keys())
+            invalidate_stock_valuations()
+            invalidate_catalogs()
 
 
 class InventoryProduct(models.Model):
@@ -99,3 +160,318 @@ class InventoryProduct(models.Model):
 
     def get_quantity_display(self):
         return self.product.get_quantity_display(self.quantity)
+
+
+def create_stockentry(shop, operator, stockentryproducts):
+    """
+    Create a stock entry and all its lines at once, and record the
+    quantities in the stock ledger.
+
+    The automatic prices of the products, which depend on their last stock
+    entry, are invalidated at once.
+
+    :param shop: shop of the stock entry, mandatory.
+    :param operator: user doing the stock entry, mandatory.
+    :param stockentryproducts: lines of the stock entry, not saved yet.
+    :type shop: Shop object
+    :type operator: User object
+    :type stockentryproducts: list of StockEntryProduct objects
+    :returns: the stock entry created
+    :rtype: StockEntry object
+    """
+    quantities = {}
+    for stockentryproduct in stockentryproducts:
+        quantities[stockentryproduct.product_id] = quantities.get(
+            stockentryproduct.product_id, 0) + stockentryproduct.quantity
+
+    with transaction.atomic():
+        stockentry = StockEntry.objects.create(operator=operator, shop=shop)
+        for stockentryproduct in stockentryproducts:
+            stockentryproduct.stockentry = stockentry
+        StockEntryProduct.objects.bulk_create(stockentryproducts)
+        add_stock_input(quantities)
+    invalidate_products_prices(quantities.keys())
+    invalidate_stock_valuations()
+    return stockentry
+
+
+def create_inventory(shop, operator, quantities):
+    """
+    Create an inventory and all its lines at once, and record the quantities
+    in the stock ledger.
+
+    :param shop: shop of the inventory, mandatory.
+    :param operator: user doing the inventory, mandatory.
+    :param quantities: quantities counted, indexed by product pk.
+    :type shop: Shop object
+    :type operator: User object
+    :type quantities: dict {integer: integer}
+    :returns: the inventory created
+    :rtype: Inventory object
+    """
+    with transaction.atomic():
+        inventory = Inventory.objects.create(operator=operator, shop=shop)
+        InventoryProduct.objects.bulk_create([
+            InventoryProduct(inventory=inventory, product_id=pk, quantity=quantity)
+            for pk, quantity in quantities.items()
+        ])
+        set_stock_base(quantities)
+    invalidate_stock_valuations()
+    return inventory
+
+
+def _quantity_since_checkpoint(model, datetime_field, checkpoint, until=None):
+    """
+    Return the expression of the quantity of the model (StockEntryProduct or
+    SaleProduct) related to the outer product, dated since the checkpoint
+    annotation, and until the given moment if any.
+
+    Without checkpoint (None), the whole history is counted.
+    """
+    def total(queryset):
+        return Subquery(
+            queryset.order_by().values('product').annotate(
+                total=Sum('quantity')).values('total'),
+            output_field=IntegerField())
+
+    history = model.objects.filter(product=OuterRef('pk'))
+    if until is not None:
+        history = history.filter(**{datetime_field + '__lte': until})
+    return Case(
+        When(**{checkpoint + '__isnull': True, 'then': total(history)}),
+        default=total(history.filter(**{
+            datetime_field + '__gte': OuterRef(checkpoint)})),
+        output_field=IntegerField()
+    )
+
+
+def get_stock_history(product_pks):
+    """
+    Return the products annotated with their stock history since the
+    previous inventory (the one before the last), in one query:
+    - previous_inventory_quantity: quantity of the previous inventory, None
+    if there isn't any,
+    - previous_stock_input: quantity entered since,
+    - previous_stock_output: quantity sold since.
+
+    Without previous inventory, the whole history is counted.
+    """
+    previous_inventoryproduct = InventoryProduct.objects.filter(
+        product=OuterRef('pk')).order_by('-id')[1:2]
+
+    products = Product.objects.filter(pk__in=product_pks).annotate(
+        previous_inventory_quantity=Subquery(
+            previous_inventoryproduct.values('quantity')),
+        previous_inventory_datetime=Subquery(
+            previous_inventoryproduct.values('inventory__datetime'))
+    ).annotate(
+        previous_stock_input=_quantity_since_checkpoint(
+            StockEntryProduct, 'stockentry__datetime', 'previous_inventory_datetime'),
+        previous_stock_output=_quantity_since_checkpoint(
+            SaleProduct, 'sale__datetime', 'previous_inventory_datetime')
+    )
+    for product in products:
+        product.previous_stock_input = product.previous_stock_input or 0
+        product.previous_stock_output = product.previous_stock_output or 0
+        yield product
+
+
+def get_stocks_at(products, moment):
+    """
+    Return the products with the stock estimated at a given moment, in one
+    query.
+
+    The checkpoint of each product is its last inventory before the moment.
+    The stock entries and the sales between the checkpoint and the moment
+    are added, the sales being corrected by the correcting factor as in
+    Product.current_stock_estimated.
+
+    :param products: products, mandatory.
+    :param moment: moment of the stock, mandatory.
+    :type products: Product queryset
+    :type moment: aware datetime
+    :returns: products, with the attributes checkpoint_quantity (None
+    without inventory before the moment), checkpoint_datetime, stock_input_at,
+    stock_output_at and stock_at.
+    :rtype: list of Product objects
+    """
+    checkpoint = InventoryProduct.objects.filter(
+        product=OuterRef('pk'), inventory__datetime__lte=moment
+    ).order_by('-inventory__datetime', '-id')[:1]
+
+    products = products.annotate(
+        checkpoint_quantity=Subquery(checkpoint.values('quantity')),
+        checkpoint_datetime=Subquery(checkpoint.values('inventory__datetime'))
+    ).annotate(
+        stock_input_at=_quantity_since_checkpoint(
+            StockEntryProduct, 'stockentry__datetime', 'checkpoint_datetime', moment),
+        stock_output_at=_quantity_since_checkpoint(
+            SaleProduct, 'sale__datetime', 'checkpoint_datetime', moment)
+    )
+
+    products = list(products)
+    for product in products:
+        product.stock_input_at = product.stock_input_at or 0
+        product.stock_output_at = product.stock_output_at or 0
+        product.stock_at = (
+            (product.checkpoint_quantity or 0) + product.stock_input_at
+            - product.stock_output_at * Decimal(product.correcting_factor))
+    return products
+
+
+def _unit_costs_average(stockentries):
+    """
+    Return the weighted-average cost of one unit (CL, G or product), over
+    all the stock entries of a product.
+
+    :param stockentries: (quantity, price) of the stock entries, by date.
+    :type stockentries: iterable of tuples
+    :returns: the cost of one unit, None without stock entry.
+    """
+    total_quantity = 0
+    total_price = Decimal(0)
+    for quantity, price in stockentries:
+        total_quantity += quantity
+        total_price += price
+    if not total_quantity:
+        return None
+    return total_price / total_quantity
+
+
+def _stock_value_fifo(stockentries, stock):
+    """
+    Return the value of the stock of a product, first in first out: the
+    units left are the last ones entered, valued at their own cost.
+
+    Units beyond the quantities entered are valued at the cost of the oldest
+    stock entry.
+
+    :param stockentries: (quantity, price) of the stock entries, by date.
+    :param stock: quantity in stock.
+    :type stockentries: iterable of tuples
+    :type stock: Decimal
+    :returns: the value of the stock, None without stock entry.
+    """
+    stockentries = [(quantity, price) for quantity, price in stockentries if quantity]
+    if not stockentries:
+        return None
+    value = Decimal(0)
+    remaining = stock
+    for quantity, price in reversed(stockentries):
+        if remaining <= 0:
+            break
+        taken = min(remaining, quantity)
+        value += price * taken / quantity
+        remaining -= taken
+    if remaining > 0:
+        quantity, price = stockentries[0]
+        value += price * remaining / quantity
+    return value
+
+
+def compute_stock_valuation(shop, moment, method=VALUATION_AVERAGE):
+    """
+    Return the value of the stock of every product of the shop at a given
+    moment.
+
+    The stock is the one estimated by get_stocks_at, negative stocks being
+    worth nothing. The stock entries until the moment are streamed with one
+    query, ordered by product and date, and each product is valued in a
+    single pass over its own entries.
+
+    :param shop: shop, mandatory.
+    :param moment: moment of the stock, mandatory.
+    :param method: VALUATION_AVERAGE or VALUATION_FIFO.
+    :type shop: Shop object
+    :type moment: aware datetime
+    :type method: string
+    :returns: one dict per product, ordered by name, with the keys pk, name,
+    unit, quantity (in CL/G/unit), quantity_display, unit_cost (for L/KG/unit,
+    None without stock entry) and value.
+    :rtype: list of dicts
+    """
+    if method not in dict(VALUATION_METHODS):
+        raise ValueError("Unknown valuation method %s." % method)
+
+    products = get_stocks_at(
+        shop.product_set.filter(is_removed=False).order_by('name'), moment)
+    stockentries = StockEntryProduct.objects.filter(
+        product__in=[product.pk for product in products],
+        stockentry__datetime__lte=moment
+    ).order_by('product', 'stockentry__datetime', 'pk').values_list(
+        'product', 'quantity', 'price')
+
+    values = {}
+    for pk, rows in itertools.groupby(stockentries.iterator(), key=lambda row: row[0]):
+        values[pk] = [(quantity, price) for _, quantity, price in rows]
+
+    cent = Decimal('0.01')
+    valuation = []
+    for product in products:
+        stock = max(Decimal(product.stock_at), Decimal(0))
+        entries = values.get(product.pk, [])
+        if method == VALUATION_FIFO:
+            value = _stock_value_fifo(entries, stock)
+            unit_cost = value / stock if value is not None and stock else None
+            if unit_cost is None:
+                unit_cost = _unit_costs_average(entries[-1:])
+        else:
+            unit_cost = _unit_costs_average(entries)
+            value = unit_cost * stock if unit_cost is not None else None
+
+        if unit_cost is not None:
+            # Cost for L/KG, as StockEntryProduct.unit_price.
+            unit_cost *= {'CL': 100, 'G': 1000}.get(product.unit, 1)
+            unit_cost = unit_cost.quantize(cent, rounding=ROUND_HALF_UP)
+        valuation.append({
+            'pk': product.pk,
+            'name': product.name,
+            'unit': product.get_upper_unit_display(),
+            'quantity': stock,
+            'quantity_display': product.get_quantity_display(stock),
+            'unit_cost': unit_cost,
+            'value': (value or Decimal(0)).quantize(cent, rounding=ROUND_HALF_UP)
+        })
+    return valuation
+
+
+def get_stock_valuation_cache_key(shop_pk, date, method):
+    """
+    Return the cache key of the stock valuation of a shop at the end of a
+    day. Valuations are stored with a global version, see borgia.cache.
+    """
+    return 'stocks.valuation.{0}.{1}.{2}'.format(shop_pk, date.isoformat(), method)
+
+
+def invalidate_stock_valuations():
+    """
+    Invalidate the cached stock valuations of every shop.
+    """
+    bump_version(VALUATION_CACHE_VERSION_KEY)
+
+
+def get_stock_valuation(shop, date, method=VALUATION_AVERAGE):
+    """
+    Return the valuation of the stock of the shop at the end of a day, see
+    compute_stock_valuation.
+
+    Valuations of past days are cached, until a stock entry or an inventory
+    is created. The valuation of the current day is always computed, as
+    sales go on.
+
+    :param shop: shop, mandatory.
+    :param date: day, mandatory.
+    :param method: VALUATION_AVERAGE or VALUATION_FIFO.
+    :type shop: Shop object
+    :type date: date
+    :type method: string
+    """
+    if date >= localdate():
+        return compute_stock_valuation(shop, now(), method)
+
+    key = get_stock_valuation_cache_key(shop.pk, date, method)
+    versions, valuation = get_versioned(key, [VALUATION_CACHE_VERSION_KEY])
+    if valuation is None:
+        valuation = compute_stock_valuation(shop, end_of_day(date), method)
+        set_versioned(key, versions, valuation, VALUATION_CACHE_TIMEOUT)
+    return valuation
@@ -1,9 +1,24 @@
+import datetime
 import decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils.timezone import localtime, now
 
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
-from shops.models import Product, Shop
-from stocks.models import (Inventory, InventoryProduct, StockEntry,
-                           StockEntryProduct)
+from configurations.utils import configuration_get
+from modules.models import SelfSaleModule
+from sales.models import Sale, SaleProduct
+from shops.models import (PRICE_CACHE_VERSION_KEY, Product, Shop,
+                          add_stock_input, add_stock_output,
+                          get_price_cache_key, rebuild_stock_ledger,
+                          set_stock_base)
+from stocks.models import (VALUATION_FIFO, Inventory, InventoryProduct,
+                           StockEntry, StockEntryProduct,
+                           compute_stock_valuation, create_stockentry,
+                           get_stock_valuation, get_stocks_at)
 
 
 class BaseStocksTestCase(BaseBorgiaViewsTestCase):
@@ -82,3 +97,300 @@ class StockEntryTestCase(BaseStocksTestCase):
 
         total = self.stockentry2.total()
         self.assertEqual(total, decimal.Decimal('5.0'))
+
+
+class ProductPriceCacheTestCase(BaseStocksTestCase):
+    def setUp(self):
+        super().setUp()
+        self.margin_profit = configuration_get('MARGIN_PROFIT')
+        self.margin_profit.value = '0'
+        self.margin_profit.save()
+
+    def get_price(self):
+        return Product.objects.get(pk=self.product3.pk).get_price()
+
+    def test_cached_price(self):
+        self.assertEqual(self.get_price(), round(decimal.Decimal(4) / 12, 4))
+        # Prices are served from the cache, without any query
+        with self.assertNumQueries(0):
+            self.product3.get_price()
+            self.product3.get_price()
+
+    def test_cached_price_single_round_trip(self):
+        self.get_price()
+        product = Product.objects.get(pk=self.product3.pk)
+        # The version and the price are read together.
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            product.get_price()
+        get_many.assert_called_once_with(
+            [PRICE_CACHE_VERSION_KEY, get_price_cache_key(product.pk)])
+
+    def test_invalidation_on_stockentry(self):
+        self.get_price()
+        StockEntryProduct.objects.create(
+            stockentry=StockEntry.objects.create(operator=self.user1, shop=self.shop1),
+            product=self.product3,
+            quantity=10,
+            price=decimal.Decimal('5.0')
+        )
+        self.assertEqual(self.get_price(), decimal.Decimal('0.5'))
+
+    def test_invalidation_on_product_change(self):
+        self.get_price()
+        self.product3.correcting_factor = 2
+        self.product3.save()
+        self.assertEqual(self.get_price(), round(decimal.Decimal(8) / 12, 4))
+        self.product3.is_manual = True
+        self.product3.manual_price = decimal.Decimal('3.5')
+        self.product3.save()
+        self.assertEqual(self.get_price(), decimal.Decimal('3.5'))
+
+    def test_invalidation_on_margin_profit(self):
+        self.get_price()
+        self.margin_profit.value = '50'
+        self.margin_profit.save()
+        self.assertEqual(self.get_price(), decimal.Decimal('0.5'))
+
+
+class StockLedgerTestCase(BaseStocksTestCase):
+    def setUp(self):
+        super().setUp()
+        self.selfsalemodule = SelfSaleModule.objects.create(shop=self.shop1)
+        rebuild_stock_ledger(Product.objects.all())
+
+    def get_product(self, product):
+        return Product.objects.get(pk=product.pk)
+
+    def assertLedgerMatchesHistory(self, product):
+        product = self.get_product(product)
+        self.assertEqual(
+            (product.stock_base, product.stock_input, product.stock_output),
+            product.compute_stock_ledger())
+
+    def sell(self, product, quantity):
+        sale = Sale.objects.create(
+            operator=self.user1, sender=self.user1, recipient=self.user1,
+            shop=self.shop1, module=self.selfsalemodule)
+        SaleProduct.objects.create(sale=sale, product=product, quantity=quantity)
+        add_stock_output({product.pk: quantity})
+
+    def test_rebuild(self):
+        product1 = self.get_product(self.product1)
+        self.assertEqual(product1.stock_input, 3)
+        self.assertEqual(product1.current_stock_estimated(), 3)
+        self.assertEqual(rebuild_stock_ledger(Product.objects.all()), [])
+
+    def test_sale_and_stockentry(self):
+        self.sell(self.product3, 5)
+        StockEntryProduct.objects.create(
+            stockentry=self.stockentry1, product=self.product3, quantity=4)
+        add_stock_input({self.product3.pk: 4})
+        self.assertLedgerMatchesHistory(self.product3)
+        self.assertEqual(self.get_product(self.product3).current_stock_estimated(), 11)
+
+    def test_inventory(self):
+        self.sell(self.product1, 2)
+        inventory = Inventory.objects.create(operator=self.user1, shop=self.shop1)
+        InventoryProduct.objects.create(
+            inventory=inventory, product=self.product1, quantity=8)
+        set_stock_base({self.product1.pk: 8})
+        self.assertLedgerMatchesHistory(self.product1)
+        self.sell(self.product1, 3)
+        self.assertLedgerMatchesHistory(self.product1)
+        self.assertEqual(self.get_product(self.product1).current_stock_estimated(), 5)
+
+    def test_save_keeps_ledger(self):
+        product = self.get_product(self.product1)
+        add_stock_input({self.product1.pk: 10})
+        product.name = 'Product1 new name'
+        product.save()
+        self.assertEqual(self.get_product(self.product1).stock_input, 13)
+
+    def test_command(self):
+        Product.objects.filter(pk=self.product1.pk).update(stock_input=0)
+        out = StringIO()
+        call_command('rebuild_stock_ledger', stdout=out)
+        self.assertIn('1 fixed', out.getvalue())
+        self.assertLedgerMatchesHistory(self.product1)
+
+
+class CorrectingFactorsTestCase(BaseStocksTestCase):
+    def setUp(self):
+        super().setUp()
+        self.selfsalemodule = SelfSaleModule.objects.create(shop=self.shop1)
+        self.sale = Sale.objects.create(
+            operator=self.user1, sender=self.user1, recipient=self.user1,
+            shop=self.shop1, module=self.selfsalemodule)
+        self.product5 = Product.objects.create(name='product5 name', shop=self.shop1)
+
+        # Previous inventory, only for some products
+        previous_inventory = Inventory.objects.create(
+            operator=self.user1, shop=self.shop1,
+            datetime=self.stockentry1.datetime)
+        for product, quantity in ((self.product1, 10), (self.product2, 4)):
+            InventoryProduct.objects.create(
+                inventory=previous_inventory, product=product, quantity=quantity)
+
+        for product, quantity in ((self.product1, 7), (self.product2, 3),
+                                  (self.product3, 9), (self.product4, 5)):
+            SaleProduct.objects.create(
+                sale=self.sale, product=product, quantity=quantity)
+
+        self.inventory = Inventory.objects.create(operator=self.user1, shop=self.shop1)
+        for product, quantity in ((self.product1, 4), (self.product2, 6),
+                                  (self.product3, 1), (self.product4, 15),
+                                  (self.product5, 0)):
+            InventoryProduct.objects.create(
+                inventory=self.inventory, product=product, quantity=quantity)
+
+    def get_correcting_factors(self):
+        return dict(Product.objects.values_list('pk', 'correcting_factor'))
+
+    def test_parity_with_product_path(self):
+        initial_factors = self.get_correcting_factors()
+        for inventoryproduct in self.inventory.inventoryproduct_set.all():
+            inventoryproduct.product.update_correcting_factor(
+                inventoryproduct.quantity)
+        expected_factors = self.get_correcting_factors()
+        self.assertNotEqual(expected_factors, initial_factors)
+
+        for pk, correcting_factor in initial_factors.items():
+            Product.objects.filter(pk=pk).update(correcting_factor=correcting_factor)
+        with self.assertNumQueries(3):
+            self.inventory.update_correcting_factors()
+        self.assertEqual(self.get_correcting_factors(), expected_factors)
+
+    def test_invalidates_prices(self):
+        price = Product.objects.get(pk=self.product3.pk).get_price()
+        self.inventory.update_correcting_factors()
+        self.assertNotEqual(Product.objects.get(pk=self.product3.pk).get_price(), price)
+
+
+class StocksAtTestCase(BaseStocksTestCase):
+    def setUp(self):
+        super().setUp()
+        self.selfsalemodule = SelfSaleModule.objects.create(shop=self.shop1)
+        self.day = datetime.timedelta(days=1)
+        self.start = now() - 10 * self.day
+        StockEntry.objects.filter(pk=self.stockentry1.pk).update(datetime=self.start)
+
+        self.sell(self.start + self.day, self.product1, 1)
+        inventory = Inventory.objects.create(
+            operator=self.user1, shop=self.shop1, datetime=self.start + 2 * self.day)
+        InventoryProduct.objects.create(inventory=inventory, product=self.product1, quantity=5)
+        StockEntryProduct.objects.create(
+            stockentry=StockEntry.objects.create(
+                operator=self.user1, shop=self.shop1, datetime=self.start + 3 * self.day),
+            product=self.product1, quantity=10)
+        self.sell(self.start + 4 * self.day, self.product1, 2)
+        self.sell(self.start + 4 * self.day, self.product3, 4)
+
+    def sell(self, moment, product, quantity):
+        sale = Sale.objects.create(
+            operator=self.user1, sender=self.user1, recipient=self.user1,
+            shop=self.shop1, module=self.selfsalemodule, datetime=moment)
+        SaleProduct.objects.create(sale=sale, product=product, quantity=quantity)
+
+    def get_stocks(self, moment):
+        return {product.pk: product.stock_at
+                for product in get_stocks_at(self.shop1.product_set.all(), moment)}
+
+    def test_stocks_at(self):
+        self.assertEqual(self.get_stocks(self.start - self.day),
+                         {self.product1.pk: 0, self.product2.pk: 0, self.product3.pk: 0})
+        self.assertEqual(self.get_stocks(self.start + self.day),
+                         {self.product1.pk: 2, self.product2.pk: 7, self.product3.pk: 12})
+        # Inventory checkpoint
+        self.assertEqual(self.get_stocks(self.start + 2 * self.day)[self.product1.pk], 5)
+        self.assertEqual(self.get_stocks(self.start + 3 * self.day)[self.product1.pk], 15)
+        self.assertEqual(self.get_stocks(now()),
+                         {self.product1.pk: 13, self.product2.pk: 7, self.product3.pk: 8})
+
+    def test_correcting_factor(self):
+        Product.objects.filter(pk=self.product1.pk).update(correcting_factor=2)
+        self.assertEqual(self.get_stocks(now())[self.product1.pk], 11)
+
+    def test_constant_queries(self):
+        for i in range(20):
+            Product.objects.create(name='product' + str(i), shop=self.shop1)
+        with self.assertNumQueries(1):
+            self.get_stocks(now())
+
+    def test_command(self):
+        out = StringIO()
+        call_command('stock_at_date', self.shop1.name,
+                     localtime(self.start + 3 * self.day + datetime.timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M:%S'),
+                     stdout=out)
+        self.assertIn('Product1 name\t15cl', out.getvalue())
+
+
+class StockValuationTestCase(BaseStocksTestCase):
+    def setUp(self):
+        super().setUp()
+        self.selfsalemodule = SelfSaleModule.objects.create(shop=self.shop1)
+        self.day = datetime.timedelta(days=1)
+        self.start = now() - 10 * self.day
+        StockEntry.objects.filter(pk=self.stockentry1.pk).update(datetime=self.start)
+        StockEntryProduct.objects.create(
+            stockentry=StockEntry.objects.create(
+                operator=self.user1, shop=self.shop1, datetime=self.start + self.day),
+            product=self.product1, quantity=10, price=decimal.Decimal('4.0'))
+        sale = Sale.objects.create(
+            operator=self.user1, sender=self.user1, recipient=self.user1,
+            shop=self.shop1, module=self.selfsalemodule, datetime=self.start + 2 * self.day)
+        SaleProduct.objects.create(sale=sale, product=self.product1, quantity=5)
+
+    def get_values(self, moment, method='average'):
+        return {line['pk']: (line['unit_cost'], line['value'])
+                for line in compute_stock_valuation(self.shop1, moment, method)}
+
+    def test_weighted_average(self):
+        self.assertEqual(self.get_values(now()), {
+            self.product1.pk: (decimal.Decimal('38.46'), decimal.Decimal('3.08')),
+            self.product2.pk: (decimal.Decimal('285.71'), decimal.Decimal('2.00')),
+            self.product3.pk: (decimal.Decimal('0.33'), decimal.Decimal('4.00'))
+        })
+
+    def test_fifo(self):
+        values = self.get_values(now(), VALUATION_FIFO)
+        # The 8cl left come from the last stock entry.
+        self.assertEqual(values[self.product1.pk],
+                         (decimal.Decimal('40.00'), decimal.Decimal('3.20')))
+        self.assertEqual(values[self.product3.pk],
+                         (decimal.Decimal('0.33'), decimal.Decimal('4.00')))
+
+    def test_before_stockentries(self):
+        for unit_cost, value in self.get_values(self.start - self.day).values():
+            self.assertIsNone(unit_cost)
+            self.assertEqual(value, 0)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            compute_stock_valuation(self.shop1, now(), 'lifo')
+
+    def test_constant_queries(self):
+        for i in range(20):
+            product = Product.objects.create(name='product' + str(i), shop=self.shop1)
+            StockEntryProduct.objects.create(
+                stockentry=self.stockentry1, product=product, quantity=1, price=1)
+        with self.assertNumQueries(2):
+            compute_stock_valuation(self.shop1, now())
+
+    def test_cache(self):
+        date = (self.start + 5 * self.day).date()
+        get_stock_valuation(self.shop1, date)
+        with self.assertNumQueries(0):
+            get_stock_valuation(self.shop1, date)
+
+        create_stockentry(self.shop1, self.user1, [StockEntryProduct(
+            product=self.product3, quantity=1, price=decimal.Decimal('1.0'))])
+        with self.assertNumQueries(2):
+            get_stock_valuation(self.shop1, date)
+
+    def test_cache_product_saved(self):
+        date = (self.start + 5 * self.day).date()
+        get_stock_valuation(self.shop1, date)
+        self.product1.correcting_factor = decimal.Decimal('0.5')
+        self.product1.save()
+        with self.assertNumQueries(2):
+            get_stock_valuation(self.shop1, date)
@@ -9,10 +9,13 @@ class StocksNamedURLTests(TestCase):
         expected_named_urls = [
             ('url_stockentry_list', [], {'shop_pk': 53}),
             ('url_stockentry_create', [], {'shop_pk': 53}),
+            ('url_stockentry_import', [], {'shop_pk': 53}),
             ('url_stockentry_retrieve', [], {'shop_pk': 53, 'stockentry_pk': 53}),
             ('url_inventory_list', [], {'shop_pk': 53}),
             ('url_inventory_create', [], {'shop_pk': 53}),
-            ('url_inventory_retrieve', [], {'shop_pk': 53, 'inventory_pk': 53})
+            ('url_inventory_retrieve', [], {'shop_pk': 53, 'inventory_pk': 53}),
+            ('url_stock_at_date', [], {'shop_pk': 53}),
+            ('url_stock_valuation', [], {'shop_pk': 53})
         ]
         for name, args, kwargs in expected_named_urls:
             with self.subTest(name=name):
@@ -1,7 +1,18 @@
+import decimal
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+import openpyxl
+from openpyxl import Workbook
+from openpyxl.writer.excel import save_virtual_workbook
+
 from borgia.tests.utils import get_login_url_redirected
+from shops.models import Product
 from shops.tests.tests_views import BaseShopsViewsTest
 from stocks.models import (Inventory, InventoryProduct, StockEntry,
                            StockEntryProduct)
@@ -88,6 +99,145 @@ class StockEntryCreateViewTest(BaseGeneralStocksViewsTest):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def get_post_data(self, is_adding_inventory, lines):
+        data = {
+            'form-TOTAL_FORMS': len(lines),
+            'form-INITIAL_FORMS': 0,
+            'form-MAX_NUM_FORMS': 1000,
+            'isAddingInventory': is_adding_inventory
+        }
+        for index, (product, quantity, unit_quantity, amount, unit_amount,
+                    inventory_quantity) in enumerate(lines):
+            data['form-%d-product' % index] = (
+                str(product.pk) + '/' + product.get_unit_display())
+            data['form-%d-quantity' % index] = quantity
+            data['form-%d-unit_quantity' % index] = unit_quantity
+            data['form-%d-amount' % index] = amount
+            data['form-%d-unit_amount' % index] = unit_amount
+            if inventory_quantity is not None:
+                data['form-%d-inventory_quantity' % index] = inventory_quantity
+                data['form-%d-unit_inventory' % index] = unit_quantity
+        return data
+
+    def test_post(self):
+        response = self.client3.post(self.get_url(self.shop1.pk), self.get_post_data(
+            'without', [(self.product1, 24, 'UNIT', '0.5', 'UNIT', None),
+                        (self.product2, 2, 'L', '6', 'PACKAGE', None)]))
+        self.assertRedirects(response, reverse(
+            'url_stockentry_list', kwargs={'shop_pk': self.shop1.pk}))
+        stockentry = StockEntry.objects.exclude(pk=self.stockentry1.pk).get()
+        self.assertEqual(
+            list(stockentry.stockentryproduct_set.order_by('pk').values_list(
+                'product', 'quantity', 'price')),
+            [(self.product1.pk, 24, 12), (self.product2.pk, 200, 6)])
+        self.assertEqual(Product.objects.get(pk=self.product1.pk).stock_input, 24)
+        self.assertFalse(Inventory.objects.exclude(pk=self.inventory1.pk).exists())
+
+    def test_post_with_inventory(self):
+        self.client3.post(self.get_url(self.shop1.pk), self.get_post_data(
+            'with', [(self.product1, 24, 'UNIT', '0.5', 'UNIT', 6)]))
+        inventory = Inventory.objects.exclude(pk=self.inventory1.pk).get()
+        self.assertEqual(
+            list(inventory.inventoryproduct_set.values_list('product', 'quantity')),
+            [(self.product1.pk, 30)])
+        product1 = Product.objects.get(pk=self.product1.pk)
+        self.assertEqual((product1.stock_base, product1.stock_input), (30, 0))
+
+    def test_invalid_post(self):
+        data = self.get_post_data('without', [(self.product1, 24, 'UNIT', '', 'UNIT', None)])
+        response = self.client3.post(self.get_url(self.shop1.pk), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(StockEntry.objects.exclude(pk=self.stockentry1.pk).exists())
+        # The submission is rendered again, with its errors.
+        stockentry_form = response.context['stockentry_form']
+        self.assertTrue(stockentry_form.is_bound)
+        self.assertTrue(stockentry_form.errors[0])
+        self.assertContains(response, 'value="24"')
+
+    def test_price_invalidation(self):
+        self.assertEqual(Product.objects.get(pk=self.product1.pk).get_price(), decimal.Decimal('1.05'))
+        self.client3.post(self.get_url(self.shop1.pk), self.get_post_data(
+            'without', [(self.product1, 24, 'UNIT', '0.5', 'UNIT', None)]))
+        self.assertEqual(Product.objects.get(pk=self.product1.pk).get_price(), decimal.Decimal('0.525'))
+
+    def test_constant_queries_post(self):
+        def count_queries(nb_lines):
+            data = self.get_post_data(
+                'with', [(self.product1, 24, 'UNIT', '0.5', 'UNIT', 6)] * nb_lines)
+            with CaptureQueriesContext(connection) as context:
+                self.client3.post(self.get_url(self.shop1.pk), data)
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(1), count_queries(20))
+
+
+class StockEntryImportViewTest(BaseGeneralStocksViewsTest):
+    url_view = 'url_stockentry_import'
+
+    def test_president_get(self):
+        super().president_get()
+
+    def test_chief_get(self):
+        super().chief_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def get_new_stockentry(self):
+        return StockEntry.objects.exclude(pk=self.stockentry1.pk).get()
+
+    def test_post_csv(self):
+        invoice = SimpleUploadedFile('invoice.csv', (
+            'product;quantity;unit_quantity;amount;unit_amount\n'
+            'Skoll;24;;12,50;\n'
+            'BEER;3;L;2;L\n'
+            'unknown;1;;1;\n'
+            '\n'
+            'meat;1.5;KG;10;KG\n').encode())
+        response = self.client3.post(
+            self.get_url(self.shop1.pk), {'invoice': invoice}, follow=True)
+        self.assertRedirects(response, reverse(
+            'url_stockentry_list', kwargs={'shop_pk': self.shop1.pk}))
+        self.assertContains(response, 'Ligne 4')
+        self.assertEqual(
+            list(self.get_new_stockentry().stockentryproduct_set.order_by('pk').values_list(
+                'product', 'quantity', 'price')),
+            [(self.product1.pk, 24, decimal.Decimal('12.50')),
+             (self.product2.pk, 300, 6),
+             (self.product3.pk, 1500, 15)])
+        self.assertEqual(Product.objects.get(pk=self.product2.pk).stock_input, 300)
+
+    def test_post_xlsx(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['product', 'quantity', 'amount'])
+        sheet.append(['skoll', 10, 5])
+        sheet.append(['beer', 'ten', 5])
+        invoice = SimpleUploadedFile('invoice.xlsx', save_virtual_workbook(workbook))
+        self.client3.post(self.get_url(self.shop1.pk), {'invoice': invoice})
+        self.assertEqual(
+            list(self.get_new_stockentry().stockentryproduct_set.values_list(
+                'product', 'quantity', 'price')),
+            [(self.product1.pk, 10, 5)])
+
+    def test_post_xlsx_closes_workbook(self):
+        workbook = Workbook()
+        workbook.active.append(['product', 'quantity', 'amount'])
+        workbook.active.append(['skoll', 10, 5])
+        invoice = SimpleUploadedFile('invoice.xlsx', save_virtual_workbook(workbook))
+        with mock.patch.object(openpyxl.Workbook, 'close', autospec=True) as close:
+            self.client3.post(self.get_url(self.shop1.pk), {'invoice': invoice})
+        close.assert_called_once()
+
+    def test_post_unreadable(self):
+        invoice = SimpleUploadedFile('invoice.xlsx', b'not an excel file')
+        response = self.client3.post(self.get_url(self.shop1.pk), {'invoice': invoice})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(StockEntry.objects.exclude(pk=self.stockentry1.pk).exists())
+
 
 class StockEntryRetrieveViewTest(BaseStocksViewsTest):
     """
@@ -155,6 +305,104 @@ class InventoryCreateViewTest(BaseGeneralStocksViewsTest):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def get_post_data(self, inventory_type, lines):
+        data = {
+            'form-TOTAL_FORMS': len(lines),
+            'form-INITIAL_FORMS': 0,
+            'form-MAX_NUM_FORMS': 1000,
+            'type': inventory_type
+        }
+        for index, (product, quantity, unit_quantity) in enumerate(lines):
+            data['form-%d-product' % index] = (
+                str(product.pk) + '/' + product.get_unit_display())
+            data['form-%d-quantity' % index] = quantity
+            data['form-%d-unit_quantity' % index] = unit_quantity
+        return data
+
+    def test_post_partial(self):
+        response = self.client3.post(self.get_url(self.shop1.pk), self.get_post_data(
+            'partial', [(self.product1, 12, 'UNIT'), (self.product2, 2, 'L')]))
+        self.assertRedirects(response, reverse(
+            'url_inventory_list', kwargs={'shop_pk': self.shop1.pk}))
+        inventory = Inventory.objects.exclude(pk=self.inventory1.pk).get()
+        self.assertEqual(
+            dict(inventory.inventoryproduct_set.values_list('product', 'quantity')),
+            {self.product1.pk: 12, self.product2.pk: 200})
+        self.assertEqual(Product.objects.get(pk=self.product2.pk).stock_base, 200)
+
+    def test_post_full(self):
+        self.client3.post(self.get_url(self.shop1.pk), self.get_post_data(
+            'full', [(self.product1, 12, 'UNIT')]))
+        inventory = Inventory.objects.exclude(pk=self.inventory1.pk).get()
+        self.assertEqual(
+            dict(inventory.inventoryproduct_set.values_list('product', 'quantity')),
+            {self.product1.pk: 12, self.product2.pk: 0, self.product3.pk: 0})
+
+    def test_constant_queries_post(self):
+        def count_queries(nb_products):
+            for i in range(nb_products):
+                Product.objects.create(name='product' + str(i), shop=self.shop1)
+            data = self.get_post_data('full', [(self.product1, 12, 'UNIT')])
+            with CaptureQueriesContext(connection) as context:
+                self.client3.post(self.get_url(self.shop1.pk), data)
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(1), count_queries(20))
+
+
+class StockAtDateViewTest(BaseGeneralStocksViewsTest):
+    url_view = 'url_stock_at_date'
+
+    def test_president_get(self):
+        super().president_get()
+
+    def test_chief_get(self):
+        super().chief_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def test_post(self):
+        response = self.client3.post(self.get_url(self.shop1.pk), {'date': '01/01/2000'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [product.stock_at for product in response.context['product_list']], [0, 0, 0])
+
+
+class StockValuationViewTest(BaseGeneralStocksViewsTest):
+    url_view = 'url_stock_valuation'
+
+    def test_president_get(self):
+        super().president_get()
+
+    def test_chief_get(self):
+        super().chief_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def test_post(self):
+        response = self.client3.post(self.get_url(self.shop1.pk),
+                                     {'date': '01/01/2000', 'method': 'fifo'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['method'], 'fifo')
+        self.assertEqual(response.context['total'], 0)
+
+    def test_csv(self):
+        response = self.client3.get(self.get_url(self.shop1.pk),
+                                    {'csv': '', 'date': '01/01/2000', 'method': 'fifo'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertEqual(lines[0], 'Produit;Quantité;Unité;Coût unitaire;Valeur')
+        self.assertEqual(lines[-1], 'Total;;;;0.00')
+
 
 class InventoryRetrieveViewTest(BaseStocksViewsTest):
     """
@@ -1,8 +1,10 @@
 from django.urls import include, path
 
 from stocks.views import (InventoryListView, InventoryRetrieveView,
-                          InventoryCreateView, StockEntryCreateView,
-                          StockEntryListView, StockEntryRetrieveView)
+                          InventoryCreateView, StockAtDateView,
+                          StockEntryCreateView, StockEntryImportView,
+                          StockEntryListView, StockEntryRetrieveView,
+                          StockValuationView)
 
 
 stocks_patterns = [
@@ -10,12 +12,15 @@ stocks_patterns = [
         path('entries/', include([
             path('', StockEntryListView.as_view(), name='url_stockentry_list'),
             path('create/', StockEntryCreateView.as_view(), name='url_stockentry_create'),
+            path('import/', StockEntryImportView.as_view(), name='url_stockentry_import'),
             path('<int:stockentry_pk>/', StockEntryRetrieveView.as_view(), name='url_stockentry_retrieve'),
         ])),
         path('inventories/', include([
             path('', InventoryListView.as_view(), name='url_inventory_list'),
             path('create/', InventoryCreateView.as_view(), name='url_inventory_create'),
             path('<int:inventory_pk>/', InventoryRetrieveView.as_view(), name='url_inventory_retrieve'),
-        ]))
+        ])),
+        path('at-date/', StockAtDateView.as_view(), name='url_stock_at_date'),
+        path('valuation/', StockValuationView.as_view(), name='url_stock_valuation')
     ]))
 ]
@@ -0,0 +1,10 @@
+import datetime
+
+from django.utils.timezone import make_aware
+
+
+def end_of_day(date):
+    """
+    Return the last moment of the day, in the current timezone.
+    """
+    return make_aware(datetime.datetime.combine(date, datetime.time.max))
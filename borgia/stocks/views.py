@@ -1,10 +1,19 @@
+import csv
 import decimal
+import io
+import itertools
+import zipfile
 
+import openpyxl
+from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.forms.formsets import formset_factory
-from django.http import Http404
+from django.http import Http404, HttpResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.utils.timezone import localdate, now
+from openpyxl.utils.exceptions import InvalidFileException
 
 from borgia.views import BorgiaFormView, BorgiaView
 from shops.mixins import ShopMixin
@@ -12,10 +21,14 @@ from shops.models import Product
 from stocks.forms import (AdditionnalDataInventoryForm,
                           AdditionnalDataStockEntryForm,
                           BaseInventoryProductFormSet, InventoryListDateForm,
-                          InventoryProductForm, StockEntryListDateForm,
-                          StockEntryProductForm)
-from stocks.models import (Inventory, InventoryProduct, StockEntry,
-                           StockEntryProduct)
+                          InventoryProductForm, StockAtDateForm,
+                          StockEntryImportForm, StockEntryListDateForm,
+                          StockEntryProductForm, StockValuationForm)
+from stocks.models import (VALUATION_AVERAGE, VALUATION_METHODS, Inventory,
+                           StockEntry, StockEntryProduct, create_inventory,
+                           create_stockentry, get_stock_valuation,
+                           get_stocks_at)
+from stocks.utils import end_of_day
 
 
 class StockEntryListView(ShopMixin, BorgiaFormView):
@@ -67,68 +80,129 @@ class StockEntryCreateView(ShopMixin, BorgiaView):
     lm_active = 'lm_stockentry_create'
 
     def get(self, request, *args, **kwargs):
-        context = self.get_context_data(**kwargs)
         stockentry_product_form = formset_factory(StockEntryProductForm,
                                                   extra=1)
-        context['stockentry_form'] = stockentry_product_form(
-            form_kwargs={'shop': self.shop})
-        context['add_inventory_form'] = AdditionnalDataStockEntryForm()
+        return self.render_forms(
+            request,
+            stockentry_product_form(
+                form_kwargs={'shop': self.shop,
+                             'products': get_stock_products(self.shop).values()}),
+            AdditionnalDataStockEntryForm())
+
+    def render_forms(self, request, stockentry_form, add_inventory_form):
+        """
+        Render the page with the forms, bound with their errors after an
+        invalid submission.
+        """
+        context = self.get_context_data(**self.kwargs)
+        context['stockentry_form'] = stockentry_form
+        context['add_inventory_form'] = add_inventory_form
         return render(request, self.template_name, context=context)
 
     def post(self, request, *args, **kwargs):
-        stockentry = StockEntry.objects.create(
-            operator=request.user, shop=self.shop)
-
+        """
+        Nothing is saved unless the forms are valid. Products are loaded
+        once, for the forms and the lines. The stock entry and the optional
+        inventory are saved in one transaction.
+        """
+        products = get_stock_products(self.shop)
         # TODO: Verify formset with django 2.x
         stockentry_product_form = formset_factory(StockEntryProductForm,
                                                   extra=1)
         stockentry_form = stockentry_product_form(
-            request.POST, form_kwargs={'shop': self.shop, 'empty_permitted': False})
+            request.POST, form_kwargs={'shop': self.shop,
+                                       'products': products.values(),
+                                       'empty_permitted': False})
         add_inventory_form = AdditionnalDataStockEntryForm(request.POST)
 
         if stockentry_form.is_valid() and add_inventory_form.is_valid():
-            is_adding_inventory = False
-            if add_inventory_form.cleaned_data['isAddingInventory'] == 'with':
-                inventory = Inventory.objects.create(
-                    operator=request.user, shop=self.shop)
-                is_adding_inventory = True
+            is_adding_inventory = add_inventory_form.cleaned_data['isAddingInventory'] == 'with'
 
+            stockentryproducts = []
+            inventory_quantities = {}
             for form in stockentry_form.cleaned_data:
+                product = products.get(int(form['product'].split('/')[0]))
+                if product is None:
+                    continue
                 try:
-                    product = get_product_from_form(form['product'])
                     quantity = get_normalized_quantity(
                         product, form['unit_quantity'], form['quantity'])
                     price = get_normalized_price(
                         form['unit_quantity'], form['quantity'], form['unit_amount'], form['amount'])
-
-                    StockEntryProduct.objects.create(
-                        stockentry=stockentry,
-                        product=product,
-                        quantity=quantity,
-                        price=price
-                    )
-
-                    # AJOUT DE L'INVENTAIRE SI BESOIN
-                    if is_adding_inventory:
-                        if form['unit_inventory'] and form['inventory_quantity']:
-                            inventory_quantity = get_normalized_quantity(
-                                product, form['unit_inventory'], form['inventory_quantity'])
-
-                            InventoryProduct.objects.create(
-                                inventory=inventory,
-                                product=product,
-                                quantity=inventory_quantity+quantity
-                            )
-
-                except ObjectDoesNotExist:
-                    pass
                 except (ZeroDivisionError, decimal.DivisionUndefined, decimal.DivisionByZero):
-                    pass
+                    continue
+
+                stockentryproducts.append(StockEntryProduct(
+                    product=product,
+                    quantity=quantity,
+                    price=price
+                ))
+
+                # AJOUT DE L'INVENTAIRE SI BESOIN
+                if is_adding_inventory:
+                    if form['unit_inventory'] and form['inventory_quantity']:
+                        inventory_quantity = get_normalized_quantity(
+                            product, form['unit_inventory'], form['inventory_quantity'])
+                        inventory_quantities[product.pk] = inventory_quantity+quantity
+
+            with transaction.atomic():
+                create_stockentry(self.shop, request.user, stockentryproducts)
+                if is_adding_inventory:
+                    create_inventory(self.shop, request.user, inventory_quantities)
+
+            return redirect(
+                reverse('url_stockentry_list',
+                        kwargs={'shop_pk': self.shop.pk})
+            )
+        else:
+            return self.render_forms(request, stockentry_form, add_inventory_form)
+
+
+class StockEntryImportView(ShopMixin, BorgiaFormView):
+    """
+    Create a stock entry from a supplier invoice, CSV or Excel file.
+
+    Rows are matched to the products of the shop by name. Rows which can't
+    be imported are reported, the others are saved in one stock entry.
+    """
+    permission_required = 'stocks.add_stockentry'
+    menu_type = 'shops'
+    template_name = 'stocks/stockentry_import.html'
+    form_class = StockEntryImportForm
+    lm_active = 'lm_stockentry_list'
 
-        return redirect(
-            reverse('url_stockentry_list',
-                    kwargs={'shop_pk': self.shop.pk})
-        )
+    def form_valid(self, form):
+        products = {product.name.strip().lower(): product
+                    for product in get_stock_products(self.shop).values()}
+
+        stockentryproducts = []
+        errors = []
+        try:
+            for line, row in read_stockentry_rows(form.cleaned_data['invoice']):
+                try:
+                    stockentryproducts.append(
+                        get_stockentryproduct_from_row(row, products))
+                except ValueError as error:
+                    errors.append('Ligne ' + str(line) + ' : ' + str(error))
+        except (ValueError, csv.Error, UnicodeDecodeError, zipfile.BadZipFile,
+                InvalidFileException):
+            form.add_error('invoice', 'Le fichier ne peut pas être lu.')
+            return self.form_invalid(form)
+
+        if stockentryproducts:
+            create_stockentry(self.shop, self.request.user, stockentryproducts)
+            messages.success(self.request, str(len(stockentryproducts)) +
+                             ' lignes ont été importées')
+        else:
+            messages.warning(self.request, 'Aucune ligne n\'a été importée')
+        for error in errors:
+            messages.warning(self.request, error)
+
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse('url_stockentry_list',
+                       kwargs={'shop_pk': self.shop.pk})
 
 
 class StockEntryRetrieveView(ShopMixin, BorgiaView):
@@ -206,6 +280,96 @@ class InventoryListView(ShopMixin, BorgiaFormView):
         return query
 
 
+class StockAtDateView(ShopMixin, BorgiaFormView):
+    """
+    Estimated stock of every product of the shop at the end of a given day.
+    """
+    permission_required = 'stocks.view_inventory'
+    menu_type = 'shops'
+    template_name = 'stocks/stock_at_date.html'
+    form_class = StockAtDateForm
+    lm_active = 'lm_inventory_list'
+
+    date = None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.date is None:
+            moment = now()
+        else:
+            moment = end_of_day(self.date)
+        products = get_stocks_at(
+            self.shop.product_set.filter(is_removed=False).order_by('name'), moment)
+        for product in products:
+            product.stock_at_display = product.get_quantity_display(product.stock_at)
+        context['moment'] = moment
+        context['product_list'] = products
+        return context
+
+    def form_valid(self, form):
+        self.date = form.cleaned_data['date']
+        return self.get(self.request, self.args, self.kwargs)
+
+
+class StockValuationView(ShopMixin, BorgiaFormView):
+    """
+    Value of the stock of every product of the shop at the end of a given
+    day, displayed or downloaded as CSV (GET parameter csv).
+    """
+    permission_required = 'stocks.view_stockentry'
+    menu_type = 'shops'
+    template_name = 'stocks/stock_valuation.html'
+    form_class = StockValuationForm
+    lm_active = 'lm_stockentry_list'
+
+    date = None
+    method = VALUATION_AVERAGE
+
+    def get(self, request, *args, **kwargs):
+        if 'csv' not in request.GET:
+            return super().get(request, *args, **kwargs)
+
+        form = self.form_class(request.GET)
+        if form.is_valid():
+            self.date = form.cleaned_data['date']
+            self.method = form.cleaned_data['method']
+        return self.get_csv_response()
+
+    def get_valuation(self):
+        if self.date is None:
+            self.date = localdate()
+        return get_stock_valuation(self.shop, self.date, self.method)
+
+    def get_csv_response(self):
+        valuation = self.get_valuation()
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="valorisation_{0}_{1}.csv"'.format(
+            self.shop.name, self.date.isoformat())
+        writer = csv.writer(response, delimiter=';')
+        writer.writerow(['Produit', 'Quantité', 'Unité', 'Coût unitaire', 'Valeur'])
+        for line in valuation:
+            writer.writerow([line['name'], line['quantity_display'], line['unit'],
+                             line['unit_cost'] if line['unit_cost'] is not None else '',
+                             line['value']])
+        writer.writerow(['Total', '', '', '', sum(line['value'] for line in valuation)])
+        return response
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        valuation = self.get_valuation()
+        context['date'] = self.date
+        context['method'] = self.method
+        context['method_display'] = dict(VALUATION_METHODS)[self.method]
+        context['valuation'] = valuation
+        context['total'] = sum(line['value'] for line in valuation)
+        return context
+
+    def form_valid(self, form):
+        self.date = form.cleaned_data['date']
+        self.method = form.cleaned_data['method']
+        return self.get(self.request, self.args, self.kwargs)
+
+
 class InventoryCreateView(ShopMixin, BorgiaView):
     """
     """
@@ -220,7 +384,8 @@ class InventoryCreateView(ShopMixin, BorgiaView):
                                                     extra=1)
         context = self.get_context_data(**kwargs)
         context['inventory_formset'] = inventory_product_formset(
-            form_kwargs={'shop': self.shop})
+            form_kwargs={'shop': self.shop,
+                         'products': get_stock_products(self.shop).values()})
         context['additionnal_data_form'] = AdditionnalDataInventoryForm()
         return render(request, self.template_name, context=context)
 
@@ -228,53 +393,38 @@ class InventoryCreateView(ShopMixin, BorgiaView):
         """
         Products in the shop (and active) but not listed in the form are
         included in the inventory with a quantity 0.
+
+        Products are loaded once, for the forms and the lines. The inventory,
+        its lines and the correcting factors are saved in one transaction.
         """
+        products = get_stock_products(self.shop)
         # TODO: Verify formset with django 2.x
         inventory_product_formset = formset_factory(InventoryProductForm,
                                                     formset=BaseInventoryProductFormSet,
                                                     extra=1)
         inventory_formset = inventory_product_formset(
-            request.POST, form_kwargs={'shop': self.shop, 'empty_permitted': False})
+            request.POST, form_kwargs={'shop': self.shop,
+                                       'products': products.values(),
+                                       'empty_permitted': False})
         additionnal_data_form = AdditionnalDataInventoryForm(request.POST)
 
         if inventory_formset.is_valid() and additionnal_data_form.is_valid():
-            inventory = Inventory.objects.create(
-                operator=request.user, shop=self.shop)
-
             # Ids in the form
-            if inventory_formset.is_valid():
-                for form in inventory_formset.cleaned_data:
-                    try:
-                        product = get_product_from_form(form['product'])
-                        quantity = get_normalized_quantity(
-                            product, form['unit_quantity'], form['quantity'])
-
-                        InventoryProduct.objects.create(
-                            inventory=inventory,
-                            product=product,
-                            quantity=quantity
-                        )
-
-                    except ObjectDoesNotExist:
-                        pass
-
-                if additionnal_data_form.is_valid():
-                    if additionnal_data_form.cleaned_data['type'] == 'full':
-                        # Ids not in the form but active in the shop
-                        try:
-                            for product in Product.objects.filter(shop=self.shop, is_removed=False, is_active=True).exclude(
-                                    pk__in=[form['product'].split('/')[0] for form in inventory_formset.cleaned_data]):
-                                InventoryProduct.objects.create(
-                                    inventory=inventory,
-                                    product=product,
-                                    quantity=decimal.Decimal(0)
-                                )
-
-                        except ObjectDoesNotExist:
-                            pass
-                        except (ZeroDivisionError, decimal.DivisionUndefined, decimal.DivisionByZero):
-                            pass
+            quantities = {}
+            for form in inventory_formset.cleaned_data:
+                product = products.get(int(form['product'].split('/')[0]))
+                if product is not None:
+                    quantities[product.pk] = get_normalized_quantity(
+                        product, form['unit_quantity'], form['quantity'])
 
+            if additionnal_data_form.cleaned_data['type'] == 'full':
+                # Ids not in the form but active in the shop
+                for product in products.values():
+                    if product.is_active and product.pk not in quantities:
+                        quantities[product.pk] = 0
+
+            with transaction.atomic():
+                inventory = create_inventory(self.shop, request.user, quantities)
                 # Update all correcting factors listed
                 inventory.update_correcting_factors()
 
@@ -321,8 +471,103 @@ class InventoryRetrieveView(ShopMixin, BorgiaView):
         return render(request, self.template_name, context=context)
 
 
-def get_product_from_form(form_product):
-    return Product.objects.get(pk=form_product.split('/')[0])
+def get_stock_products(shop):
+    """
+    Return the products of the shop which can be listed in stock entries and
+    inventories, indexed by pk.
+    """
+    return {product.pk: product for product in Product.objects.filter(
+        shop=shop, is_removed=False)}
+
+
+STOCKENTRY_IMPORT_UNITS_QUANTITY = {None: ['UNIT'], 'CL': ['CL', 'L'], 'G': ['G', 'KG']}
+STOCKENTRY_IMPORT_UNITS_AMOUNT = ['UNIT', 'PACKAGE', 'L', 'KG']
+
+
+def read_stockentry_rows(invoice):
+    """
+    Read a supplier invoice, CSV or Excel (xlsx) file, row by row.
+
+    The first row holds the column names. Excel files are read in read_only
+    mode, CSV files are decoded as a stream, with ',', ';' or tabulations as
+    delimiter.
+
+    :param invoice: uploaded file, mandatory.
+    :returns: generator of (line number, {column name: value}), empty rows
+    are skipped.
+    :raises: ValueError if the file has no header.
+    """
+    workbook = None
+    try:
+        if invoice.name.lower().endswith('.xlsx'):
+            # A read_only workbook keeps the file open until it is closed.
+            workbook = openpyxl.load_workbook(invoice, read_only=True)
+            rows = ([cell.value for cell in row] for row in workbook.active.rows)
+        else:
+            stream = io.TextIOWrapper(invoice.file, encoding='utf-8-sig')
+            header = stream.readline()
+            dialect = csv.Sniffer().sniff(header, delimiters=',;\t')
+            rows = csv.reader(itertools.chain([header], stream), dialect)
+
+        header = next(rows, None)
+        if not header:
+            raise ValueError('Missing header')
+        columns = [str(value).strip().lower() if value is not None else ''
+                   for value in header]
+
+        for line, row in enumerate(rows, start=2):
+            if all(value is None or str(value).strip() == '' for value in row):
+                continue
+            yield line, dict(zip(columns, row))
+    finally:
+        if workbook is not None:
+            workbook.close()
+
+
+def get_stockentryproduct_from_row(row, products):
+    """
+    Return the StockEntryProduct (not saved) described by a row of a
+    supplier invoice.
+
+    Columns are the fields of StockEntryProductForm: product (name of the
+    product), quantity, unit_quantity (unit of the product by default),
+    amount and unit_amount (PACKAGE by default).
+
+    :param row: {column name: value}, mandatory.
+    :param products: products of the shop, indexed by lowercase name.
+    :raises: ValueError with a readable message if the row is not valid.
+    """
+    name = str(row.get('product') or '').strip()
+    try:
+        product = products[name.lower()]
+    except KeyError:
+        raise ValueError('produit "' + name + '" inconnu')
+
+    unit_quantity = str(row.get('unit_quantity') or product.unit or 'UNIT').strip().upper()
+    if unit_quantity not in STOCKENTRY_IMPORT_UNITS_QUANTITY[product.unit]:
+        raise ValueError('unité de quantité "' + unit_quantity + '" invalide pour ' + product.name)
+    unit_amount = str(row.get('unit_amount') or 'PACKAGE').strip().upper()
+    if unit_amount not in STOCKENTRY_IMPORT_UNITS_AMOUNT:
+        raise ValueError('unité de montant "' + unit_amount + '" invalide')
+
+    try:
+        quantity = decimal.Decimal(str(row.get('quantity')).strip().replace(',', '.'))
+        amount = decimal.Decimal(str(row.get('amount')).strip().replace(',', '.'))
+    except decimal.InvalidOperation:
+        raise ValueError('quantité ou montant invalide')
+    if quantity <= 0 or amount < 0:
+        raise ValueError('quantité ou montant invalide')
+
+    normalized_quantity = get_normalized_quantity(product, unit_quantity, quantity)
+    if normalized_quantity != normalized_quantity.to_integral_value():
+        raise ValueError('quantité invalide')
+    price = get_normalized_price(unit_quantity, quantity, unit_amount, amount)
+
+    return StockEntryProduct(
+        product=product,
+        quantity=int(normalized_quantity),
+        price=price.quantize(decimal.Decimal('.01'))
+    )
 
 
 def get_normalized_quantity(product, form_unit_quantity, form_quantity):
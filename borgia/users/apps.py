@@ -1,5 +1,9 @@
 from django.apps import AppConfig
 
 
-class AccountsConfig(AppConfig):
-    name = 'accounts'
+class UsersConfig(AppConfig):
+    name = 'users'
+
+    def ready(self):
+        # Import users signals
+        from users.signals import invalidate_lateral_menus_on_permissions_change
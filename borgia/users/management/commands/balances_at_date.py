@@ -0,0 +1,22 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import User, get_balances_at
+
+
+class Command(BaseCommand):
+    help = 'Print the balance of every user at the end of a given day.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('date', help='YYYY-MM-DD.')
+
+    def handle(self, *args, **options):
+        try:
+            date = datetime.datetime.strptime(options['date'], '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError('Invalid date "%s", expected YYYY-MM-DD.' % options['date'])
+
+        balances = get_balances_at(date)
+        for pk, username in User.objects.order_by('username').values_list('pk', 'username'):
+            self.stdout.write('%s\t%s' % (username, balances[pk]))
@@ -0,0 +1,26 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import localdate
+
+from users.models import take_balance_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Write the balance of every user at the end of a day, used to compute past balances.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date', help='Day of the snapshot (YYYY-MM-DD), yesterday by default.')
+
+    def handle(self, *args, **options):
+        date = localdate() - datetime.timedelta(days=1)
+        if options['date']:
+            try:
+                date = datetime.datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Invalid date "%s", expected YYYY-MM-DD.' % options['date'])
+
+        count = take_balance_snapshot(date)
+        self.stdout.write(self.style.SUCCESS(
+            'Balances of %d user(s) saved for %s.' % (count, date.isoformat())))
@@ -0,0 +1,58 @@
+# Generated by Django 2.1.11 on 2026-10-17 07:09
+
+import unicodedata
+
+from django.db import migrations, models
+
+SEARCH_TEXT_FIELDS = ('username', 'first_name', 'last_name', 'surname', 'family')
+
+
+def normalize_search_text(value):
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.lower().split())
+
+
+def backfill_search_text(apps, schema_editor):
+    """
+    Compute the search text of every existing user.
+    """
+    User = apps.get_model('users', 'User')
+    for user in User.objects.only(*SEARCH_TEXT_FIELDS).iterator():
+        User.objects.filter(pk=user.pk).update(search_text=normalize_search_text(
+            ' '.join(getattr(user, field) or '' for field in SEARCH_TEXT_FIELDS)))
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Index the search text with trigrams on PostgreSQL, so that substring
+    searches do not scan the table. Other databases keep a plain scan of the
+    column.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX users_user_search_text_trgm '
+            'ON users_user USING gin (search_text gin_trgm_ops)')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS users_user_search_text_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Texte de recherche'),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,131 @@
+# Generated by Django 2.1.11 on 2026-10-17 07:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_balance_movements(apps, schema_editor):
+    """
+    Write the journal of the transactions paid before it existed.
+
+    The recipient of the payment of an event is not recorded, so only the
+    debits of the participants are written for events.
+    """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    BalanceMovement = apps.get_model('users', 'BalanceMovement')
+    Sale = apps.get_model('sales', 'Sale')
+    Recharging = apps.get_model('finances', 'Recharging')
+    Transfert = apps.get_model('finances', 'Transfert')
+    ExceptionnalMovement = apps.get_model('finances', 'ExceptionnalMovement')
+    Event = apps.get_model('events', 'Event')
+    WeightsUser = apps.get_model('events', 'WeightsUser')
+
+    def content_type(model):
+        """
+        Return the content type of the model, created only when needed so
+        that an empty database keeps the ids given by post_migrate.
+        """
+        if model not in content_types:
+            content_types[model] = ContentType.objects.get_or_create(
+                app_label=model._meta.app_label, model=model._meta.model_name)[0]
+        return content_types[model]
+
+    content_types = {}
+
+    def movements():
+        for pk, user_id, total, moment in Sale.objects.values_list(
+                'pk', 'sender_id', 'total', 'datetime').iterator():
+            yield BalanceMovement(user_id=user_id, amount=-total, kind='sale',
+                                  content_type=content_type(Sale), object_id=pk,
+                                  datetime=moment)
+
+        for solution_name in ('Cash', 'Cheque', 'Lydia'):
+            Solution = apps.get_model('finances', solution_name)
+            amounts = dict(Solution.objects.values_list('pk', 'amount'))
+            rechargings = Recharging.objects.filter(
+                content_type__app_label='finances',
+                content_type__model=solution_name.lower()).values_list(
+                    'pk', 'sender_id', 'solution_id', 'datetime')
+            for pk, user_id, solution_id, moment in rechargings.iterator():
+                if amounts.get(solution_id):
+                    yield BalanceMovement(user_id=user_id, amount=amounts[solution_id],
+                                          kind='recharging',
+                                          content_type=content_type(Recharging),
+                                          object_id=pk, datetime=moment)
+
+        transferts = Transfert.objects.exclude(sender=models.F('recipient')).filter(
+            amount__gt=0).values_list('pk', 'sender_id', 'recipient_id', 'amount', 'datetime')
+        for pk, sender_id, recipient_id, amount, moment in transferts.iterator():
+            for user_id, delta in ((sender_id, -amount), (recipient_id, amount)):
+                yield BalanceMovement(user_id=user_id, amount=delta, kind='transfert',
+                                      content_type=content_type(Transfert),
+                                      object_id=pk, datetime=moment)
+
+        exceptionnal_movements = ExceptionnalMovement.objects.filter(
+            amount__gt=0).values_list('pk', 'recipient_id', 'amount', 'is_credit', 'datetime')
+        for pk, user_id, amount, is_credit, moment in exceptionnal_movements.iterator():
+            yield BalanceMovement(user_id=user_id, amount=amount if is_credit else -amount,
+                                  kind='exceptionnalmovement',
+                                  content_type=content_type(ExceptionnalMovement),
+                                  object_id=pk, datetime=moment)
+
+        for event in Event.objects.filter(done=True, price__isnull=False).iterator():
+            weights = list(WeightsUser.objects.filter(
+                event=event, weights_participation__gt=0).values_list(
+                    'user_id', 'weights_participation'))
+            total_weights = sum(weight for _, weight in weights)
+            for user_id, weight in weights:
+                if event.payment_by_ponderation:
+                    price = event.price * weight
+                else:
+                    price = round(event.price / total_weights * weight, 2)
+                if price:
+                    yield BalanceMovement(user_id=user_id, amount=-price, kind='event',
+                                          content_type=content_type(Event), object_id=event.pk,
+                                          datetime=event.datetime)
+
+    batch = []
+    for movement in movements():
+        batch.append(movement)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            BalanceMovement.objects.bulk_create(batch)
+            batch = []
+    BalanceMovement.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('users', '0002_user_search_text'),
+        ('sales', '0005_sale_datetime_index'),
+        ('finances', '0004_recharging_datetime_index'),
+        ('events', '0002_auto_20190103_1237'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceMovement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Montant')),
+                ('kind', models.CharField(choices=[('sale', 'Achat'), ('recharging', 'Rechargement'), ('transfert', 'Transfert'), ('exceptionnalmovement', 'Mouvement exceptionnel'), ('event', 'Evénement')], max_length=31, verbose_name='Type')),
+                ('object_id', models.PositiveIntegerField()),
+                ('datetime', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_movements', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='balancemovement',
+            index=models.Index(fields=['user', 'datetime', 'id'], name='users_balancemovement_user_dt'),
+        ),
+        migrations.RunPython(backfill_balance_movements, migrations.RunPython.noop),
+    ]
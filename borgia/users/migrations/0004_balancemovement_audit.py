@@ -0,0 +1,38 @@
+# Generated by Django 2.1.11 on 2026-10-17 07:37
+
+from django.db import migrations
+
+
+def grant_audit_permission(apps, schema_editor):
+    """
+    Allow the presidents and the treasurers of an existing installation to
+    audit the balances. New installations get it from the initial fixture.
+    """
+    Group = apps.get_model('auth', 'Group')
+    groups = Group.objects.filter(name__in=['presidents', 'treasurers'])
+    if not groups.exists():
+        return
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Permission = apps.get_model('auth', 'Permission')
+    content_type = ContentType.objects.get_or_create(
+        app_label='users', model='balancemovement')[0]
+    permission = Permission.objects.get_or_create(
+        content_type=content_type, codename='audit_balancemovement',
+        defaults={'name': 'Can audit the balances'})[0]
+    for group in groups:
+        group.permissions.add(permission)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_balancemovement'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='balancemovement',
+            options={'default_permissions': (), 'permissions': (('audit_balancemovement', 'Can audit the balances'),)},
+        ),
+        migrations.RunPython(grant_audit_permission, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.1.11 on 2026-10-17 09:12
+
+from django.db import migrations
+from django.db.models import Max, Sum
+
+# Events are paid to this user, see events.views.EventFinish.
+EVENT_RECIPIENT_PK = 1
+
+
+def backfill_event_recipients(apps, schema_editor):
+    """
+    Credit the recipient of the events paid before the journal existed,
+    left out by 0003_balancemovement.
+
+    The debits and the credit of an event paid since sum to zero, so the
+    events whose movements do not are the ones completed.
+    """
+    User = apps.get_model('users', 'User')
+    BalanceMovement = apps.get_model('users', 'BalanceMovement')
+    if not User.objects.filter(pk=EVENT_RECIPIENT_PK).exists():
+        return
+
+    events = BalanceMovement.objects.filter(kind='event').order_by().values(
+        'content_type', 'object_id').annotate(
+            total=Sum('amount'), last=Max('datetime')).filter(total__lt=0)
+    BalanceMovement.objects.bulk_create([
+        BalanceMovement(user_id=EVENT_RECIPIENT_PK, amount=-event['total'], kind='event',
+                        content_type_id=event['content_type'],
+                        object_id=event['object_id'], datetime=event['last'])
+        for event in events.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_balancesnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_event_recipients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.1.11 on 2026-10-17 08:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def record_opening_balances(apps, schema_editor):
+    """
+    Record the balance of every user when the journal is installed, once.
+    """
+    User = apps.get_model('users', 'User')
+    OpeningBalance = apps.get_model('users', 'OpeningBalance')
+    moment = django.utils.timezone.now()
+    OpeningBalance.objects.bulk_create([
+        OpeningBalance(user_id=pk, balance=balance, datetime=moment)
+        for pk, balance in User.objects.values_list('pk', 'balance').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_backfill_event_recipients'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Solde')),
+                ('datetime', models.DateTimeField(verbose_name='Date')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='opening_balance', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
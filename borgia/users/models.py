@@ -1,14 +1,34 @@
+import collections
 import datetime
 import decimal
-import itertools
+import unicodedata
 
 from django.contrib.auth.models import AbstractUser
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (Case, DecimalField, F, Value, When,
+                              prefetch_related_objects)
 from django.utils import timezone
 
 from borgia.utils import (PRESIDENTS_GROUP_NAME, VICE_PRESIDENTS_GROUP_NAME, TREASURERS_GROUP_NAME,
-                          INTERNALS_GROUP_NAME, EXTERNALS_GROUP_NAME)
+                          INTERNALS_GROUP_NAME, EXTERNALS_GROUP_NAME,
+                          prefetch_generic_foreign_keys)
+
+SEARCH_TEXT_FIELDS = ('username', 'first_name', 'last_name', 'surname', 'family')
+
+SNAPSHOT_BATCH_SIZE = 1000
+
+
+def normalize_search_text(value):
+    """
+    Return the text lowercased, without accents and with single spaces, as
+    stored in User.search_text.
+    """
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.lower().split())
 
 
 class User(AbstractUser):
@@ -96,6 +116,12 @@ class User(AbstractUser):
 
     jwt_iat = models.DateTimeField('Jwt iat', default=timezone.now)
 
+    # Denormalized from SEARCH_TEXT_FIELDS on save, indexed with pg_trgm on
+    # PostgreSQL. QuerySet.update() skips it: change these fields through
+    # save().
+    search_text = models.TextField('Texte de recherche', blank=True, default='',
+                                   editable=False)
+
     class Meta:
         """
         Define Permissions for User.
@@ -138,6 +164,21 @@ class User(AbstractUser):
         else:
             return self.first_name + ' ' + self.last_name
 
+    def save(self, *args, **kwargs):
+        # search_text is computed on pre_save, fixtures included.
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(SEARCH_TEXT_FIELDS):
+            kwargs['update_fields'] = list(update_fields) + ['search_text']
+        super().save(*args, **kwargs)
+
+    def compute_search_text(self):
+        """
+        Return the normalized text searched in the lists: username, names,
+        surname and family.
+        """
+        return normalize_search_text(' '.join(
+            getattr(self, field) or '' for field in SEARCH_TEXT_FIELDS))
+
     def get_full_name(self):
         """
         Return the name displayed in the navbar
@@ -182,9 +223,9 @@ class User(AbstractUser):
         for se in events:
             solde_prev += se.get_price_of_user(self)
         self.virtual_balance = self.balance - solde_prev
-        self.save()
+        self.save(update_fields=['virtual_balance'])
 
-    def credit(self, amount):
+    def credit(self, amount, source=None):
         """
         Credit the user of a certain amount of money.
 
@@ -193,6 +234,7 @@ class User(AbstractUser):
 
         :param amount: float or integer amount of money in euro, max 2 decimal
         places, must be superior to 0
+        :param source: transaction paid, recorded in the balance journal.
         :returns: nothing
         :raise: ValueError if the amount is negative or null or if not a float
         or int
@@ -202,10 +244,9 @@ class User(AbstractUser):
         if amount <= 0:
             raise ValueError('The amount must be positive')
 
-        self.balance += amount
-        self.save()
+        apply_balance_deltas({self.pk: amount}, users=[self], source=source)
 
-    def debit(self, amount):
+    def debit(self, amount, source=None):
         """
         Debit the user of a certain amount of money.
 
@@ -214,6 +255,7 @@ class User(AbstractUser):
 
         :param amount: float or integer amount of money in euro, max 2 decimal
         places, must be superior to 0
+        :param source: transaction paid, recorded in the balance journal.
         :returns: nothing
         :raise: ValueError if the amount is negative or null or if not a float
         or int
@@ -223,32 +265,293 @@ class User(AbstractUser):
         if amount <= 0:
             raise ValueError('The amount must be strictly positive')
 
-        self.balance -= amount
-        self.save()
+        apply_balance_deltas({self.pk: -amount}, users=[self], source=source)
 
-    def list_transaction(self):
-        """
-        Return the list of sales concerning the user.
 
-        :returns: list of objects
+class BalanceMovement(models.Model):
+    """
+    Journal of the movements of the balances: one row per user credited or
+    debited, appended each time a transaction is paid.
+
+    :note:: Rows are never updated nor deleted, the history of a user is read
+    from this table only.
+
+    :param user: user whose balance moved, mandatory.
+    :param amount: signed amount added to the balance, mandatory.
+    :param kind: model name of the transaction, mandatory.
+    :param source: transaction paid (Sale, Recharging, Transfert,
+    ExceptionnalMovement or Event), mandatory.
+    :param datetime: date of the movement, mandatory.
+    """
+    KIND_CHOICES = (
+        ('sale', 'Achat'),
+        ('recharging', 'Rechargement'),
+        ('transfert', 'Transfert'),
+        ('exceptionnalmovement', 'Mouvement exceptionnel'),
+        ('event', 'Evénement'),
+    )
+
+    user = models.ForeignKey(User, related_name='balance_movements',
+                             on_delete=models.CASCADE)
+    amount = models.DecimalField('Montant', max_digits=9, decimal_places=2)
+    kind = models.CharField('Type', max_length=31, choices=KIND_CHOICES)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    source = GenericForeignKey('content_type', 'object_id')
+    datetime = models.DateTimeField('Date', default=timezone.now)
+
+    class Meta:
         """
+        Remove default permissions for BalanceMovement, and index the
+        history of a user.
 
-        sales = self.sender_sale.all()
-        transferts = self.recipient_transfert.union(
-            self.sender_transfert.all())
-        rechargings = self.sender_recharging.all()
-        exceptionnal_movements = self.recipient_exceptionnal_movement.all()
-        events = self.event_set.filter(done=True)
-        for event in events:
-            event.amount = event.get_price_of_user(self)
-
-        list_transaction = sorted(
-            list(itertools.chain(sales, transferts, rechargings,
-                                 exceptionnal_movements, events)),
-            key=lambda instance: instance.datetime, reverse=True
+        :note:: The audit of the balances is allowed by the permission
+        audit_balancemovement.
+        """
+        default_permissions = ()
+        permissions = (
+            ('audit_balancemovement', 'Can audit the balances'),
         )
+        indexes = [
+            models.Index(fields=['user', 'datetime', 'id'], name='users_balancemovement_user_dt'),
+        ]
+
+    def is_credit(self):
+        return self.amount > 0
+
+
+def apply_balance_deltas(deltas, users=None, source=None):
+    """
+    Apply several balance movements in a single UPDATE statement.
+
+    The new balance is computed by the database (balance = balance + delta),
+    so concurrent movements on the same account can't overwrite each other.
+    Only the balance column is written.
+
+    If the transaction paid is given, the movements are appended to the
+    BalanceMovement journal in the same database transaction, at the date of
+    the transaction so that the journal and the transactions agree on the
+    day of each movement.
+
+    :param deltas: signed amounts to add, indexed by user pk. Null amounts are
+    ignored.
+    :param users: User instances whose in-memory balance should be refreshed
+    once the update is done.
+    :param source: transaction paid.
+    :type deltas: dict {integer: decimal}
+    :type users: list of User objects
+    :type source: Sale, Recharging, Transfert, ExceptionnalMovement or Event
+    object
+    :returns: nothing
+    """
+    deltas = {pk: decimal.Decimal(str(delta))
+              for pk, delta in deltas.items() if delta != 0}
+    if deltas:
+        with transaction.atomic():
+            User.objects.filter(pk__in=deltas.keys()).update(
+                balance=F('balance') + Case(
+                    *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+                    default=Value(decimal.Decimal(0)),
+                    output_field=DecimalField(max_digits=9, decimal_places=2)
+                )
+            )
+            if source is not None:
+                content_type = ContentType.objects.get_for_model(source)
+                BalanceMovement.objects.bulk_create([
+                    BalanceMovement(user_id=pk, amount=delta, kind=content_type.model,
+                                    content_type=content_type, object_id=source.pk,
+                                    datetime=source.datetime)
+                    for pk, delta in deltas.items()
+                ])
+
+    for user in users or []:
+        user.refresh_from_db(fields=['balance'])
+
+
+def get_balance_history(user):
+    """
+    Return the balance movements of the user, the most recent first, with
+    their transaction.
+
+    :param user: user, mandatory.
+    :type user: User object
+    :returns: the movements, to paginate or slice, then to pass to
+    load_balance_movements_sources.
+    :rtype: BalanceMovement queryset
+    """
+    return user.balance_movements.order_by('-datetime', '-id')
+
+
+def load_balance_movements_sources(movements):
+    """
+    Load the transactions of the movements, and what is displayed with
+    them, in a constant number of queries.
+
+    :param movements: movements, mandatory.
+    :type movements: iterable of BalanceMovement objects
+    :returns: the movements
+    :rtype: list
+    """
+    movements = prefetch_generic_foreign_keys(movements, 'source')
+    sources = collections.defaultdict(list)
+    for movement in movements:
+        if movement.source is not None:
+            sources[movement.kind].append(movement.source)
+    related = {
+        'sale': ('shop', 'saleproduct_set__product'),
+        'recharging': ('sender', ),
+        'transfert': ('sender', 'recipient'),
+        'exceptionnalmovement': ('operator', ),
+    }
+    for kind, lookups in related.items():
+        if sources[kind]:
+            prefetch_related_objects(sources[kind], *lookups)
+    if sources['recharging']:
+        prefetch_generic_foreign_keys(sources['recharging'], 'content_solution')
+    return movements
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Balance of a user at the end of a day, written for all users at once by
+    take_balance_snapshot.
+
+    :param user: user, mandatory.
+    :param date: day of the snapshot, mandatory.
+    :param balance: balance at the end of the day, mandatory.
+    """
+    user = models.ForeignKey(User, related_name='balance_snapshots',
+                             on_delete=models.CASCADE)
+    date = models.DateField('Date')
+    balance = models.DecimalField('Solde', decimal_places=2, max_digits=9)
+
+    class Meta:
+        """
+        Remove default permissions for BalanceSnapshot.
+        """
+        default_permissions = ()
+        unique_together = ('date', 'user')
+
+
+class OpeningBalance(models.Model):
+    """
+    Balance of a user when the balance journal was installed, written once
+    by the migration 0007_openingbalance.
+
+    The audit of the balances can start from it instead of zero, for the
+    balances imported or changed before the journal.
+
+    :param user: user, mandatory.
+    :param balance: balance at the opening, mandatory.
+    :param datetime: date of the opening, mandatory.
+    """
+    user = models.OneToOneField(User, related_name='opening_balance',
+                                on_delete=models.CASCADE)
+    balance = models.DecimalField('Solde', decimal_places=2, max_digits=9)
+    datetime = models.DateTimeField('Date')
+
+    class Meta:
+        """
+        Remove default permissions for OpeningBalance.
+        """
+        default_permissions = ()
+
+
+def _start_of_next_day(date):
+    return timezone.make_aware(
+        datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time.min))
+
+
+def get_balances_at(date, users=None, use_snapshots=True):
+    """
+    Return the balance of the users at the end of the day, with a constant
+    number of queries.
+
+    The balance is the one of the last snapshot taken on or before the day,
+    plus the movements of the journal since the snapshot. Users without such
+    a snapshot start from their current balance, minus the movements after
+    the day.
+
+    :note:: Balances changed without recording the movement in the journal
+    are not taken into account.
+
+    :param date: day, mandatory.
+    :param users: users, all users by default.
+    :param use_snapshots: False to start from the current balances only.
+    :type date: date
+    :type users: User queryset
+    :type use_snapshots: boolean
+    :returns: balance, indexed by user pk
+    :rtype: dict {integer: decimal}
+    """
+    if users is None:
+        users = User.objects.all()
+    end = _start_of_next_day(date)
+    movements = BalanceMovement.objects.filter(user__in=users).order_by().values_list(
+        'user').annotate(total=models.Sum('amount'))
+
+    balances = {}
+    snapshot_date = None
+    if use_snapshots:
+        snapshot_date = BalanceSnapshot.objects.filter(date__lte=date).aggregate(
+            last=models.Max('date'))['last']
+    if snapshot_date is not None:
+        balances = dict(BalanceSnapshot.objects.filter(
+            date=snapshot_date, user__in=users).values_list('user', 'balance'))
+        for pk, total in movements.filter(datetime__gte=_start_of_next_day(snapshot_date),
+                                          datetime__lt=end):
+            if pk in balances:
+                balances[pk] += total
+
+    current_balances = {pk: balance for pk, balance in users.values_list('pk', 'balance')
+                        if pk not in balances}
+    if current_balances:
+        for pk, total in movements.filter(datetime__gte=end):
+            if pk in current_balances:
+                current_balances[pk] -= total
+        balances.update(current_balances)
+    return balances
+
+
+def take_balance_snapshot(date):
+    """
+    Write the balance of every user at the end of the day, replacing the
+    snapshot of this day if any.
 
-        return list_transaction
+    Balances are computed from the current balances, not from the previous
+    snapshots, so that an error in a snapshot is not carried over.
+
+    :param date: day, mandatory.
+    :type date: date
+    :returns: number of users in the snapshot.
+    :rtype: integer
+    """
+    with transaction.atomic():
+        BalanceSnapshot.objects.filter(date=date).delete()
+        snapshots = BalanceSnapshot.objects.bulk_create([
+            BalanceSnapshot(user_id=pk, date=date, balance=balance)
+            for pk, balance in get_balances_at(date, use_snapshots=False).items()
+        ], batch_size=SNAPSHOT_BATCH_SIZE)
+    return len(snapshots)
+
+
+def search_users(search):
+    """
+    Return the pks of the users matching the search, each word of the search
+    being contained in their search text.
+
+    Transactions are then filtered on their indexed foreign keys, with
+    operator__in=search_users(search) for instance.
+
+    :param search: text searched, mandatory.
+    :type search: string
+    :returns: pks of the users, evaluated by the query using them.
+    :rtype: QuerySet of integers
+    """
+    users = User.objects.all()
+    for word in normalize_search_text(search).split():
+        users = users.filter(search_text__contains=word)
+    return users.values_list('pk', flat=True)
 
 
 def get_list_year():
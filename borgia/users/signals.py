@@ -0,0 +1,30 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from borgia.utils import invalidate_lateral_menus_permissions
+from users.models import User
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_lateral_menus_on_permissions_change(**kwargs):
+    """
+    Lateral menus depend on the groups and permissions of the user.
+    """
+    invalidate_lateral_menus_permissions()
+
+
+@receiver(pre_save, sender=User)
+def update_search_text(instance, **kwargs):
+    """
+    Keep the denormalized search text of the user up to date.
+
+    Not called by QuerySet.update(), which must not change the fields of
+    SEARCH_TEXT_FIELDS.
+    """
+    instance.search_text = instance.compute_search_text()
@@ -3,7 +3,7 @@ from django.template.defaultfilters import stringfilter
 from django.conf import settings
 
 from borgia.utils import group_name_display
-from configurations.utils import configuration_get
+from configurations.utils import configuration_get_value
 
 register = template.Library()
 
@@ -72,7 +72,7 @@ def order_by(attr, request):
 
 @register.simple_tag
 def get_center_name():
-    return configuration_get('CENTER_NAME').get_value()
+    return configuration_get_value('CENTER_NAME')
 
 @register.simple_tag
 def set_default_template():
@@ -1,6 +1,25 @@
+import datetime
+import decimal
+import io
+from importlib import import_module
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import make_aware
+
+from events.models import Event
+from finances.models import (Cash, ExceptionnalMovement, Recharging,
+                             Transfert)
 
-from users.models import User, get_list_year
+from users.models import (BalanceMovement, BalanceSnapshot, User,
+                          apply_balance_deltas, get_balance_history,
+                          get_balances_at, get_list_year,
+                          load_balance_movements_sources, search_users,
+                          take_balance_snapshot)
+from users.templatetags.users_extra import get_transaction_label
 
 
 class UserTest(TestCase):
@@ -73,6 +92,33 @@ class UserTest(TestCase):
         self.user_all_fields.debit(20)
         self.assertEqual(self.user_all_fields.balance, initial_balance - 20)
 
+    def test_concurrent_movements(self):
+        # Two terminals holding their own copy of the same account
+        initial_balance = self.user_all_fields.balance
+        terminal1 = User.objects.get(pk=self.user_all_fields.pk)
+        terminal2 = User.objects.get(pk=self.user_all_fields.pk)
+
+        for _ in range(10):
+            terminal1.debit(2)
+            terminal2.debit(3)
+        terminal2.credit(7)
+
+        self.user_all_fields.refresh_from_db()
+        self.assertEqual(self.user_all_fields.balance, initial_balance - 50 + 7)
+        self.assertEqual(terminal2.balance, initial_balance - 50 + 7)
+
+    def test_apply_balance_deltas(self):
+        apply_balance_deltas({
+            self.user_all_fields.pk: decimal.Decimal('-12.5'),
+            self.user_only_username.pk: decimal.Decimal('12.5'),
+            self.user_with_first_name.pk: 0
+        }, users=[self.user_all_fields])
+
+        self.assertEqual(self.user_all_fields.balance, decimal.Decimal('87.5'))
+        self.assertEqual(User.objects.get(pk=self.user_only_username.pk).balance,
+                         decimal.Decimal('12.5'))
+        self.assertEqual(User.objects.get(pk=self.user_with_first_name.pk).balance, 0)
+
     # def test_list_transaction(self):
     #     user1 = User.objects.create(username='other1')
     #     user2 = User.objects.create(username='other2')
@@ -112,6 +158,192 @@ class UserTest(TestCase):
     #                           [s1, s2, s4, s6])
 
 
+class SearchUsersTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(
+            username='AE1', first_name='Hélène', last_name='Dupont',
+            surname='Bucque', family='12-34')
+        self.user2 = User.objects.create(
+            username='AE2', first_name='Jean', last_name='Dupont')
+
+    def search(self, search):
+        return set(search_users(search))
+
+    def test_search_text(self):
+        self.assertEqual(self.user1.search_text, 'ae1 helene dupont bucque 12-34')
+        self.assertEqual(self.user2.search_text, 'ae2 jean dupont')
+
+    def test_update_fields(self):
+        self.user2.surname = 'Bucque2'
+        self.user2.save(update_fields=['surname'])
+        self.assertEqual(User.objects.get(pk=self.user2.pk).search_text,
+                         'ae2 jean dupont bucque2')
+
+    def test_search_users(self):
+        self.assertEqual(self.search('dupont'), {self.user1.pk, self.user2.pk})
+        self.assertEqual(self.search('HELENE'), {self.user1.pk})
+        self.assertEqual(self.search('hélène dup'), {self.user1.pk})
+        self.assertEqual(self.search('jean bucque'), set())
+
+
+class BalanceMovementTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1')
+        self.user2 = User.objects.create(username='user2')
+
+    def add_transactions(self):
+        cash = Cash.objects.create(sender=self.user1, amount=10)
+        recharging = Recharging.objects.create(
+            sender=self.user1, operator=self.user2, content_solution=cash)
+        recharging.pay()
+        transfert = Transfert.objects.create(
+            sender=self.user1, recipient=self.user2, amount=3, justification='test')
+        transfert.pay()
+        movement = ExceptionnalMovement.objects.create(
+            operator=self.user2, recipient=self.user1, amount=2,
+            is_credit=False, justification='test')
+        movement.pay()
+        return [recharging, transfert, movement]
+
+    def test_written_on_pay(self):
+        recharging, transfert, movement = self.add_transactions()
+        self.assertListEqual(
+            [(m.kind, m.amount, m.source) for m in get_balance_history(self.user1)],
+            [('exceptionnalmovement', decimal.Decimal('-2.00'), movement),
+             ('transfert', decimal.Decimal('-3.00'), transfert),
+             ('recharging', decimal.Decimal('10.00'), recharging)])
+        self.assertListEqual(
+            [(m.kind, m.amount) for m in get_balance_history(self.user2)],
+            [('transfert', decimal.Decimal('3.00'))])
+
+    def test_dated_as_source(self):
+        for source in self.add_transactions():
+            self.assertSetEqual(set(BalanceMovement.objects.filter(
+                kind=source._meta.model_name, object_id=source.pk).values_list(
+                    'datetime', flat=True)), {source.datetime})
+
+    def test_sum_is_balance(self):
+        self.add_transactions()
+        self.add_transactions()
+        for user in (self.user1, self.user2):
+            user.refresh_from_db()
+            self.assertEqual(
+                sum(m.amount for m in user.balance_movements.all()), user.balance)
+
+    def test_without_source(self):
+        apply_balance_deltas({self.user1.pk: 5})
+        self.assertFalse(BalanceMovement.objects.filter(user=self.user1).exists())
+
+    def test_backfill_event_recipients(self):
+        migration = import_module('users.migrations.0006_backfill_event_recipients')
+        recipient = User.objects.get_or_create(
+            pk=migration.EVENT_RECIPIENT_PK, defaults={'username': 'AE_ENSAM'})[0]
+        # Paid before the journal, only the debits were backfilled.
+        event1 = Event.objects.create(description='event1', manager=self.user1, done=True)
+        apply_balance_deltas({self.user2.pk: -4}, source=event1)
+        event2 = Event.objects.create(description='event2', manager=self.user1, done=True)
+        apply_balance_deltas({self.user2.pk: -3, recipient.pk: 3}, source=event2)
+
+        migration.backfill_event_recipients(apps, None)
+        self.assertListEqual(
+            list(BalanceMovement.objects.filter(user=recipient, kind='event').order_by(
+                'object_id').values_list('object_id', 'amount')),
+            [(event1.pk, decimal.Decimal('4.00')), (event2.pk, decimal.Decimal('3.00'))])
+
+    def test_load_sources_constant_queries(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                for movement in load_balance_movements_sources(
+                        get_balance_history(self.user1)):
+                    get_transaction_label(movement.source)
+            return len(queries)
+
+        self.add_transactions()
+        count = count_queries()
+        for i in range(3):
+            self.add_transactions()
+        self.assertEqual(count_queries(), count)
+
+
+class BalanceSnapshotTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1', balance=10)
+        self.user2 = User.objects.create(username='user2')
+        self.day1 = datetime.date(2019, 8, 30)
+        self.day2 = datetime.date(2019, 8, 31)
+        self.day3 = datetime.date(2019, 9, 1)
+        self.move(self.user1, 5, self.day1)
+        self.move(self.user2, 3, self.day2)
+        self.move(self.user1, -2, self.day3)
+
+    def move(self, user, amount, date):
+        movement = ExceptionnalMovement.objects.create(
+            operator=self.user2, recipient=user, amount=abs(amount),
+            is_credit=amount > 0, justification='test')
+        movement.pay()
+        BalanceMovement.objects.filter(kind='exceptionnalmovement', object_id=movement.pk).update(
+            datetime=make_aware(datetime.datetime.combine(date, datetime.time(23, 30))))
+
+    def get_balances_at(self, date):
+        balances = get_balances_at(date, User.objects.filter(
+            pk__in=[self.user1.pk, self.user2.pk]))
+        return balances[self.user1.pk], balances[self.user2.pk]
+
+    def test_without_snapshot(self):
+        self.assertEqual(self.get_balances_at(self.day1 - datetime.timedelta(days=1)), (10, 0))
+        self.assertEqual(self.get_balances_at(self.day1), (15, 0))
+        self.assertEqual(self.get_balances_at(self.day2), (15, 3))
+        self.assertEqual(self.get_balances_at(self.day3), (13, 3))
+
+    def test_with_snapshot(self):
+        self.assertEqual(take_balance_snapshot(self.day1), User.objects.count())
+        self.assertEqual(BalanceSnapshot.objects.get(user=self.user1, date=self.day1).balance, 15)
+        self.assertEqual(self.get_balances_at(self.day3), (13, 3))
+
+        # Later balances are computed from the snapshot.
+        BalanceSnapshot.objects.filter(user=self.user1).update(balance=20)
+        self.assertEqual(self.get_balances_at(self.day1 - datetime.timedelta(days=1)), (10, 0))
+        self.assertEqual(self.get_balances_at(self.day2), (20, 3))
+        self.assertEqual(self.get_balances_at(self.day3), (18, 3))
+
+    def test_snapshot_from_current_balances(self):
+        take_balance_snapshot(self.day1)
+        BalanceSnapshot.objects.filter(user=self.user1).update(balance=20)
+        take_balance_snapshot(self.day2)
+        self.assertEqual(BalanceSnapshot.objects.get(user=self.user1, date=self.day2).balance, 15)
+
+    def test_snapshot_replaced(self):
+        take_balance_snapshot(self.day2)
+        BalanceSnapshot.objects.filter(user=self.user1).update(balance=20)
+        take_balance_snapshot(self.day2)
+        self.assertEqual(BalanceSnapshot.objects.get(user=self.user1, date=self.day2).balance, 15)
+
+    def test_constant_queries(self):
+        take_balance_snapshot(self.day1)
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                get_balances_at(self.day3)
+            return len(queries)
+
+        # Users created after the snapshot start from their current balance.
+        User.objects.create(username='new')
+        count = count_queries()
+        for i in range(5):
+            user = User.objects.create(username='other%d' % i)
+            self.move(user, 1, self.day2)
+            self.move(self.user1, 1, self.day2)
+        self.assertEqual(count_queries(), count)
+
+    def test_commands(self):
+        out = io.StringIO()
+        call_command('snapshot_balances', '--date', '2019-08-31', stdout=out)
+        self.assertEqual(BalanceSnapshot.objects.get(user=self.user2, date=self.day2).balance, 3)
+        call_command('balances_at_date', '2019-08-30', stdout=out)
+        self.assertIn('user1\t15.00', out.getvalue())
+        self.assertIn('user2\t0', out.getvalue())
+
+
 class ListYearTest(TestCase):
     """
     Be careful : user1 is ignored (in the current BDD, user1 is the admin)
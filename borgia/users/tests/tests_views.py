@@ -1,5 +1,8 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client
 from django.urls import reverse
+from openpyxl import Workbook
+from openpyxl.writer.excel import save_virtual_workbook
 
 from borgia.tests.utils import get_login_url_redirected
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
@@ -203,3 +206,19 @@ class UpdateGroupViewTestCase(BaseBorgiaViewsTestCase):
             self.get_url(1))
         self.assertEqual(response_offline_user.status_code, 302)
         self.assertRedirects(response_offline_user, get_login_url_redirected(self.get_url(1)))
+
+
+class UserUploadXlsxViewTestCase(BaseGeneralUserViewsTestCase):
+    url_view = 'url_add_by_list_xlsx'
+
+    def test_post_updates_search_text(self):
+        workbook = Workbook()
+        workbook.active.append(['username', 'last_name'])
+        workbook.active.append([self.user2.username, 'Nouveaunom'])
+        self.client1.post(self.get_url(), {
+            'list_user': SimpleUploadedFile('users.xlsx', save_virtual_workbook(workbook)),
+            'xlsx_columns': ['last_name']
+        })
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.last_name, 'Nouveaunom')
+        self.assertIn('nouveaunom', self.user2.search_text)
@@ -11,7 +11,6 @@ from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
 from django.contrib.auth.models import Group, Permission
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
-from django.db.models import Q
 from django.http import Http404, HttpResponseBadRequest
 from django.shortcuts import HttpResponse, redirect, render
 from django.urls import reverse
@@ -20,11 +19,12 @@ from django.utils.encoding import force_text
 from borgia.utils import (get_members_group, human_unused_permissions,
                           get_permission_name_group_managing)
 from borgia.views import BorgiaFormView, BorgiaView
-from configurations.utils import configuration_get
+from configurations.utils import configuration_get_value
 from users.forms import (GroupUpdateForm, UserCreationCustomForm, UserDownloadXlsxForm,
                          UserSearchForm, UserUpdateForm, UserUploadXlsxForm)
 from users.mixins import GroupMixin, UserMixin
-from users.models import User
+from users.models import (User, get_balance_history,
+                          load_balance_movements_sources, search_users)
 
 
 class UserListView(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
@@ -82,12 +82,7 @@ class UserListView(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
 
     def form_query(self, query):
         if self.search:
-            query = query.filter(
-                Q(last_name__icontains=self.search)
-                | Q(first_name__icontains=self.search)
-                | Q(surname__icontains=self.search)
-                | Q(username__icontains=self.search)
-            )
+            query = query.filter(pk__in=search_users(self.search))
 
         if self.year and self.year != 'all':
             query = query.filter(
@@ -100,8 +95,8 @@ class UserListView(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
             if self.state == 'negative_balance':
                 query = query.filter(balance__lt=0.0, is_active=True)
             elif self.state == 'threshold':
-                threshold = configuration_get(
-                    'BALANCE_THRESHOLD_PURCHASE').get_value()
+                threshold = configuration_get_value(
+                    'BALANCE_THRESHOLD_PURCHASE')
                 query = query.filter(balance__lt=threshold, is_active=True)
             elif self.state == 'unactive':
                 query = query.filter(is_active=False)
@@ -202,6 +197,13 @@ class UserRetrieveView(UserMixin, BorgiaView):
         context = self.get_context_data(**kwargs)
         return render(request, self.template_name, context=context)
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.request.user.has_perm('users.advanced_view_user'):
+            context['movement_list'] = load_balance_movements_sources(
+                get_balance_history(self.user)[:25])
+        return context
+
 
 class UserUpdateView(UserMixin, BorgiaFormView):
     """
@@ -455,21 +457,21 @@ class UserUploadXlsxView(LoginRequiredMixin, PermissionRequiredMixin, BorgiaForm
         columns = form.cleaned_data['xlsx_columns']
         # Setting column numbers
         for col in range(min_col, max_col+1):
-            if sheet.cell(None, sheet.min_row, col).value == 'username':
+            if sheet.cell(sheet.min_row, col).value == 'username':
                 col_username = col - min_row
-            elif sheet.cell(None, sheet.min_row, col).value == 'first_name':
+            elif sheet.cell(sheet.min_row, col).value == 'first_name':
                 col_first_name = col - min_row
-            elif sheet.cell(None, sheet.min_row, col).value == 'last_name':
+            elif sheet.cell(sheet.min_row, col).value == 'last_name':
                 col_last_name = col - min_row
-            elif sheet.cell(None, sheet.min_row, col).value == 'email':
+            elif sheet.cell(sheet.min_row, col).value == 'email':
                 col_email = col - min_row
-            elif sheet.cell(None, sheet.min_row, col).value == 'surname':
+            elif sheet.cell(sheet.min_row, col).value == 'surname':
                 col_surname = col - min_row
-            elif sheet.cell(None, sheet.min_row, col).value == 'family':
+            elif sheet.cell(sheet.min_row, col).value == 'family':
                 col_family = col - min_row
-            elif sheet.cell(None, sheet.min_row, col).value == 'campus':
+            elif sheet.cell(sheet.min_row, col).value == 'campus':
                 col_campus = col - min_row
-            elif sheet.cell(None, sheet.min_row, col).value == 'year':
+            elif sheet.cell(sheet.min_row, col).value == 'year':
                 col_year = col - min_row
 
         for _ in range(min_row):
@@ -545,14 +547,16 @@ class UserUploadXlsxView(LoginRequiredMixin, PermissionRequiredMixin, BorgiaForm
 
                 if not skipped_row:
                     username = user_dict['username']
-                    if User.objects.filter(username=username).count() > 0:
-                        User.objects.filter(
-                            username=username).update(**user_dict)
+                    # Saved through the instance, search_text is computed on
+                    # pre_save.
+                    user = User.objects.filter(username=username).first()
+                    if user is not None:
+                        for field, value in user_dict.items():
+                            setattr(user, field, value)
                     else:
-                        user = User.objects.create(**user_dict)
+                        user = User(**user_dict)
                         user.set_password(''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits)
                                                   for _ in range(20)))
-                    user = User.objects.get(username=username)
                     user.save()
 
                     user.groups.add(get_members_group())
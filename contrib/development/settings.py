@@ -92,6 +92,16 @@ DATABASES = {
     }
 }
 
+# Cache
+# The memory cache is only valid with a single process (runserver). Any
+# deployment with several processes needs a shared cache, see
+# contrib/production/settings.py.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Password validation
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend'
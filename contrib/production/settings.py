@@ -96,6 +96,20 @@ DATABASES = {
     }
 }
 
+# Cache
+# REQUIRED: a cache shared by all the processes (uWSGI workers). Product
+# prices, module catalogs, lateral menus and configurations are cached, and
+# invalidated through version keys stored in this cache: with the default
+# per-process memory cache, other workers would keep stale values.
+# Create the table with `python manage.py createcachetable`, or use a
+# memcached / Redis backend instead.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'borgia_cache',
+    }
+}
+
 # Password validation
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend'